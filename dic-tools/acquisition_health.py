@@ -0,0 +1,149 @@
+"""
+Per-camera acquisition health: dropped frames, incomplete frames and stream statistics.
+
+``AcquisitionHealth.observe`` is called with every image a camera hands over. Frame IDs increase by one per
+exposure, so any gap between consecutive IDs is a frame lost somewhere between the sensor and the application.
+Incomplete images are counted by their status code, and the transport layer's own counters are sampled from the
+TL stream nodemap. ``sample`` is meant to run about once a second; it logs the drop rate over the last interval,
+which lets a recording at a given frame rate be shown lossless or the lossy stage be identified.
+"""
+import threading
+import time
+from collections import Counter
+import PySpin
+from loguru import logger
+
+STREAM_STATISTICS = ('StreamTotalBufferCount', 'StreamFailedBufferCount', 'StreamBufferUnderrunCount',
+                     'StreamLostFrameCount', 'StreamDroppedFrameCount')
+
+
+class AcquisitionHealth:
+    """
+    Tracks frame drops for one camera.
+
+    :param name: Label used in logs, e.g. the serial number.
+    :param nodes: Node cache of the camera used to read stream statistics, or None to skip them.
+    :type nodes: acquistion.CameraNodes or None
+    """
+
+    def __init__(self, name, nodes=None):
+        self.name = name
+        self.nodes = nodes
+        self.reset()
+
+    def reset(self):
+        self.frames = 0
+        self.dropped = 0
+        self.duplicates = 0
+        self.incomplete = Counter()
+        self.last_frame_id = None
+        self.stream_statistics = {}
+        self._last_sample = (time.monotonic(), 0, 0)
+        self.drop_rate = 0.0
+
+    def observe(self, image_result):
+        """
+        Accounts for one image returned by ``GetNextImage``.
+
+        :return: False if the image is incomplete or a repeat of the previous frame, True otherwise.
+        :rtype: bool
+        """
+        if image_result.IsIncomplete():
+            self.incomplete[image_result.GetImageStatus()] += 1
+            return False
+        return self.observe_frame_id(image_result.GetFrameID())
+
+    def observe_frame_id(self, frame_id):
+        """Accounts for a complete frame by its ID; see ``observe``."""
+        if self.last_frame_id is not None:
+            if frame_id == self.last_frame_id:
+                self.duplicates += 1
+                return False
+            if frame_id > self.last_frame_id + 1:
+                self.dropped += frame_id - self.last_frame_id - 1
+        self.last_frame_id = frame_id
+        self.frames += 1
+        return True
+
+    @property
+    def lost(self):
+        """Frames dropped in transit or delivered incomplete."""
+        return self.dropped + sum(self.incomplete.values())
+
+    def read_stream_statistics(self):
+        """Reads the transport layer counters that the camera's stream nodemap provides."""
+        if self.nodes is None:
+            return self.stream_statistics
+        from acquistion import STREAM_NODEMAP
+        for name in STREAM_STATISTICS:
+            node = self.nodes.integer(name, STREAM_NODEMAP, writable=False)
+            if node is not None:
+                try:
+                    self.stream_statistics[name] = node.GetValue()
+                except PySpin.SpinnakerException:
+                    pass
+        return self.stream_statistics
+
+    def sample(self):
+        """
+        Updates the stream statistics and the drop rate since the previous sample and logs them.
+
+        :return: Frames lost per second since the previous sample.
+        :rtype: float
+        """
+        now = time.monotonic()
+        last_time, last_frames, last_lost = self._last_sample
+        lost = self.lost
+        elapsed = now - last_time
+        self.drop_rate = (lost - last_lost) / elapsed if elapsed > 0 else 0.0
+        fps = (self.frames - last_frames) / elapsed if elapsed > 0 else 0.0
+        self._last_sample = (now, self.frames, lost)
+        self.read_stream_statistics()
+        message = '%s: %.1f fps, %.1f lost/s, %s' % (self.name, fps, self.drop_rate, self.summary())
+        if lost > last_lost:
+            logger.warning(message)
+        else:
+            logger.debug(message)
+        return self.drop_rate
+
+    def summary(self):
+        """
+        :return: All counters, suitable for logging or a JSON report.
+        :rtype: dict
+        """
+        return {'frames': self.frames, 'dropped': self.dropped, 'duplicates': self.duplicates,
+                'incomplete': dict(self.incomplete), 'stream': dict(self.stream_statistics)}
+
+    def is_lossless(self):
+        return self.lost == 0 and not any(self.stream_statistics.get(name, 0) for name in STREAM_STATISTICS[1:])
+
+
+class HealthMonitor(threading.Thread):
+    """
+    Samples a set of ``AcquisitionHealth`` trackers every ``interval`` seconds until stopped.
+
+    :param trackers: One tracker per camera.
+    :type trackers: list of AcquisitionHealth
+    """
+
+    def __init__(self, trackers, interval=1.0):
+        super(HealthMonitor, self).__init__(name='health-monitor', daemon=True)
+        self.trackers = trackers
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            for tracker in self.trackers:
+                tracker.sample()
+
+    def stop(self):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        for tracker in self.trackers:
+            tracker.sample()
+            if tracker.is_lossless():
+                logger.info(f'{tracker.name}: lossless, {tracker.summary()}')
+            else:
+                logger.warning(f'{tracker.name}: frames lost, {tracker.summary()}')
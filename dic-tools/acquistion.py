@@ -24,17 +24,132 @@
 
 import os
 os.environ['KMP_DUPLICATE_LIB_OK'] = 'True'
+if __name__ == '__main__':
+    # run as a script, DIC_TOOLS_SIMULATE acquires from simulated cameras; see simulated_pyspin
+    import simulated_pyspin
+    simulated_pyspin.install_if_requested()
 import PySpin
 import sys
 from datetime import datetime as dt
 import os
-import contextlib
+import time
 from pathlib import Path
 from loguru import logger
 from collections import namedtuple
+import grab_engine
+import trigger_dispatch
+import acquisition_health
+import image_writer
+import raw_capture
+import burst_buffer
+import camera_startup
+import shared_memory_acquisition
+import stereo_sequence
+import instrumentation
+import numpy as np
+
+
+DEVICE_NODEMAP = 'device'
+STREAM_NODEMAP = 'stream'
+TL_DEVICE_NODEMAP = 'tl_device'
+
+
+class CameraNodes:
+    """
+    Resolves a camera's GenICam nodes once and caches the typed handles.
+
+    Only the lookup by name is cached. Whether a node is available and readable or writable is checked on every
+    call, because that changes with other nodes: ``ExposureTime`` once ``ExposureAuto`` is off, ``Width`` while the
+    camera is streaming, ``LineSource`` with ``LineSelector``. Every accessor returns None if the node cannot be used
+    as requested right now. Call ``invalidate`` whenever the camera is re-initialized.
+
+    :param cam: Camera whose nodes are accessed.
+    :type cam: CameraPtr
+    """
+
+    def __init__(self, cam):
+        self.cam = cam
+        self._handles = {}
+        self._entry_values = {}
+
+    def _nodemap(self, nodemap):
+        if nodemap == STREAM_NODEMAP:
+            return self.cam.GetTLStreamNodeMap()
+        if nodemap == TL_DEVICE_NODEMAP:
+            return self.cam.GetTLDeviceNodeMap()
+        return self.cam.GetNodeMap()
+
+    def _node(self, pointer_type, name, nodemap, writable):
+        key = (pointer_type, name, nodemap)
+        node = self._handles.get(key)
+        if node is None:
+            node = self._handles[key] = pointer_type(self._nodemap(nodemap).GetNode(name))
+        usable = PySpin.IsAvailable(node) and (PySpin.IsWritable(node) if writable else PySpin.IsReadable(node))
+        return node if usable else None
+
+    def enumeration(self, name, nodemap=DEVICE_NODEMAP, writable=True):
+        return self._node(PySpin.CEnumerationPtr, name, nodemap, writable)
+
+    def command(self, name, nodemap=DEVICE_NODEMAP):
+        return self._node(PySpin.CCommandPtr, name, nodemap, True)
+
+    def integer(self, name, nodemap=DEVICE_NODEMAP, writable=True):
+        return self._node(PySpin.CIntegerPtr, name, nodemap, writable)
+
+    def float(self, name, nodemap=DEVICE_NODEMAP, writable=True):
+        return self._node(PySpin.CFloatPtr, name, nodemap, writable)
+
+    def boolean(self, name, nodemap=DEVICE_NODEMAP, writable=True):
+        return self._node(PySpin.CBooleanPtr, name, nodemap, writable)
+
+    def string(self, name, nodemap=DEVICE_NODEMAP):
+        return self._node(PySpin.CStringPtr, name, nodemap, False)
+
+    def entry_value(self, name, entry_name, nodemap=DEVICE_NODEMAP):
+        """
+        :return: Integer value of entry ``entry_name`` of enumeration ``name``, or None if it is not readable.
+        :rtype: int or None
+        """
+        key = (name, entry_name, nodemap)
+        if key not in self._entry_values:
+            node = self.enumeration(name, nodemap, writable=False)
+            entry = node.GetEntryByName(entry_name) if node is not None else None
+            if entry is None or not PySpin.IsAvailable(entry) or not PySpin.IsReadable(entry):
+                # not cached, the entry may become available later
+                return None
+            self._entry_values[key] = entry.GetValue()
+        return self._entry_values[key]
+
+    def invalidate(self):
+        """Forgets every cached handle; they are resolved again on next use."""
+        self._handles.clear()
+        self._entry_values.clear()
+
+
+_camera_nodes = {}
+
+
+def camera_nodes(cam):
+    """
+    Returns the shared node cache of a camera.
+
+    :param cam: Camera to look up.
+    :type cam: CameraPtr
+    :rtype: CameraNodes
+    """
+    key = cam.GetUniqueID()
+    nodes = _camera_nodes.get(key)
+    if nodes is None:
+        nodes = _camera_nodes[key] = CameraNodes(cam)
+    return nodes
 
 
-def configure_trigger(cam):
+def invalidate_camera_nodes(cam):
+    """Drops the cached node handles of a camera; call after (re)initializing it."""
+    _camera_nodes.pop(cam.GetUniqueID(), None)
+
+
+def configure_trigger(cam, trigger=None, source=None, activation=None):
     """
     This function configures the camera to use a trigger. First, trigger mode is
     set to off in order to select the trigger source. Once the trigger source
@@ -43,85 +158,111 @@ def configure_trigger(cam):
 
      :param cam: Camera to configure trigger for.
      :type cam: CameraPtr
+     :param trigger: One of ``triggers``; defaults to ``selected_trigger``.
+     :type trigger: int or None
+     :param source: Trigger source of a hardware trigger; defaults to ``Line0``, or ``Counter0End`` for the counter
+        trigger.
+     :type source: str or None
+     :param activation: Edge the hardware trigger fires on, e.g. ``'FallingEdge'``; None leaves it as it is.
+     :type activation: str or None
      :return: True if successful, False otherwise.
      :rtype: bool
     """
     result = True
+    trigger = selected_trigger if trigger is None else trigger
 
     logger.info('*** CONFIGURING TRIGGER ***\n')
-    if selected_trigger == triggers.software:
+    if trigger == triggers.software:
         logger.info('Software trigger chosen ...')
-    elif selected_trigger == triggers.hardware:
+    elif trigger == triggers.hardware:
         logger.info('Hardware trigger chose ...')
+    elif trigger == triggers.counter:
+        logger.info('Counter trigger chosen ...')
     try:
+        nodes = camera_nodes(cam)
         # Ensure trigger mode off
         # The trigger must be disabled in order to configure whether the source
         # is software or hardware.
-        nodemap = cam.GetNodeMap()
-        node_trigger_mode = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerMode'))
-        if not PySpin.IsAvailable(node_trigger_mode) or not PySpin.IsReadable(node_trigger_mode):
+        node_trigger_mode = nodes.enumeration('TriggerMode', writable=False)
+        if node_trigger_mode is None:
             logger.error('Unable to disable trigger mode (node retrieval). Aborting...')
             return False
 
-        node_trigger_mode_off = node_trigger_mode.GetEntryByName('Off')
-        if not PySpin.IsAvailable(node_trigger_mode_off) or not PySpin.IsReadable(node_trigger_mode_off):
+        trigger_mode_off = nodes.entry_value('TriggerMode', 'Off')
+        if trigger_mode_off is None:
             logger.error('Unable to disable trigger mode (enum entry retrieval). Aborting...')
             return False
-        node_trigger_mode.SetIntValue(node_trigger_mode_off.GetValue())
+        node_trigger_mode.SetIntValue(trigger_mode_off)
         logger.info('Trigger mode disabled...')
 
         # Set TriggerSelector to FrameStart
         # For this example, the trigger selector should be set to frame start.
         # This is the default for most cameras.
-        node_trigger_selector = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerSelector'))
-        if not PySpin.IsAvailable(node_trigger_selector) or not PySpin.IsWritable(node_trigger_selector):
+        node_trigger_selector = nodes.enumeration('TriggerSelector')
+        if node_trigger_selector is None:
             logger.error('Unable to get trigger selector (node retrieval). Aborting...')
             return False
 
-        node_trigger_selector_framestart = node_trigger_selector.GetEntryByName('FrameStart')
-        if not PySpin.IsAvailable(node_trigger_selector_framestart) or not PySpin.IsReadable(
-                node_trigger_selector_framestart):
+        trigger_selector_framestart = nodes.entry_value('TriggerSelector', 'FrameStart')
+        if trigger_selector_framestart is None:
             logger.error('Unable to set trigger selector (enum entry retrieval). Aborting...')
             return False
-        node_trigger_selector.SetIntValue(node_trigger_selector_framestart.GetValue())
+        node_trigger_selector.SetIntValue(trigger_selector_framestart)
 
         logger.info('Trigger selector set to frame start...')
 
         # Select trigger source
         # The trigger source must be set to hardware or software while trigger
         # mode is off.
-        node_trigger_source = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerSource'))
-        if not PySpin.IsAvailable(node_trigger_source) or not PySpin.IsWritable(node_trigger_source):
+        node_trigger_source = nodes.enumeration('TriggerSource')
+        if node_trigger_source is None:
             logger.error('Unable to get trigger source (node retrieval). Aborting...')
             return False
 
-        if selected_trigger == triggers.software:
-            node_trigger_source_software = node_trigger_source.GetEntryByName('Software')
-            if not PySpin.IsAvailable(node_trigger_source_software) or not PySpin.IsReadable(
-                    node_trigger_source_software):
+        if trigger == triggers.software:
+            trigger_source_software = nodes.entry_value('TriggerSource', 'Software')
+            if trigger_source_software is None:
                 logger.error('Unable to set trigger source (enum entry retrieval). Aborting...')
                 return False
-            node_trigger_source.SetIntValue(node_trigger_source_software.GetValue())
+            node_trigger_source.SetIntValue(trigger_source_software)
             logger.info('Trigger source set to software...')
 
-        elif selected_trigger == triggers.hardware:
-            node_trigger_source_hardware = node_trigger_source.GetEntryByName('Line0')
-            if not PySpin.IsAvailable(node_trigger_source_hardware) or not PySpin.IsReadable(
-                    node_trigger_source_hardware):
+        else:
+            if source is None:
+                source = 'Counter0End' if trigger == triggers.counter else 'Line0'
+            trigger_source_hardware = nodes.entry_value('TriggerSource', source)
+            if trigger_source_hardware is None:
                 logger.error('Unable to set trigger source (enum entry retrieval). Aborting...')
                 return False
-            node_trigger_source.SetIntValue(node_trigger_source_hardware.GetValue())
-            logger.info('Trigger source set to hardware...')
+            node_trigger_source.SetIntValue(trigger_source_hardware)
+            logger.info('Trigger source set to %s...' % source)
+
+            if activation is not None:
+                node_trigger_activation = nodes.enumeration('TriggerActivation')
+                trigger_activation = nodes.entry_value('TriggerActivation', activation)
+                if node_trigger_activation is None or trigger_activation is None:
+                    logger.error('Unable to set trigger activation. Aborting...')
+                    return False
+                node_trigger_activation.SetIntValue(trigger_activation)
+                logger.info('Trigger activation set to %s...' % activation)
+
+            # Let the next trigger start an exposure while the last frame is
+            # still being read out; paced triggers would otherwise be missed
+            # at rates close to the maximum frame rate.
+            node_trigger_overlap = nodes.enumeration('TriggerOverlap')
+            trigger_overlap_readout = nodes.entry_value('TriggerOverlap', 'ReadOut')
+            if node_trigger_overlap is not None and trigger_overlap_readout is not None:
+                node_trigger_overlap.SetIntValue(trigger_overlap_readout)
 
         # Turn trigger mode on
         # Once the appropriate trigger source has been set, turn trigger mode
         # on in order to retrieve images using the trigger.
-        node_trigger_mode_on = node_trigger_mode.GetEntryByName('On')
-        if not PySpin.IsAvailable(node_trigger_mode_on) or not PySpin.IsReadable(node_trigger_mode_on):
+        trigger_mode_on = nodes.entry_value('TriggerMode', 'On')
+        if trigger_mode_on is None:
             logger.error('Unable to enable trigger mode (enum entry retrieval). Aborting...')
             return False
 
-        node_trigger_mode.SetIntValue(node_trigger_mode_on.GetValue())
+        node_trigger_mode.SetIntValue(trigger_mode_on)
         logger.info('Trigger mode turned back on...')
 
     except PySpin.SpinnakerException as ex:
@@ -131,12 +272,12 @@ def configure_trigger(cam):
     return result
 
 
-def execute_trigger(nodemap):
+def execute_trigger(nodes):
     """
     This function acquires an image by executing the trigger node.
 
-    :param nodemap: Device nodemap.
-    :type nodemap: INodeMap
+    :param nodes: Node cache of the camera to trigger.
+    :type nodes: CameraNodes
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -151,8 +292,10 @@ def execute_trigger(nodemap):
 
         if selected_trigger == triggers.software:
             # Execute software trigger
-            node_softwaretrigger_cmd = PySpin.CCommandPtr(nodemap.GetNode('TriggerSoftware'))
-            if not PySpin.IsAvailable(node_softwaretrigger_cmd) or not PySpin.IsWritable(node_softwaretrigger_cmd):
+            # The command handle is resolved and validated once per camera, so
+            # this is the only nodemap access left on the per-frame path.
+            node_softwaretrigger_cmd = nodes.command('TriggerSoftware')
+            if node_softwaretrigger_cmd is None:
                 print('Unable to execute trigger. Aborting...')
                 return False
 
@@ -163,6 +306,9 @@ def execute_trigger(nodemap):
         elif selected_trigger == triggers.hardware:
             print('Use the hardware to trigger image acquisition.')
 
+        elif selected_trigger == triggers.counter:
+            print('The counter of the primary camera triggers image acquisition.')
+
     except PySpin.SpinnakerException as ex:
         print('Error: %s' % ex)
         return False
@@ -170,28 +316,28 @@ def execute_trigger(nodemap):
     return result
 
 
-def reset_trigger(nodemap):
+def reset_trigger(nodes):
     """
     This function returns the camera to a normal state by turning off trigger mode.
 
-    :param nodemap: Transport layer device nodemap.
-    :type nodemap: INodeMap
+    :param nodes: Node cache of the camera to reset.
+    :type nodes: CameraNodes
     :returns: True if successful, False otherwise.
     :rtype: bool
     """
     try:
         result = True
-        node_trigger_mode = PySpin.CEnumerationPtr(nodemap.GetNode('TriggerMode'))
-        if not PySpin.IsAvailable(node_trigger_mode) or not PySpin.IsReadable(node_trigger_mode):
+        node_trigger_mode = nodes.enumeration('TriggerMode', writable=False)
+        if node_trigger_mode is None:
             print('Unable to disable trigger mode (node retrieval). Aborting...')
             return False
 
-        node_trigger_mode_off = node_trigger_mode.GetEntryByName('Off')
-        if not PySpin.IsAvailable(node_trigger_mode_off) or not PySpin.IsReadable(node_trigger_mode_off):
+        trigger_mode_off = nodes.entry_value('TriggerMode', 'Off')
+        if trigger_mode_off is None:
             print('Unable to disable trigger mode (enum entry retrieval). Aborting...')
             return False
 
-        node_trigger_mode.SetIntValue(node_trigger_mode_off.GetValue())
+        node_trigger_mode.SetIntValue(trigger_mode_off)
 
         print('Trigger mode disabled...')
 
@@ -202,151 +348,752 @@ def reset_trigger(nodemap):
     return result
 
 
-@contextlib.contextmanager
-def working_directory(path):
-    """Changes working directory and returns to previous on exit."""
-    prev_cwd = Path.cwd()
-    os.chdir(path)
+def configure_counter_strobe(cam, rate, output_line=None, pulse_width=None):
+    """
+    This function sets up Counter0 of a camera as a pulse generator; see the
+    CounterAndTimer example for more in-depth comments on counters. The counter
+    counts microsecond ticks, waits ``CounterDelay`` ticks, is active for
+    ``CounterDuration`` ticks and then restarts itself on its own end, so one
+    pulse is output every period on ``output_line`` without any host timing.
+    The counter stays idle until ``start_counter_strobe``.
+
+    :param cam: Primary camera, whose output line is wired to the other cameras' trigger inputs.
+    :type cam: CameraPtr
+    :param rate: Pulses per second.
+    :type rate: float
+    :param output_line: Line the strobe is output on; defaults to ``STROBE_OUTPUT_LINE``.
+    :type output_line: str or None
+    :param pulse_width: Length of each pulse in microseconds; defaults to ``STROBE_PULSE_WIDTH``.
+    :type pulse_width: int or None
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    output_line = STROBE_OUTPUT_LINE if output_line is None else output_line
+    pulse_width = STROBE_PULSE_WIDTH if pulse_width is None else pulse_width
+    period = int(round(1e6 / rate))
+    if not 0 < pulse_width < period:
+        logger.error('A pulse of %d us does not fit a period of %d us. Aborting...' % (pulse_width, period))
+        return False
+
+    logger.info('*** CONFIGURING COUNTER STROBE ***\n')
     try:
-        yield
-    finally:
-        os.chdir(prev_cwd)
+        nodes = camera_nodes(cam)
+        # Counter0 counts microseconds and waits to be started
+        for name, entry in (('CounterSelector', 'Counter0'), ('CounterEventSource', 'MHzTick'),
+                            ('CounterTriggerSource', 'Off'), ('CounterTriggerActivation', 'RisingEdge')):
+            if not set_enumeration(nodes, name, entry):
+                return False
+
+        # The pulse is the active part of the counter, at the end of each period
+        node_counter_duration = nodes.integer('CounterDuration')
+        node_counter_delay = nodes.integer('CounterDelay')
+        if node_counter_duration is None or node_counter_delay is None:
+            logger.error('Unable to set counter duration and delay. Aborting...')
+            return False
+        node_counter_duration.SetValue(pulse_width)
+        node_counter_delay.SetValue(period - pulse_width)
+        logger.info('Counter period set to %d us (%.6f pulses per second)...' % (period, 1e6 / period))
+
+        # Output the counter on the strobe line; Line1 is an output only, the
+        # bidirectional Line2 has to be switched to output and powered first
+        if not set_enumeration(nodes, 'LineSelector', output_line):
+            return False
+        node_line_mode = nodes.enumeration('LineMode', writable=False)
+        line_mode_output = nodes.entry_value('LineMode', 'Output')
+        if node_line_mode is not None and PySpin.IsWritable(node_line_mode) and line_mode_output is not None:
+            node_line_mode.SetIntValue(line_mode_output)
+        if not set_enumeration(nodes, 'LineSource', 'Counter0Active'):
+            return False
+        if output_line == 'Line2':
+            node_voltage_enable = nodes.boolean('V3_3Enable')
+            if node_voltage_enable is None:
+                logger.error('Unable to enable 3.3V on Line2. Aborting...')
+                return False
+            node_voltage_enable.SetValue(True)
+        logger.info('Counter strobe output on %s...' % output_line)
+
+        node_resulting_rate = nodes.float('AcquisitionResultingFrameRate', writable=False)
+        if node_resulting_rate is not None and node_resulting_rate.GetValue() < rate:
+            logger.warning('The camera manages %.2f fps at most; %.2f triggers per second will be missed'
+                           % (node_resulting_rate.GetValue(), rate))
+
+    except PySpin.SpinnakerException as ex:
+        logger.error('Error: %s' % ex)
+        return False
+
+    return True
+
+
+def set_enumeration(nodes, name, entry_name):
+    """
+    Sets enumeration ``name`` to entry ``entry_name``.
+
+    :param nodes: Node cache of the camera.
+    :type nodes: CameraNodes
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    node = nodes.enumeration(name)
+    value = nodes.entry_value(name, entry_name)
+    if node is None or value is None:
+        logger.error('Unable to set %s to %s. Aborting...' % (name, entry_name))
+        return False
+    node.SetIntValue(value)
+    return True
+
+
+def configure_counter_trigger(cam, primary, rate, output_line=None, input_line=None):
+    """
+    This function configures one camera of a hardware-timed set. The primary
+    camera generates the strobe with its counter and triggers on the end of
+    each pulse; every other camera triggers on the falling edge of the strobe
+    on its input line, which is the same instant.
+
+    :param cam: Camera to configure.
+    :type cam: CameraPtr
+    :param primary: True for the camera that generates the strobe.
+    :type primary: bool
+    :param rate: Frames per second.
+    :type rate: float
+    :param output_line: Strobe output line of the primary camera; defaults to ``STROBE_OUTPUT_LINE``.
+    :type output_line: str or None
+    :param input_line: Trigger input line of the other cameras; defaults to ``STROBE_INPUT_LINE``.
+    :type input_line: str or None
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    if primary:
+        return configure_counter_strobe(cam, rate, output_line) and configure_trigger(cam, triggers.counter)
+    return configure_trigger(cam, triggers.hardware, STROBE_INPUT_LINE if input_line is None else input_line,
+                             'FallingEdge')
+
+
+def start_counter_strobe(nodes):
+    """
+    This function starts the strobe of the primary camera. Begin acquisition
+    on every camera first, so they all see the first pulse.
+
+    :param nodes: Node cache of the primary camera.
+    :type nodes: CameraNodes
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    try:
+        # restarting on its own end makes the counter run continuously; the
+        # reset starts the first period
+        if not set_enumeration(nodes, 'CounterSelector', 'Counter0') or \
+                not set_enumeration(nodes, 'CounterTriggerSource', 'Counter0End'):
+            return False
+        node_counter_reset = nodes.command('CounterReset')
+        if node_counter_reset is None:
+            logger.error('Unable to start the counter. Aborting...')
+            return False
+        node_counter_reset.Execute()
+        logger.info('Counter strobe started...')
+
+    except PySpin.SpinnakerException as ex:
+        logger.error('Error: %s' % ex)
+        return False
+
+    return True
+
+
+def stop_counter_strobe(nodes, output_line=None):
+    """
+    This function stops the strobe of the primary camera and disconnects the
+    counter from its output line.
+
+    :param nodes: Node cache of the primary camera.
+    :type nodes: CameraNodes
+    :param output_line: Strobe output line; defaults to ``STROBE_OUTPUT_LINE``.
+    :type output_line: str or None
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    try:
+        result = set_enumeration(nodes, 'CounterSelector', 'Counter0') and \
+            set_enumeration(nodes, 'CounterTriggerSource', 'Off') and \
+            set_enumeration(nodes, 'LineSelector', STROBE_OUTPUT_LINE if output_line is None else output_line) and \
+            set_enumeration(nodes, 'LineSource', 'Off')
+        if result:
+            logger.info('Counter strobe stopped...')
+
+    except PySpin.SpinnakerException as ex:
+        logger.error('Error: %s' % ex)
+        result = False
+
+    return result
+
+
+def enable_chunk_timestamps(cam):
+    """
+    This function enables chunk data so every image carries the timestamp of
+    its exposure; see the ChunkData example for more in-depth comments on
+    chunk data.
+
+    :param cam: Camera to enable chunk timestamps on.
+    :type cam: CameraPtr
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    try:
+        nodes = camera_nodes(cam)
+        chunk_mode_active = nodes.boolean('ChunkModeActive')
+        if chunk_mode_active is None:
+            logger.error('Unable to activate chunk mode. Aborting...')
+            return False
+        chunk_mode_active.SetValue(True)
+
+        node_chunk_selector = nodes.enumeration('ChunkSelector')
+        chunk_selector_timestamp = nodes.entry_value('ChunkSelector', 'Timestamp')
+        if node_chunk_selector is None or chunk_selector_timestamp is None:
+            logger.error('Unable to select timestamp chunk. Aborting...')
+            return False
+        node_chunk_selector.SetIntValue(chunk_selector_timestamp)
+
+        # ChunkEnable applies to the selected chunk
+        chunk_enable = nodes.boolean('ChunkEnable')
+        if chunk_enable is None:
+            logger.error('Unable to enable timestamp chunk. Aborting...')
+            return False
+        chunk_enable.SetValue(True)
+        logger.info('Chunk timestamps enabled...')
+
+    except PySpin.SpinnakerException as ex:
+        logger.error('Error: %s' % ex)
+        return False
+
+    return True
+
+
+def latch_clock_offsets(cam_list):
+    """
+    Latches each camera's timestamp counter to estimate its offset from the
+    host clock, so timestamps from different cameras can be compared.
+
+    :param cam_list: List of cameras
+    :type cam_list: CameraList or list
+    :return: Device minus host ``perf_counter_ns`` time for each camera, or
+        None where the camera cannot latch its timestamp.
+    :rtype: list
+    """
+    offsets = []
+    for cam in cam_list:
+        nodes = camera_nodes(cam)
+        latch = nodes.command('TimestampLatch')
+        latch_value = nodes.integer('TimestampLatchValue', writable=False)
+        if latch is None or latch_value is None:
+            offsets.append(None)
+            continue
+        before = time.perf_counter_ns()
+        latch.Execute()
+        after = time.perf_counter_ns()
+        offsets.append(latch_value.GetValue() - (before + after) // 2)
+    return offsets
 
 
 def configure_camera(cam, acquisition_mode='Continuous', buffer_mode='NewestOnly'):
+    nodes = camera_nodes(cam)
     # Set acquisition mode to continuous
-    node_acquisition_mode = PySpin.CEnumerationPtr(cam.GetNodeMap().GetNode('AcquisitionMode'))
-    if not PySpin.IsAvailable(node_acquisition_mode) or not PySpin.IsWritable(node_acquisition_mode):
+    node_acquisition_mode = nodes.enumeration('AcquisitionMode')
+    if node_acquisition_mode is None:
         logger.error('Unable to set acquisition mode to continuous (node retrieval; camera). Aborting... \n')
         return False
-    node_acquisition_mode_continuous = node_acquisition_mode.GetEntryByName(acquisition_mode)
-    if not PySpin.IsAvailable(node_acquisition_mode_continuous) or not PySpin.IsReadable(
-            node_acquisition_mode_continuous):
+    acquisition_mode_continuous = nodes.entry_value('AcquisitionMode', acquisition_mode)
+    if acquisition_mode_continuous is None:
         logger.error(f'Unable to set acquisition mode to {acquisition_mode} (entry \'continuous\' retrieval). \
         Aborting... \n')
         return False
-    acquisition_mode_continuous = node_acquisition_mode_continuous.GetValue()
     node_acquisition_mode.SetIntValue(acquisition_mode_continuous)
     logger.info(f'Camera acquisition mode set to {acquisition_mode}...')
     # Set StreamBuferHandlingMode to NewestOnly
-    s_node_map = cam.GetTLStreamNodeMap()
-    node_buffer_handling_mode = PySpin.CEnumerationPtr(s_node_map.GetNode('StreamBufferHandlingMode'))
-    if not PySpin.IsAvailable(node_buffer_handling_mode) or not PySpin.IsWritable(node_buffer_handling_mode):
+    node_buffer_handling_mode = nodes.enumeration('StreamBufferHandlingMode', STREAM_NODEMAP)
+    if node_buffer_handling_mode is None:
         logger.error('Unable to set buffer mode to newest only (node retrieval; camera). Aborting... \n')
         return False
-    node_buffer_handling_mode_newest = node_buffer_handling_mode.GetEntryByName(buffer_mode)
-    if not PySpin.IsAvailable(node_buffer_handling_mode_newest) or not PySpin.IsReadable(
-            node_buffer_handling_mode_newest):
+    buffer_handling_newest = nodes.entry_value('StreamBufferHandlingMode', buffer_mode, STREAM_NODEMAP)
+    if buffer_handling_newest is None:
         logger.error(f'Unable to set buffer mode to {buffer_mode} (entry \'continuous\' retrieval ). \
         Aborting... \n')
         return False
-    buffer_handling_newest = node_buffer_handling_mode_newest.GetValue()
     node_buffer_handling_mode.SetIntValue(buffer_handling_newest)
     logger.info(f'Camera buffer handling mode set to {buffer_mode}')
 
 
-def acquire_images(cam_list):
+def configure_frame_rate(cam, fps=None, exposure_time=None):
+    """
+    This function fixes the exposure time and the frame rate of a free-running camera.
+
+    :param cam: Camera to configure.
+    :type cam: CameraPtr
+    :param fps: Frames per second, or None to leave the frame rate as it is.
+    :type fps: float or None
+    :param exposure_time: Exposure time in microseconds, or None to leave the exposure as it is.
+    :type exposure_time: float or None
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    try:
+        nodes = camera_nodes(cam)
+        if exposure_time is not None:
+            # ExposureTime only becomes writable once automatic exposure is off
+            node_exposure_auto = nodes.enumeration('ExposureAuto')
+            exposure_auto_off = nodes.entry_value('ExposureAuto', 'Off')
+            if node_exposure_auto is None or exposure_auto_off is None:
+                logger.error('Unable to disable automatic exposure. Aborting...')
+                return False
+            node_exposure_auto.SetIntValue(exposure_auto_off)
+            node_exposure_time = nodes.float('ExposureTime')
+            if node_exposure_time is None:
+                logger.error('Unable to set exposure time. Aborting...')
+                return False
+            node_exposure_time.SetValue(exposure_time)
+            logger.info(f'Exposure time set to {exposure_time} us')
+        if fps is not None:
+            node_rate_enable = nodes.boolean('AcquisitionFrameRateEnable')
+            if node_rate_enable is None:
+                logger.error('Unable to enable the frame rate setting. Aborting...')
+                return False
+            node_rate_enable.SetValue(True)
+            node_rate = nodes.float('AcquisitionFrameRate')
+            if node_rate is None:
+                logger.error('Unable to set frame rate. Aborting...')
+                return False
+            node_rate.SetValue(fps)
+            logger.info(f'Frame rate set to {fps} fps')
+
+    except PySpin.SpinnakerException as ex:
+        logger.error('Error: %s' % ex)
+        return False
+
+    return True
+
+
+class CameraDescriptor:
+    """
+    Static facts about a camera, read once at initialization so nothing on the per-frame path touches a nodemap.
+
+    :param index: Position of the camera in the camera list.
+    :param serial_number: Device serial number, or None if it was not readable.
+    :param model: Device model name.
+    :param width: Image width in pixels.
+    :param height: Image height in pixels.
+    :param pixel_format: Symbolic name of the pixel format, e.g. ``'Mono8'``.
+    :param calibration_id: Identifier tying the camera to a stereo calibration; read from ``DeviceUserID``.
+    """
+    __slots__ = ('index', 'serial_number', 'model', 'width', 'height', 'pixel_format', 'calibration_id')
+
+    def __init__(self, index, serial_number, model='', width=0, height=0, pixel_format='', calibration_id=''):
+        self.index = index
+        self.serial_number = serial_number
+        self.model = model
+        self.width = width
+        self.height = height
+        self.pixel_format = pixel_format
+        self.calibration_id = calibration_id
+
+    @property
+    def dtype(self):
+        """NumPy dtype of the camera's frames."""
+        return pixel_dtype(self.pixel_format)
+
+    def metadata(self):
+        """
+        :return: The descriptor as a JSON-serializable dict, for metadata writers.
+        :rtype: dict
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        return 'CameraDescriptor(%s)' % ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__)
+
+
+def pixel_dtype(pixel_format):
+    """
+    :param pixel_format: Symbolic name of a pixel format, e.g. ``'Mono12'``.
+    :return: The NumPy dtype ``GetNDArray`` returns for it: 8 bit formats as uint8, deeper ones as uint16.
+    """
+    return np.uint8 if pixel_format.endswith('8') else np.uint16
+
+
+def describe_camera(cam, index):
+    """
+    Builds the descriptor of an initialized camera.
+
+    :param cam: Initialized camera.
+    :type cam: CameraPtr
+    :param index: Position of the camera in the camera list.
+    :type index: int
+    :rtype: CameraDescriptor
+    """
+    nodes = camera_nodes(cam)
+
+    def read(node):
+        return node.GetValue() if node is not None else ''
+
+    serial_number = read(nodes.string('DeviceSerialNumber', TL_DEVICE_NODEMAP)) or None
+    pixel_format = nodes.enumeration('PixelFormat', writable=False)
+    descriptor = CameraDescriptor(index, serial_number, read(nodes.string('DeviceModelName', TL_DEVICE_NODEMAP)),
+                                  read(nodes.integer('Width', writable=False)),
+                                  read(nodes.integer('Height', writable=False)),
+                                  pixel_format.GetCurrentEntry().GetSymbolic() if pixel_format is not None else '',
+                                  read(nodes.string('DeviceUserID')))
+    logger.info('Camera %d: %r' % (index, descriptor))
+    return descriptor
+
+
+def grabbed_frame_templates(save_directory, cameras, extension='jpg'):
+    """
+    Creates the absolute filename templates of one acquisition session.
+
+    :param save_directory: Directory the frames are saved in.
+    :type save_directory: str or Path
+    :param cameras: Descriptor of each camera.
+    :type cameras: list of CameraDescriptor
+    :param extension: File extension, which decides the format the images are saved in.
+    :type extension: str
+    :return: Templates giving each frame a unique path from its camera index and frame number.
+    :rtype: image_writer.FilenameTemplates
+    """
+    session = str(dt.now()).replace(":", "").replace(".", "")
+    return image_writer.FilenameTemplates(
+        save_directory, 'AcquisitionMultipleCamera-{serial_number}-{{frame_number}}-{session}.{extension}',
+        [camera.serial_number or str(camera.index) for camera in cameras], session=session, extension=extension)
+
+
+def write_grabbed_frames(writer, templates, log_frames=True):
+    """
+    Returns a grab engine handler that queues each frame on an image writer pool.
+
+    :param writer: Pool that encodes and saves the frames.
+    :type writer: image_writer.ImageWriterPool
+    :param templates: Absolute filename templates of the session, see ``grabbed_frame_templates``.
+    :type templates: image_writer.FilenameTemplates
+    :param log_frames: Log every frame; turn off for long unattended runs.
+    :type log_frames: bool
+    """
+    def submit(frame):
+        if log_frames:
+            logger.info('Camera %d grabbed image %d, width = %d, height = %d' % (
+                frame.camera.index, frame.frame_number, frame.image.GetWidth(), frame.image.GetHeight()))
+        if isinstance(frame.image, raw_capture.RawFrame):
+            frame.image.metadata.update(frame.camera.metadata())
+        filename = templates.path(frame.camera.index, frame_number=frame.frame_number)
+        writer.submit(frame.image, filename, frame.camera.serial_number)
+        if log_frames:
+            logger.info('Image queued for %s' % filename)
+    return submit
+
+
+def prepare_for_acquisition(cam, index=0):
+    """
+    Configures a camera for acquire_images: acquisition and buffer mode, chunk
+    timestamps and the selected trigger.
+
+    :param cam: Initialized camera.
+    :type cam: CameraPtr
+    :param index: Position of the camera in the camera list; the first camera generates the counter trigger.
+    :type index: int
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    configure_camera(cam)
+    # stamp every frame with its exposure time
+    enable_chunk_timestamps(cam)
+    # todo set pixel format (mono8?)
+    if selected_trigger == triggers.counter:
+        return configure_counter_trigger(cam, index == 0, STROBE_RATE)
+    # set trigger to software trigger
+    return configure_trigger(cam)
+
+
+def wait_for_key():
+    # Get user input
+    input('Press any key to initiate software trigger./n')
+
+
+def acquire_images(cam_list, save_directory='.', prepared=False, num_images=None, wait=wait_for_key):
     """
     This function acquires and saves images from each device.
 
     :param cam_list: List of cameras
     :type cam_list: CameraList
+    :param save_directory: Directory the images are saved in.
+    :type save_directory: str or Path
+    :param prepared: True if prepare_for_acquisition already ran for every camera.
+    :type prepared: bool
+    :param num_images: Number of images to grab from each camera; defaults to ``NUM_IMAGES``.
+    :type num_images: int or None
+    :param wait: Called before each trigger, by default to wait for the user; None triggers straight away.
     :return: True if successful, False otherwise.
     :rtype: bool
     """
+    num_images = NUM_IMAGES if num_images is None else num_images
 
     logger.info('*** IMAGE ACQUISITION ***\n')
+    if CAPTURE_MODE == capture_modes.shared_memory:
+        return acquire_shared_memory(cam_list, save_directory, num_images)
     try:
         result = True
 
         # Prepare each camera to acquire images
         #
         # *** NOTES ***
-        # For pseudo-simultaneous streaming, each camera is prepared as if it
-        # were just one, but in a loop. Notice that cameras are selected with
-        # an index. We demonstrate pseudo-simultaneous streaming because true
-        # simultaneous streaming would require multiple process or threads,
-        # which is too complex for an example.
+        # Each camera is prepared as if it were just one, on its own thread so
+        # the round trips to all cameras overlap; see camera_startup. Grabbing
+        # itself is truly simultaneous; see grab_engine.
         #
+        if not prepared:
+            startup = camera_startup.start_cameras(cam_list, lambda i, cam: prepare_for_acquisition(cam, i))
+            if not all(camera.ok for camera in startup):
+                logger.error('Not every camera could be configured. Aborting...')
+                return False
 
-        for i, cam in enumerate(cam_list):
-            configure_camera(cam)
-            # set trigger to software trigger
-            configure_trigger(cam)
-            # todo set pixel format (mono8?)
+        streaming = []
+        engine = writer = dispatcher = None
+        engine_joined = strobe_started = False
+        try:
+            for i, cam in enumerate(cam_list):
+                # Begin acquiring images
+                cam.BeginAcquisition()
+                streaming.append(cam)
+                logger.info('Camera %d started acquiring images...' % i)
+
+            # Retrieve, convert, and save images for each camera
+            #
+            # *** NOTES ***
+            # Each camera gets its own grab worker thread that owns its
+            # GetNextImage/Release loop, so one camera's frame never waits behind
+            # another camera's conversion or disk write. The engine's downstream
+            # stage only queues frames; encoding and saving happen in the writer
+            # pool so they never stall the grab path either.
+            # Every path is absolute, so writer threads never depend on the
+            # working directory and can save concurrently.
+            save_directory = Path(save_directory).absolute()
+            cameras = [describe_camera(cam, i) for i, cam in enumerate(cam_list)]
+            writer = image_writer.ImageWriterPool(workers=WRITER_WORKERS, max_queue=WRITER_QUEUE_SIZE,
+                                                  policy=WRITER_POLICY, spill_path=save_directory / 'spill.raw')
+            # In raw mode the untouched sensor buffer is copied and written as is;
+            # conversion happens after the test with `raw_capture.py develop`.
+            if CAPTURE_MODE == capture_modes.raw:
+                process, extension = raw_capture.copy_raw_frame, 'raw'
+            else:
+                process, extension = grab_engine.convert_mono8, 'jpg'
+            # Software triggers are fired from one pre-armed thread per camera so
+            # the stereo pair is exposed as close together as possible; the skew
+            # achieved is measured from the frames' device timestamps, mapped
+            # onto the host clock with latched clock offsets.
+            trigger_nodes = [camera_nodes(cam) for cam in cam_list]
+            dispatcher = trigger_dispatch.TriggerDispatcher.from_nodes(
+                trigger_nodes, [camera.serial_number for camera in cameras], latch_clock_offsets(cam_list)) \
+                if selected_trigger == triggers.software else None
+            write_frame = write_grabbed_frames(writer, grabbed_frame_templates(save_directory, cameras, extension))
+
+            def handle_frame(frame):
+                if dispatcher is not None:
+                    dispatcher.record_device_timestamp(frame.frame_number, frame.camera.index, frame.timestamp)
+                write_frame(frame)
+
+            health = [acquisition_health.AcquisitionHealth('Camera %d (%s)' % (camera.index, camera.serial_number),
+                                                           camera_nodes(cam)) for cam, camera in zip(cam_list, cameras)]
+            engine = grab_engine.GrabEngine(cam_list, cameras, handle_frame, num_frames=num_images, sink_workers=1,
+                                            process=process, health=health).start()
+            # With the counter trigger the first camera paces every frame itself
+            # once its strobe is started; there is nothing to fire from here.
+            if selected_trigger == triggers.counter:
+                strobe_started = True
+                result &= start_counter_strobe(trigger_nodes[0])
+            for n in range(num_images if selected_trigger != triggers.counter else 0):
+                if wait is not None:
+                    wait()
+                if dispatcher is not None:
+                    result &= dispatcher.fire()
+                else:
+                    for nodes, camera in zip(trigger_nodes, cameras):
+                        started = instrumentation.start()
+                        execute_trigger(nodes)
+                        instrumentation.stop('trigger', camera.serial_number, started)
+            result &= engine.join()
+            engine_joined = True
+            if dispatcher is not None:
+                dispatcher.report()
+        finally:
+            # Whatever stopped the run, even an error or Ctrl+C while waiting
+            # for a trigger, the grab threads, the strobe, the trigger threads
+            # and the writer pool are stopped and every stream is ended, so
+            # the cameras can be used again.
+            if engine is not None and not engine_joined:
+                engine.stop()
+                engine.join()
+            if strobe_started:
+                result &= stop_counter_strobe(camera_nodes(cam_list[0]))
+            if dispatcher is not None:
+                dispatcher.close()
+            if writer is not None:
+                writer.close()
+                result &= writer.errors == 0 and writer.dropped == 0
+
+            # End acquisition for each camera
+            #
+            # *** NOTES ***
+            # Notice that what is usually a one-step process is now two steps
+            # because of the additional step of selecting the camera. It is worth
+            # repeating that camera selection needs to be done once per loop.
+            #
+            # It is possible to interact with cameras through the camera list with
+            # GetByIndex(); this is an alternative to retrieving cameras as
+            # CameraPtr objects that can be quick and easy for small tasks.
+            for cam in streaming:
+                reset_trigger(camera_nodes(cam))
+                # End acquisition
+                cam.EndAcquisition()
+        # p50/p95/p99 of every stage per camera, when instrumentation is enabled
+        instrumentation.dump_report(save_directory / LATENCY_REPORT)
 
-            # Begin acquiring images
-            cam.BeginAcquisition()
-            logger.info('Camera %d started acquiring images...' % i)
+    except PySpin.SpinnakerException as ex:
+        logger.error('Error: %s' % ex)
+        result = False
 
-        # Retrieve, convert, and save images for each camera
-        #
-        # *** NOTES ***
-        # In order to work with simultaneous camera streams, nested loops are
-        # needed. It is important that the inner loop be the one iterating
-        # through the cameras; otherwise, all images will be grabbed from a
-        # single camera before grabbing any images from another.
-        for n in range(NUM_IMAGES):
-            # Get user input
-            input('Press any key to initiate software trigger./n')
-            # trigger cameras close together
-            for i, cam in enumerate(cam_list):
-                nodemap = cam.GetNodeMap()
-                execute_trigger(nodemap)
-            for i, cam in enumerate(cam_list):
+    return result
 
-                try:
-                    # Retrieve device serial number for filename
-                    node_device_serial_number = PySpin.CStringPtr(
-                        cam.GetTLDeviceNodeMap().GetNode('DeviceSerialNumber'))
-                    if PySpin.IsAvailable(node_device_serial_number) and PySpin.IsReadable(node_device_serial_number):
-                        device_serial_number = node_device_serial_number.GetValue()
-                        logger.info('Camera %d serial number set to %s...' % (i, device_serial_number))
-                    else:
-                        device_serial_number = False
-                    # Retrieve next received image and ensure image completion
-                    image_result = cam.GetNextImage()
-                    if image_result.IsIncomplete():
-                        logger.warning('Image incomplete with image status %d ... \n' % image_result.GetImageStatus())
-                    else:
-                        # Print image information
-                        width = image_result.GetWidth()
-                        height = image_result.GetHeight()
-                        logger.info('Camera %d grabbed image %d, width = %d, height = %d' % (i, n, width, height))
-                        # Convert image to mono 8
-                        image_converted = image_result.Convert(PySpin.PixelFormat_Mono8, PySpin.HQ_LINEAR)
-                        # Create a unique filename
-                        if device_serial_number:
-                            filename = 'AcquisitionMultipleCamera-%s-%d-%s.jpg' % (
-                                device_serial_number, n, str(dt.now()).replace(":", "").replace(".", ""))
-                        else:
-                            filename = 'AcquisitionMultipleCamera-%d-%d.jpg' % (i, n)
-                        # Save image
-                        image_converted.Save(filename)
-                        logger.info('Image saved at %s' % filename)
-
-                    # Release image
-                    image_result.Release()
-
-                except PySpin.SpinnakerException as ex:
-                    logger.error('Error: %s' % ex)
-                    result = False
 
-        # End acquisition for each camera
-        #
-        # *** NOTES ***
-        # Notice that what is usually a one-step process is now two steps
-        # because of the additional step of selecting the camera. It is worth
-        # repeating that camera selection needs to be done once per loop.
-        #
-        # It is possible to interact with cameras through the camera list with
-        # GetByIndex(); this is an alternative to retrieving cameras as
-        # CameraPtr objects that can be quick and easy for small tasks.
+def acquire_shared_memory(cam_list, save_directory='.', num_images=None, until=None):
+    """
+    This function records raw frames from every camera with a process per
+    camera, see shared_memory_acquisition. The cameras free-run; no trigger is
+    fired. Each camera is handed over to its process for the recording and
+    initialized again here afterwards.
+
+    :param cam_list: List of initialized cameras
+    :type cam_list: CameraList
+    :param save_directory: Directory the images are saved in.
+    :type save_directory: str or Path
+    :param num_images: Number of images to record from each camera, or None to record until ``until`` stops it.
+    :type num_images: int or None
+    :param until: See ``shared_memory_acquisition.SharedMemoryAcquisition.frames``.
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    cameras = [describe_camera(cam, i) for i, cam in enumerate(cam_list)]
+    # a camera can only be initialized by one process at a time
+    for cam in cam_list:
+        cam.DeInit()
+    try:
+        return shared_memory_acquisition.acquire_raw(cameras, num_images, save_directory, until=until)
+    finally:
         for cam in cam_list:
-            nodemap = cam.GetNodeMap()
-            reset_trigger(nodemap)
-            # End acquisition
-            cam.EndAcquisition()
+            cam.Init()
+            invalidate_camera_nodes(cam)
+
+
+def get_frame_layout(cam):
+    """
+    Reads the size and pixel type of the frames a camera will deliver.
+
+    :param cam: Initialized camera.
+    :type cam: CameraPtr
+    :return: ``(height, width)`` and the matching NumPy dtype.
+    :rtype: tuple
+    """
+    nodes = camera_nodes(cam)
+    width = nodes.integer('Width', writable=False).GetValue()
+    height = nodes.integer('Height', writable=False).GetValue()
+    pixel_format = nodes.enumeration('PixelFormat', writable=False).GetCurrentEntry().GetSymbolic()
+    return (height, width), pixel_dtype(pixel_format)
+
+
+def wait_for_burst_key():
+    input('Buffering. Press Enter to trigger the burst.\n')
+
+
+def acquire_burst(cam_list, post_trigger_frames, pre_trigger_frames=None, memory_fraction=0.5, save_directory='.',
+                  wait=wait_for_burst_key):
+    """
+    This function free-runs every camera into a preallocated in-RAM ring buffer,
+    waits for the burst to be triggered, grabs the post-trigger frames and
+    only then writes the burst to disk as a stereo sequence file.
+
+    :param cam_list: List of cameras
+    :type cam_list: CameraList
+    :param post_trigger_frames: Frames kept per camera after the trigger.
+    :type post_trigger_frames: int
+    :param pre_trigger_frames: Frames kept per camera before the trigger. Defaults to as many as fit in
+        ``memory_fraction`` of the available memory.
+    :type pre_trigger_frames: int or None
+    :param memory_fraction: Share of the available memory the ring buffers may use.
+    :type memory_fraction: float
+    :param save_directory: Directory the sequence file is saved in.
+    :type save_directory: str or Path
+    :param wait: Called while the ring buffers fill; the burst is triggered
+        when it returns. None triggers at once.
+    :type wait: callable or None
+    :return: True if successful, False otherwise.
+    :rtype: bool
+    """
+    logger.info('*** BURST ACQUISITION ***\n')
+    try:
+        result = True
+        layouts = [get_frame_layout(cam) for cam in cam_list]
+        shape, dtype = max(layouts, key=lambda layout: np.prod(layout[0]) * np.dtype(layout[1]).itemsize)
+        max_slots = burst_buffer.slots_for_memory(shape, dtype, len(layouts), memory_fraction)
+        if pre_trigger_frames is None:
+            pre_trigger_frames = max_slots - post_trigger_frames
+        n_slots = pre_trigger_frames + post_trigger_frames
+        if pre_trigger_frames < 0 or n_slots > max_slots:
+            logger.error('Not enough memory for a burst of %d frames per camera (%d fit). Aborting...'
+                         % (n_slots, max_slots))
+            return False
+        logger.info('Allocating %d frames of %s per camera...' % (n_slots, shape))
+        bursts = []
+        buffer_modes = []
+        streaming = []
+        try:
+            for i, cam in enumerate(cam_list):
+                node_buffer_mode = camera_nodes(cam).enumeration('StreamBufferHandlingMode', STREAM_NODEMAP,
+                                                                 writable=False)
+                buffer_modes.append(node_buffer_mode.GetCurrentEntry().GetSymbolic()
+                                    if node_buffer_mode is not None else None)
+                # free run and keep every frame; the ring buffer decides what is kept
+                configure_camera(cam, buffer_mode='OldestFirst')
+                reset_trigger(camera_nodes(cam))
+                ring = burst_buffer.FrameRingBuffer(n_slots, layouts[i][0], layouts[i][1])
+                bursts.append(burst_buffer.BurstCapture(cam, ring, pre_trigger_frames, post_trigger_frames, i))
+            for burst in bursts:
+                burst.cam.BeginAcquisition()
+                streaming.append(burst.cam)
+                burst.start()
+            if wait is not None:
+                wait()
+            for burst in bursts:
+                burst.trigger()
+            deadline = time.monotonic() + BURST_TIMEOUT
+            for burst in bursts:
+                if not burst.done.wait(max(deadline - time.monotonic(), 0)):
+                    logger.error('Camera %d did not complete its burst within %.0f s' % (burst.camera_index,
+                                                                                      BURST_TIMEOUT))
+                    result = False
+        finally:
+            # Whatever stopped the burst, even an error or Ctrl+C while
+            # waiting for the trigger, the capture threads are stopped, every
+            # stream is ended and every camera gets its buffer mode back.
+            for burst in bursts:
+                burst.abort()
+            for burst in bursts:
+                if burst.is_alive():
+                    burst.join()
+            for cam in streaming:
+                cam.EndAcquisition()
+            for cam, buffer_mode in zip(cam_list, buffer_modes):
+                if buffer_mode is not None:
+                    configure_camera(cam, buffer_mode=buffer_mode)
+        for burst in bursts:
+            burst.health.sample()
+            result &= burst.health.lost == 0 and not burst.failed
+        cameras = [describe_camera(cam, i) for i, cam in enumerate(cam_list)]
+        burst_buffer.flush_to_sequence(bursts, Path(save_directory).absolute() / (
+            'burst_%s%s' % (dt.now().strftime('%Y%m%d_%H%M%S'), stereo_sequence.EXTENSION)),
+                                       [camera.serial_number for camera in cameras],
+                                       cameras=[camera.metadata() for camera in cameras])
 
     except PySpin.SpinnakerException as ex:
         logger.error('Error: %s' % ex)
@@ -392,13 +1139,15 @@ def print_device_info(nodemap, cam_num):
     return result
 
 
-def run_multiple_cameras(cam_list):
+def run_multiple_cameras(cam_list, save_directory='.'):
     """
     This function acts as the body of the example; please see NodeMapInfo example
     for more in-depth comments on setting up cameras.
 
     :param cam_list: List of cameras
     :type cam_list: CameraList
+    :param save_directory: Directory the images are saved in.
+    :type save_directory: str or Path
     :return: True if successful, False otherwise.
     :rtype: bool
     """
@@ -414,37 +1163,43 @@ def run_multiple_cameras(cam_list):
         # retrieved both times as needed.
         logger.info('*** DEVICE INFORMATION ***\n')
 
-        for i, cam in enumerate(cam_list):
-            # Retrieve TL device nodemap
-            nodemap_tldevice = cam.GetTLDeviceNodeMap()
-
-            # Print device information
-            result &= print_device_info(nodemap_tldevice, i)
-
-        # Initialize each camera
+        # Print device information, initialize and configure each camera
         #
         # *** NOTES ***
-        # You may notice that the steps in this function have more loops with
-        # less steps per loop; this contrasts the AcquireImages() function
-        # which has less loops but more steps per loop. This is done for
-        # demonstrative purposes as both work equally well.
+        # Every camera is started on its own thread, so startup takes about as
+        # long as the slowest camera instead of the sum of all of them. A camera
+        # that fails or hangs is left out and the others carry on.
         #
         # *** LATER ***
         # Each camera needs to be deinitialized once all images have been
         # acquired.
-        for i, cam in enumerate(cam_list):
+        def start_camera(i, cam):
+            # Retrieve TL device nodemap and print device information
+            print_device_info(cam.GetTLDeviceNodeMap(), i)
             # Initialize camera
             cam.Init()
-
-        # Acquire images on all cameras
-        result &= acquire_images(cam_list)
+            # Node handles from a previous initialization are no longer valid
+            invalidate_camera_nodes(cam)
+            return prepare_for_acquisition(cam, i)
+
+        startup = camera_startup.start_cameras(cam_list, start_camera, timeout=STARTUP_TIMEOUT)
+        ready = [camera.cam for camera in startup if camera.ok]
+        result &= len(ready) == len(startup)
+
+        # Acquire images on all cameras that started
+        if selected_trigger == triggers.counter and not startup[0].ok:
+            logger.error('The camera generating the counter trigger could not be started. Aborting...')
+        elif ready:
+            result &= acquire_images(ready, save_directory, prepared=True)
+        else:
+            logger.error('No camera could be started. Aborting...')
 
         # Deinitialize each camera
         #
         # *** NOTES ***
         # Again, each camera must be deinitialized separately by first
         # selecting the camera and then deinitializing it.
-        for cam in cam_list:
+        for cam in ready:
             # Deinitialize camera
             cam.DeInit()
 
@@ -452,7 +1207,7 @@ def run_multiple_cameras(cam_list):
         # NOTE: Unlike the C++ examples, we cannot rely on pointer objects being automatically
         # cleaned up when going out of scope.
         # The usage of del is preferred to assigning the variable to None.
-        del cam
+        del ready, startup
 
     except PySpin.SpinnakerException as ex:
         logger.error('Error: %s' % ex)
@@ -461,22 +1216,24 @@ def run_multiple_cameras(cam_list):
     return result
 
 
-def main():
+def main(save_directory='.'):
     """
     Example entry point; please see Enumeration example for more in-depth
     comments on preparing and cleaning up the system.
 
+    :param save_directory: Directory the images are saved in.
+    :type save_directory: str or Path
     :return: True if successful, False otherwise.
     :rtype: bool
     """
 
-    # Since this application saves images in the current folder
+    # Since this application saves images in the save directory
     # we must ensure that we have permission to write to this folder.
     # If we do not have permission, fail right away.
     try:
-        test_file = open('test.txt', 'w+')
+        test_file = open(Path(save_directory).absolute() / 'test.txt', 'w+')
     except IOError:
-        logger.error('Unable to write to current directory. Please check permissions.')
+        logger.error('Unable to write to save directory. Please check permissions.')
         # input('Press Enter to exit...')
         return False
 
@@ -512,7 +1269,7 @@ def main():
     # Run example on all cameras
     logger.info('Running example for all cameras...')
 
-    result = run_multiple_cameras(cam_list)
+    result = run_multiple_cameras(cam_list, save_directory)
 
     # Clear camera list before releasing system
     cam_list.Clear()
@@ -523,15 +1280,32 @@ def main():
     return result
 
 
-trigger_type = namedtuple('Triggers', 'software hardware')
-triggers = trigger_type(1, 2)
+trigger_type = namedtuple('Triggers', 'software hardware counter')
+triggers = trigger_type(1, 2, 3)
 selected_trigger = triggers.software
+# hardware-timed triggering from the counter of the first camera; see configure_counter_trigger
+STROBE_RATE = 10.0  # frames per second
+STROBE_OUTPUT_LINE = 'Line1'  # opto-isolated output of the first camera
+STROBE_INPUT_LINE = 'Line0'  # opto-isolated input of the other cameras
+STROBE_PULSE_WIDTH = 100  # microseconds
+NUM_IMAGES = 10  # number of images to grab
+BURST_TIMEOUT = 60.0  # seconds the post-trigger frames of a burst may take
+# background image writer settings; see image_writer.ImageWriterPool
+WRITER_WORKERS = 2
+WRITER_QUEUE_SIZE = 64
+WRITER_POLICY = image_writer.BLOCK
+# shared_memory records raw frames of free-running cameras with a process per camera; see acquire_shared_memory
+capture_mode_type = namedtuple('CaptureModes', 'jpeg raw shared_memory')
+capture_modes = capture_mode_type('jpeg', 'raw', 'shared_memory')
+CAPTURE_MODE = capture_modes.jpeg
+# seconds all cameras together may take to initialize and configure
+STARTUP_TIMEOUT = 10.0
+# per-stage latency report written at the end of a session; set DIC_TOOLS_INSTRUMENT=1 to record it
+LATENCY_REPORT = 'latency_report.json'
 if __name__ == '__main__':
     # this script pauses before each image is taken and waits for the user to press a key
-    NUM_IMAGES = 10  # number of images to grab
     save_directory = Path(r'C:\Users\Npyle1\OneDrive - DJO LLC\Pictures\DIC\testing')
-    with working_directory(save_directory):
-        if main():
-            sys.exit(0)
-        else:
-            sys.exit(1)
+    if main(save_directory):
+        sys.exit(0)
+    else:
+        sys.exit(1)
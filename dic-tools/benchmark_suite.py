@@ -0,0 +1,332 @@
+"""
+Throughput benchmark suite for the acquisition, save and preview paths, run on simulated cameras.
+
+Each scenario drives one code path with cameras from ``simulated_pyspin`` at a given resolution and camera count:
+
+* ``acquire``: ``acquistion.acquire_images`` end to end, software triggered, saving ``jpeg`` or ``raw`` frames,
+* ``save``: free-running grab threads feeding the GUI's save path, as ``jpeg`` or ``raw`` files through the image
+  writer pool or into a ``sequence`` file,
+* ``preview``: the GUI preview's decimation to a 600 x 500 widget with the ``box`` or ``stride`` method.
+
+Every scenario runs in a fresh process, so its peak RSS is its own. The results, frames per second, CPU time per
+frame, peak RSS and dropped frames, are written to a JSON file; ``compare`` flags the scenarios of a new results
+file that got worse than a baseline by more than a threshold:
+
+    python benchmark_suite.py run --output results.json --cameras 1 2 4 --resolutions 1224x1024 2448x2048
+    python benchmark_suite.py compare baseline.json results.json --threshold 0.1
+
+Simulated frames skip the camera's transfer, and ``Save`` writes raw pixels in place of the JPEG encode, so the
+numbers measure the Python side of the pipeline. Compare results from the same machine only.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime as dt
+from multiprocessing import get_context
+from pathlib import Path
+from loguru import logger
+
+Scenario = namedtuple('Scenario', 'path cameras width height variant frames fps')
+VARIANTS = {'acquire': ('jpeg', 'raw'), 'save': ('jpeg', 'raw', 'sequence'), 'preview': ('box', 'stride')}
+RESOLUTIONS = ((1224, 1024), (2448, 2048))
+CAMERA_COUNTS = (1, 2)
+EXPOSURE_TIME = 0.001  # seconds; with fps 0 the simulated cameras run as fast as this allows
+PREVIEW_SIZE = (600, 500)
+# metric: True if higher is better
+METRICS = {'fps': True, 'cpu_ms_per_frame': False, 'peak_rss_mb': False, 'drops': False}
+
+
+def scenario_name(scenario):
+    return f'{scenario.path}-{scenario.cameras}x{scenario.width}x{scenario.height}-{scenario.variant}'
+
+
+def peak_rss():
+    """
+    :return: Peak resident set size of this process in bytes, or None where it cannot be read.
+    :rtype: int or None
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                       [(name, ctypes.c_size_t) for name in (
+                           'PeakWorkingSetSize', 'WorkingSetSize', 'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage',
+                           'QuotaPeakNonPagedPoolUsage', 'QuotaNonPagedPoolUsage', 'PagefileUsage',
+                           'PeakPagefileUsage')]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        if ctypes.windll.psapi.GetProcessMemoryInfo(ctypes.windll.kernel32.GetCurrentProcess(),
+                                                    ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    return None
+
+
+class Measurement:
+    """Wall and process CPU time spent inside a ``with`` block."""
+
+    def __enter__(self):
+        self.seconds = self.cpu_seconds = 0.0
+        self._started = time.perf_counter(), time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.seconds = time.perf_counter() - self._started[0]
+        self.cpu_seconds = time.process_time() - self._started[1]
+
+
+def _acquire(scenario, cams, directory, measurement):
+    import acquistion as cam_aq
+    import camera_startup
+    cam_aq.CAPTURE_MODE = scenario.variant
+    startup = camera_startup.start_cameras(cams, lambda i, cam: cam_aq.prepare_for_acquisition(cam))
+    if not all(result.ok for result in startup):
+        raise RuntimeError('Unable to configure the simulated cameras')
+    with measurement:
+        cam_aq.acquire_images(cams, directory, prepared=True, num_images=scenario.frames, wait=None)
+    written = len(list(Path(directory).glob('*.' + ('raw' if scenario.variant == 'raw' else 'jpg'))))
+    return written, scenario.cameras * scenario.frames - written
+
+
+def _save(scenario, cams, directory, measurement):
+    import acquistion as cam_aq
+    import event_acquisition
+    import grab_engine
+    import image_writer
+    import raw_capture
+    import stereo_sequence
+    cameras = []
+    for i, cam in enumerate(cams):
+        cam_aq.configure_camera(cam, buffer_mode='OldestFirst')
+        cam_aq.enable_chunk_timestamps(cam)
+        cameras.append(cam_aq.describe_camera(cam, i))
+        cam.BeginAcquisition()
+    writer = sequence = None
+    if scenario.variant == 'sequence':
+        sequence = stereo_sequence.StereoSequence.create(Path(directory) / ('benchmark' + stereo_sequence.EXTENSION),
+                                                         len(cams), scenario.height, scenario.width,
+                                                         cameras[0].dtype)
+        process = event_acquisition.copy_frame
+
+        def handle_frame(frame):
+            sequence.write(frame.frame_number, frame.camera.index, frame.image.GetNDArray(),
+                           frame_id=frame.frame_id, timestamp=frame.timestamp)
+    else:
+        process, extension = (raw_capture.copy_raw_frame, 'raw') if scenario.variant == 'raw' else \
+            (grab_engine.convert_mono8, 'jpg')
+        writer = image_writer.ImageWriterPool(workers=cam_aq.WRITER_WORKERS, max_queue=cam_aq.WRITER_QUEUE_SIZE,
+                                              policy=image_writer.DROP_OLDEST)
+        templates = image_writer.FilenameTemplates(directory, '{project}_{{image_id:03d}}_S#{serial_number}.{ext}',
+                                                   [camera.serial_number for camera in cameras], project='benchmark',
+                                                   ext=extension)
+
+        def handle_frame(frame):
+            writer.submit(frame.image, templates.path(frame.camera.index, image_id=frame.frame_number),
+                          frame.camera.serial_number)
+    with measurement:
+        with grab_engine.GrabEngine(cams, cameras, handle_frame, scenario.frames, process=process,
+                                    sink_workers=1 if sequence is not None else None) as engine:
+            pass
+        if writer is not None:
+            writer.close()
+    for cam in cams:
+        cam.EndAcquisition()
+    drops = sum(worker.health.lost for worker in engine.workers) + engine.handler_errors
+    if sequence is not None:
+        written = len(sequence) * len(cams)
+        sequence.close()
+    else:
+        written = writer.written
+        drops += writer.dropped + writer.errors
+    return written, drops
+
+
+def _preview(scenario, cams, directory, measurement):
+    import acquistion as cam_aq
+    import preview
+    for cam in cams:
+        cam_aq.configure_camera(cam, buffer_mode='NewestOnly')
+        cam.BeginAcquisition()
+    frames = 0
+    # like the UI thread: each tick takes the newest frame of every camera and prepares its texture upload
+    with measurement:
+        for _ in range(scenario.frames):
+            for cam in cams:
+                image_result = cam.GetNextImage(1000)
+                image_arr = image_result.GetNDArray()
+                factor = preview.decimation_factor((image_arr.shape[1], image_arr.shape[0]), PREVIEW_SIZE)
+                preview.preview_buffer(preview.decimate(image_arr, factor, scenario.variant))
+                image_result.Release()
+                frames += 1
+    drops = sum(cam.frames_dropped for cam in cams)
+    for cam in cams:
+        cam.EndAcquisition()
+    return frames, drops
+
+
+RUNNERS = {'acquire': _acquire, 'save': _save, 'preview': _preview}
+
+
+def run_scenario(scenario):
+    """
+    Runs one scenario on simulated cameras. Meant to run in a process of its own.
+
+    :type scenario: Scenario
+    :return: The scenario's fields and its metrics, or its fields and an ``error``.
+    :rtype: dict
+    """
+    import simulated_pyspin
+    logger.remove()  # the acquisition logs every frame; the runner reports the result
+    simulated_pyspin.install(cameras=scenario.cameras, width=scenario.width, height=scenario.height,
+                             fps=float(scenario.fps), exposure_time=EXPOSURE_TIME)
+    result = dict(scenario._asdict())
+    try:
+        simulated_pyspin.target_pattern()
+        system = simulated_pyspin.System.GetInstance()
+        cams = list(system.GetCameras())
+        for cam in cams:
+            cam.Init()
+        measurement = Measurement()
+        with tempfile.TemporaryDirectory() as directory:
+            frames, drops = RUNNERS[scenario.path](scenario, cams, directory, measurement)
+        for cam in cams:
+            cam.DeInit()
+        system.ReleaseInstance()
+    except ImportError as ex:
+        result['error'] = f'skipped, {ex}'
+        return result
+    except Exception as ex:
+        result['error'] = repr(ex)
+        return result
+    rss = peak_rss()
+    result.update(frames=frames, seconds=measurement.seconds, fps=frames / measurement.seconds if frames else 0.0,
+                  cpu_ms_per_frame=1000 * measurement.cpu_seconds / frames if frames else None,
+                  peak_rss_mb=rss / 2 ** 20 if rss is not None else None, drops=drops)
+    return result
+
+
+def scenarios(paths=tuple(VARIANTS), camera_counts=CAMERA_COUNTS, resolutions=RESOLUTIONS, variants=None,
+              frames=50, fps=0):
+    """
+    :param variants: Output formats or preview methods to run; None runs every variant of each path.
+    :return: Every combination of the arguments that applies.
+    :rtype: list of Scenario
+    """
+    return [Scenario(path, cameras, width, height, variant, frames, fps)
+            for path in paths for cameras in camera_counts for width, height in resolutions
+            for variant in VARIANTS[path] if variants is None or variant in variants]
+
+
+def run(scenario_list, output=None):
+    """
+    Runs every scenario in a fresh process and writes the results.
+
+    :param output: JSON file to write, or None.
+    :return: The results file's content.
+    :rtype: dict
+    """
+    results = {}
+    for scenario in scenario_list:
+        name = scenario_name(scenario)
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+            result = executor.submit(run_scenario, scenario).result()
+        results[name] = result
+        if 'error' in result:
+            logger.warning(f'{name}: {result["error"]}')
+        else:
+            logger.info(f'{name}: {result["fps"]:.1f} fps, {result["cpu_ms_per_frame"]:.2f} ms CPU per frame, '
+                        f'peak RSS {result["peak_rss_mb"] or 0:.0f} MB, {result["drops"]} dropped')
+    report = {'created': dt.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+              'platform': platform.platform(), 'cpu_count': os.cpu_count(), 'results': results}
+    if output is not None:
+        with open(output, 'w') as output_file:
+            json.dump(report, output_file, indent=2)
+        logger.info(f'Benchmark results written to {output}')
+    return report
+
+
+def compare(baseline, current, threshold=0.1):
+    """
+    Compares the scenarios two results files have in common.
+
+    :param baseline: Results of the reference run, as returned by ``run`` or read from its file.
+    :param current: Results of the run being checked.
+    :param threshold: Relative change beyond which a metric counts as regressed; any increase in drops does.
+    :return: ``(scenario, metric, baseline value, current value)`` of every regression.
+    :rtype: list of tuple
+    """
+    regressions = []
+    for name, new in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None or 'error' in old or 'error' in new:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            before, after = old.get(metric), new.get(metric)
+            if before is None or after is None:
+                continue
+            if metric == 'drops':
+                regressed = after > before
+            elif higher_is_better:
+                regressed = after < before * (1 - threshold)
+            else:
+                regressed = after > before * (1 + threshold)
+            change = (after - before) / before * 100 if before else 0.0
+            line = f'{name} {metric}: {before:.2f} -> {after:.2f} ({change:+.1f}%)'
+            if regressed:
+                regressions.append((name, metric, before, after))
+                logger.error('REGRESSION ' + line)
+            else:
+                logger.info(line)
+    logger.info(f'{len(regressions)} regression(s)')
+    return regressions
+
+
+def _resolution(text):
+    width, height = text.lower().split('x')
+    return int(width), int(height)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Acquisition throughput benchmarks on simulated cameras.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run benchmark scenarios and write their results')
+    run_parser.add_argument('--output', type=Path, default=Path('benchmark_results.json'))
+    run_parser.add_argument('--paths', nargs='+', choices=tuple(VARIANTS), default=tuple(VARIANTS))
+    run_parser.add_argument('--cameras', nargs='+', type=int, default=CAMERA_COUNTS)
+    run_parser.add_argument('--resolutions', nargs='+', type=_resolution, default=RESOLUTIONS,
+                            help='WIDTHxHEIGHT, e.g. 2448x2048')
+    run_parser.add_argument('--variants', nargs='+', default=None,
+                            help='output formats (jpeg, raw, sequence) or preview methods (box, stride)')
+    run_parser.add_argument('--frames', type=int, default=50, help='frames per camera')
+    run_parser.add_argument('--fps', type=float, default=0, help='simulated frame rate; 0 runs as fast as possible')
+    compare_parser = commands.add_parser('compare', help='flag regressions of one results file against another')
+    compare_parser.add_argument('baseline', type=Path)
+    compare_parser.add_argument('current', type=Path)
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as regression')
+    args = parser.parse_args(argv)
+    if args.command == 'run':
+        report = run(scenarios(args.paths, args.cameras, args.resolutions, args.variants, args.frames, args.fps),
+                     args.output)
+        return not any('error' in result and not result['error'].startswith('skipped')
+                       for result in report['results'].values())
+    with open(args.baseline) as baseline, open(args.current) as current:
+        return not compare(json.load(baseline), json.load(current), args.threshold)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
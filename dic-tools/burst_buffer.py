@@ -0,0 +1,255 @@
+"""
+Preallocated in-RAM ring buffers for bursts faster than the disk can take.
+
+A ``FrameRingBuffer`` allocates all of its frame slots up front and ``push`` copies each ``GetNDArray()`` result into
+the next slot, so nothing is allocated per frame. A ``BurstCapture`` keeps one camera's ring rolling until it is
+triggered, grabs the configured number of post-trigger frames and stops; the frames are flushed to disk afterwards.
+"""
+import ctypes
+import os
+import sys
+import threading
+import numpy as np
+import PySpin
+from loguru import logger
+import stereo_sequence
+from frame_pairing import frame_timestamp
+from acquisition_health import AcquisitionHealth
+from grab_engine import MAX_CONSECUTIVE_ERRORS, _is_timeout
+
+
+def available_memory():
+    """
+    :return: Physical memory currently available to this process, in bytes.
+    :rtype: int
+    """
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    if sys.platform == 'win32':
+        class MemoryStatusEx(ctypes.Structure):
+            _fields_ = [('dwLength', ctypes.c_ulong), ('dwMemoryLoad', ctypes.c_ulong),
+                        ('ullTotalPhys', ctypes.c_ulonglong), ('ullAvailPhys', ctypes.c_ulonglong),
+                        ('ullTotalPageFile', ctypes.c_ulonglong), ('ullAvailPageFile', ctypes.c_ulonglong),
+                        ('ullTotalVirtual', ctypes.c_ulonglong), ('ullAvailVirtual', ctypes.c_ulonglong),
+                        ('ullAvailExtendedVirtual', ctypes.c_ulonglong)]
+        status = MemoryStatusEx()
+        status.dwLength = ctypes.sizeof(MemoryStatusEx)
+        ctypes.windll.kernel32.GlobalMemoryStatusEx(ctypes.byref(status))
+        return status.ullAvailPhys
+    return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+
+
+def slots_for_memory(shape, dtype=np.uint8, n_buffers=1, memory_fraction=0.5):
+    """
+    :return: How many frames of ``shape`` each of ``n_buffers`` ring buffers can hold within ``memory_fraction``
+        of the available memory.
+    :rtype: int
+    """
+    frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    return int(available_memory() * memory_fraction) // (frame_bytes * n_buffers)
+
+
+class BufferedImage:
+    """
+    A frame copied out of a ring buffer that can be saved like the PySpin image it came from.
+
+    Implements the ``ImagePtr`` methods used by the GUI save path and ``raw_capture.RawFrame``.
+    """
+
+    def __init__(self, array, frame_id=-1, timestamp=0):
+        self.array = array
+        self.frame_id = frame_id
+        self.timestamp = timestamp
+
+    def GetNDArray(self):
+        return self.array
+
+    def GetData(self):
+        return self.array.reshape(-1).view(np.uint8)
+
+    def GetWidth(self):
+        return self.array.shape[1]
+
+    def GetHeight(self):
+        return self.array.shape[0]
+
+    def GetXOffset(self):
+        return 0
+
+    def GetYOffset(self):
+        return 0
+
+    def GetPixelFormatName(self):
+        return 'Mono8' if self.array.dtype == np.uint8 else 'Mono16'
+
+    def GetFrameID(self):
+        return self.frame_id
+
+    def GetTimeStamp(self):
+        return self.timestamp
+
+    def IsIncomplete(self):
+        return False
+
+    def Convert(self, pixel_format, algorithm=PySpin.HQ_LINEAR):
+        image = PySpin.Image.Create(self.GetWidth(), self.GetHeight(), 0, 0,
+                                    getattr(PySpin, 'PixelFormat_' + self.GetPixelFormatName()), self.array)
+        return image.Convert(pixel_format, algorithm)
+
+
+class FrameRingBuffer:
+    """
+    Fixed number of preallocated frame slots that are overwritten oldest first.
+
+    :param n_slots: Number of frames held.
+    :param shape: Shape of one frame, e.g. ``(height, width)``.
+    :param dtype: Pixel type.
+    """
+
+    def __init__(self, n_slots, shape, dtype=np.uint8):
+        self.frames = np.empty((n_slots,) + tuple(shape), dtype=dtype)
+        self.frames.fill(0)  # touch every page now rather than during the burst
+        self.frame_ids = np.full(n_slots, -1, dtype=np.int64)
+        self.timestamps = np.zeros(n_slots, dtype=np.uint64)
+        self.n_slots = n_slots
+        self.count = 0
+
+    def push_array(self, image_arr, frame_id=-1, timestamp=0):
+        """Copies ``image_arr`` over the oldest slot."""
+        slot = self.count % self.n_slots
+        np.copyto(self.frames[slot], image_arr)
+        self.frame_ids[slot] = frame_id
+        self.timestamps[slot] = timestamp
+        self.count += 1
+
+    def push(self, image_result):
+        """Copies a complete PySpin image over the oldest slot. The image can be released straight after."""
+        self.push_array(image_result.GetNDArray(), image_result.GetFrameID(), frame_timestamp(image_result))
+
+    def __len__(self):
+        return min(self.count, self.n_slots)
+
+    def ordered_slots(self):
+        """
+        :return: Slot indices from the oldest to the newest frame held.
+        :rtype: np.ndarray
+        """
+        if self.count <= self.n_slots:
+            return np.arange(self.count)
+        return (np.arange(self.n_slots) + self.count) % self.n_slots
+
+    def copy_out(self, slot):
+        """
+        :return: A copy of the frame in ``slot`` that stays valid after the slot is overwritten.
+        :rtype: BufferedImage
+        """
+        return BufferedImage(self.frames[slot].copy(), int(self.frame_ids[slot]), int(self.timestamps[slot]))
+
+    def matches(self, n_slots, shape, dtype):
+        return self.n_slots == n_slots and self.frames.shape[1:] == tuple(shape) and self.frames.dtype == dtype
+
+    def clear(self):
+        self.count = 0
+        self.frame_ids.fill(-1)
+
+
+class BurstCapture(threading.Thread):
+    """
+    Keeps a camera's ring buffer rolling until ``trigger`` and stops after ``post_trigger_frames`` more frames.
+
+    :param cam: Camera to grab from. Acquisition must already have begun.
+    :type cam: CameraPtr
+    :param ring: Buffer of at least ``pre_trigger_frames + post_trigger_frames`` slots.
+    :type ring: FrameRingBuffer
+    :param pre_trigger_frames: Frames kept from before the trigger.
+    :param post_trigger_frames: Frames grabbed after the trigger.
+
+    The capture gives up, with ``failed`` set, after ``grab_engine.MAX_CONSECUTIVE_ERRORS`` errors other than
+    timeouts in a row.
+    """
+
+    def __init__(self, cam, ring, pre_trigger_frames, post_trigger_frames, camera_index=0, timeout=1000):
+        super(BurstCapture, self).__init__(name=f'burst-{camera_index}', daemon=True)
+        if pre_trigger_frames + post_trigger_frames > ring.n_slots:
+            raise ValueError(f'A ring buffer of {ring.n_slots} frames cannot hold {pre_trigger_frames} pre-trigger '
+                             f'and {post_trigger_frames} post-trigger frames')
+        self.cam = cam
+        self.ring = ring
+        self.pre_trigger_frames = pre_trigger_frames
+        self.post_trigger_frames = post_trigger_frames
+        self.camera_index = camera_index
+        self.timeout = timeout
+        self.trigger_count = None
+        self.health = AcquisitionHealth(f'Burst camera {camera_index}')
+        self.failed = False
+        self.done = threading.Event()
+        self._abort = threading.Event()
+
+    def trigger(self):
+        """Marks the current frame as the trigger point."""
+        if self.trigger_count is None:
+            self.trigger_count = self.ring.count
+
+    def abort(self):
+        self._abort.set()
+
+    def run(self):
+        consecutive_errors = 0
+        try:
+            while not self._abort.is_set():
+                if self.trigger_count is not None and self.ring.count - self.trigger_count >= self.post_trigger_frames:
+                    break
+                try:
+                    image_result = self.cam.GetNextImage(self.timeout)
+                except PySpin.SpinnakerException as ex:
+                    if _is_timeout(ex):
+                        logger.debug('Camera %d: %s' % (self.camera_index, ex))
+                        continue
+                    logger.error('Camera %d error: %s' % (self.camera_index, ex))
+                    consecutive_errors += 1
+                    if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                        logger.error('Camera %d failed %d times in a row, giving up on the burst'
+                                     % (self.camera_index, consecutive_errors))
+                        self.failed = True
+                        break
+                    continue
+                consecutive_errors = 0
+                try:
+                    if self.health.observe(image_result):
+                        self.ring.push(image_result)
+                finally:
+                    image_result.Release()
+        finally:
+            self.done.set()
+
+    def burst_slots(self):
+        """
+        :return: Slot indices of the burst, oldest first: up to ``pre_trigger_frames`` before the trigger and
+            the post-trigger frames.
+        :rtype: np.ndarray
+        """
+        slots = self.ring.ordered_slots()
+        return slots[-(self.pre_trigger_frames + self.post_trigger_frames):]
+
+
+def flush_to_sequence(bursts, path, serial_numbers=None, **attributes):
+    """
+    Writes finished bursts to a stereo sequence file; frame *n* of each camera is its *n*-th burst frame.
+
+    :param bursts: One finished ``BurstCapture`` per camera.
+    :return: The written sequence path.
+    """
+    shape = bursts[0].ring.frames.shape[1:]
+    with stereo_sequence.StereoSequence.create(path, len(bursts), shape[0], shape[1], bursts[0].ring.frames.dtype,
+                                               serial_numbers=serial_numbers,
+                                               reserve_frames=max(len(burst.burst_slots()) for burst in bursts),
+                                               **attributes) as sequence:
+        for k, burst in enumerate(bursts):
+            ring = burst.ring
+            for n, slot in enumerate(burst.burst_slots()):
+                sequence.write(n, k, ring.frames[slot], int(ring.frame_ids[slot]), int(ring.timestamps[slot]))
+    logger.info(f'Burst flushed to {path}')
+    return path
@@ -0,0 +1,75 @@
+"""
+Concurrent camera startup.
+
+``Init`` and configuration are dominated by round trips to each camera, so doing them one camera after another
+makes startup grow linearly with the number of cameras. ``start_cameras`` runs a preparation function for every
+camera on its own thread. A camera that raises or does not finish within the timeout is reported and left out; the
+others carry on. The time each camera took and the total are logged so startup regressions show up in the logs.
+"""
+import threading
+import time
+from collections import namedtuple
+from loguru import logger
+
+StartupResult = namedtuple('StartupResult', 'index cam ok seconds error')
+
+
+def start_cameras(cam_list, prepare, timeout=10.0):
+    """
+    Calls ``prepare(index, cam)`` for every camera concurrently.
+
+    :param cam_list: Cameras to start.
+    :type cam_list: CameraList or list
+    :param prepare: Initializes and configures one camera; returning False or raising marks the camera as failed.
+    :param timeout: Seconds every camera together may take. A camera still busy after that is left out; its thread
+        is abandoned, as a blocked SDK call cannot be interrupted.
+    :type timeout: float
+    :return: One result per camera, in camera order. Threads abandoned at the timeout never change it.
+    :rtype: list of StartupResult
+    """
+    cams = list(cam_list)
+    results = [None] * len(cams)
+    lock = threading.Lock()
+    abandoned = [False]
+
+    def run(index, cam):
+        started = time.perf_counter()
+        try:
+            ok = prepare(index, cam) is not False
+            error = None if ok else 'preparation failed'
+        except Exception as ex:
+            ok, error = False, ex
+        with lock:
+            if abandoned[0]:
+                logger.warning('Camera %d finished starting %.2f s after the timeout and stays left out'
+                               % (index, time.perf_counter() - started - timeout))
+                return
+            results[index] = StartupResult(index, cam, ok, time.perf_counter() - started, error)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=run, args=(i, cam), name=f'startup-{i}', daemon=True)
+               for i, cam in enumerate(cams)]
+    for thread in threads:
+        thread.start()
+    deadline = started + timeout
+    for thread in threads:
+        thread.join(max(deadline - time.perf_counter(), 0))
+    with lock:
+        abandoned[0] = True
+        results = [result if result is not None else StartupResult(i, cam, False, timeout, 'timed out')
+                   for i, (result, cam) in enumerate(zip(results, cams))]
+    log_startup(results, time.perf_counter() - started)
+    return results
+
+
+def log_startup(results, total_seconds):
+    """Logs the time each camera took to start and which cameras failed."""
+    for result in results:
+        if result.ok:
+            logger.info('Camera %d started in %.2f s' % (result.index, result.seconds))
+        else:
+            logger.error('Camera %d failed to start after %.2f s: %s' % (result.index, result.seconds, result.error))
+    ready = sum(result.ok for result in results)
+    slowest = max((result.seconds for result in results), default=0.0)
+    logger.info('Startup: %d of %d cameras ready in %.2f s (slowest camera %.2f s)'
+                % (ready, len(results), total_seconds, slowest))
@@ -0,0 +1,266 @@
+"""
+Pushed acquisition: frames arrive on a thread other than the UI's instead of the UI polling ``GetNextImage``.
+
+Frames are pushed either by the SDK itself, to a ``FrameEventHandler`` registered on the camera (see
+``PySpin Examples/ImageEvents.py``), or by a ``grab_engine.CameraGrabWorker`` thread per camera. Either way the
+pixels are copied out of the camera buffer and the copy is published to a ``FrameMailbox``:
+
+* its ``LatestFrameSlot`` only ever holds the newest frame, for the preview, and
+* its bounded recording queue keeps every frame for pairing and saving.
+
+Neither consumer waits on the camera; the UI picks up whatever has arrived since it was last notified.
+
+Run this module directly to measure, with simulated cameras, how long the UI thread blocks per tick with polling
+and with events, and how the UI frame time develops as the exposure time grows with polling and with grab threads.
+"""
+import queue
+import threading
+import time
+if __name__ == '__main__':
+    # run as a script, the benchmark uses simulated cameras, installed before anything imports PySpin
+    import simulated_pyspin
+    simulated_pyspin.install()
+import PySpin
+import numpy as np
+from loguru import logger
+from grab_engine import CameraGrabWorker, GrabbedFrame
+from burst_buffer import BufferedImage
+from frame_pairing import frame_timestamp
+from acquisition_health import AcquisitionHealth
+
+
+def copy_frame(image):
+    """
+    :return: A copy of an event image that stays valid after the SDK reuses its buffer.
+    :rtype: burst_buffer.BufferedImage
+    """
+    return BufferedImage(np.array(image.GetNDArray(), copy=True), image.GetFrameID(), frame_timestamp(image))
+
+
+class LatestFrameSlot:
+    """
+    Holds the newest frame from a single producer.
+
+    ``put`` and ``take`` are single reference assignments of a ``(number, frame)`` tuple, which are atomic under
+    the GIL, so neither side takes a lock and the producer never waits for the consumer. A frame that is not taken
+    before the next one arrives is simply replaced.
+    """
+
+    def __init__(self):
+        self._entry = (0, None)
+        self._taken = 0
+        self._ready = threading.Event()
+
+    def put(self, frame):
+        self._entry = (self._entry[0] + 1, frame)
+        self._ready.set()
+
+    def take(self):
+        """
+        :return: The newest frame if it has not been taken yet, otherwise None.
+        """
+        number, frame = self._entry
+        if number == self._taken:
+            return None
+        self._taken = number
+        return frame
+
+    def wait(self, timeout):
+        """
+        Blocks until a frame that has not been taken yet is available.
+
+        :param timeout: Longest wait in seconds.
+        :return: The frame, or None if none arrived in time.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            self._ready.clear()
+            frame = self.take()
+            if frame is not None:
+                return frame
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._ready.wait(remaining):
+                return self.take()
+
+
+class FrameMailbox:
+    """
+    Where a producer thread publishes frames for the UI.
+
+    :param queue_size: Frames the recording queue holds before new frames are counted as overflow and discarded.
+    :type queue_size: int
+    :param notify: Called from the producer thread after each frame, e.g. to schedule a UI update, or None.
+    """
+
+    def __init__(self, queue_size=64, notify=None):
+        self.latest = LatestFrameSlot()
+        self.recording = queue.Queue(maxsize=queue_size)
+        self.notify = notify
+        self.overflow = 0
+
+    def put(self, frame):
+        """
+        Publishes a frame.
+
+        :param frame: A copied image, or a ``GrabbedFrame`` holding one so the mailbox can be a grab worker's
+            downstream queue.
+        """
+        if isinstance(frame, GrabbedFrame):
+            frame = frame.image
+        self.latest.put(frame)
+        try:
+            self.recording.put_nowait(frame)
+        except queue.Full:
+            self.overflow += 1
+        if self.notify is not None:
+            self.notify()
+
+    def drain(self):
+        """
+        :return: Every frame waiting in the recording queue, oldest first.
+        :rtype: list
+        """
+        frames = []
+        while True:
+            try:
+                frames.append(self.recording.get_nowait())
+            except queue.Empty:
+                return frames
+
+
+class FrameEventHandler(PySpin.ImageEventHandler):
+    """
+    Receives images from one camera on the SDK's thread and publishes copies to a mailbox.
+
+    :param health: Tracker fed every image; incomplete and repeated frames are not published.
+    :type health: acquisition_health.AcquisitionHealth
+    :param mailbox: Where frames are published. Defaults to a new one.
+    :type mailbox: FrameMailbox or None
+    :param copy: Called with each complete image; its result is what gets published.
+    """
+
+    def __init__(self, health, mailbox=None, copy=copy_frame):
+        super(FrameEventHandler, self).__init__()
+        self.health = health
+        self.mailbox = mailbox if mailbox is not None else FrameMailbox()
+        self.copy = copy
+        self.errors = 0
+
+    def OnImageEvent(self, image):
+        try:
+            if self.health.observe(image):
+                self.mailbox.put(self.copy(image))
+        except Exception as ex:
+            # an exception must not propagate back into the SDK's thread
+            logger.error(f'{self.health.name}: error handling image event: {ex}')
+            self.errors += 1
+
+
+def grab_thread(cam, camera, mailbox, health=None, timeout=1000):
+    """
+    Creates a grab thread that publishes copies of a camera's frames to a mailbox. Start it after
+    ``BeginAcquisition`` and stop and join it before ``EndAcquisition``.
+
+    :type camera: acquistion.CameraDescriptor
+    :type mailbox: FrameMailbox
+    :rtype: grab_engine.CameraGrabWorker
+    """
+    return CameraGrabWorker(cam, camera, mailbox, timeout=timeout, process=copy_frame, health=health)
+
+
+def benchmark(num_cameras=2, fps=30.0, exposure_time=0.02, duration=2.0, tick=1.0 / 60.0, shape=(480, 640)):
+    """
+    Measures how long each 60 Hz UI tick blocks when it polls simulated cameras and when it reads the event slots.
+
+    :param exposure_time: Exposure time of the simulated cameras, in seconds.
+    :return: ``{'poll': (mean_ms, max_ms), 'events': (mean_ms, max_ms)}`` of the per-tick UI time.
+    :rtype: dict
+    """
+    def run(ui_tick):
+        durations = []
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            ui_tick()
+            elapsed = time.perf_counter() - start
+            durations.append(elapsed)
+            time.sleep(max(tick - elapsed, 0))
+        return 1000 * sum(durations) / len(durations), 1000 * max(durations)
+
+    cams = simulated_pyspin.open_cameras(num_cameras, width=shape[1], height=shape[0], fps=fps,
+                                         exposure_time=exposure_time)
+    for cam in cams:
+        cam.BeginAcquisition()
+    results = {'poll': run(lambda: [cam.GetNextImage(1000).Release() for cam in cams])}
+    for cam in cams:
+        cam.EndAcquisition()
+
+    handlers = [FrameEventHandler(AcquisitionHealth(f'Camera {i}')) for i in range(num_cameras)]
+    for cam, handler in zip(cams, handlers):
+        cam.RegisterEventHandler(handler)
+        cam.BeginAcquisition()
+    results['events'] = run(lambda: [(h.mailbox.latest.take(), h.mailbox.drain()) for h in handlers])
+    for cam, handler in zip(cams, handlers):
+        cam.EndAcquisition()
+        cam.UnregisterEventHandler(handler)
+        cam.DeInit()
+    for name, (mean_ms, max_ms) in results.items():
+        logger.info(f'{name}: UI tick blocked {mean_ms:.2f} ms on average, {max_ms:.2f} ms at most')
+    logger.info(f'Frames received through events: {[h.health.frames for h in handlers]}')
+    return results
+
+
+def frame_time_benchmark(exposure_times=(0.005, 0.02, 0.05, 0.1), num_cameras=2, duration=2.0, tick=1.0 / 60.0,
+                         render_time=0.002, shape=(480, 640)):
+    """
+    Measures the UI frame time, the interval between the starts of consecutive 60 Hz ticks, as the exposure time of
+    simulated cameras grows. Polling ticks block on ``GetNextImage``; with grab threads a tick only takes the frames
+    already published.
+
+    :param render_time: Simulated work per tick besides grabbing, e.g. the texture upload, in seconds.
+    :return: ``{exposure_time: {'poll': (p50_ms, max_ms), 'thread': (p50_ms, max_ms)}}``
+    :rtype: dict
+    """
+    from acquistion import CameraDescriptor
+
+    def run(ui_tick):
+        starts = []
+        end = time.perf_counter() + duration
+        while time.perf_counter() < end:
+            start = time.perf_counter()
+            starts.append(start)
+            ui_tick()
+            time.sleep(render_time)
+            time.sleep(max(tick - (time.perf_counter() - start), 0))
+        frame_times = 1000 * np.diff(starts)
+        return float(np.percentile(frame_times, 50)), float(frame_times.max())
+
+    results = {}
+    for exposure_time in exposure_times:
+        # free-running as fast as the exposure time allows
+        cams = simulated_pyspin.open_cameras(num_cameras, width=shape[1], height=shape[0], fps=0.0,
+                                             exposure_time=exposure_time)
+        for cam in cams:
+            cam.BeginAcquisition()
+        poll = run(lambda: [cam.GetNextImage(1000).Release() for cam in cams])
+        mailboxes = [FrameMailbox() for _ in cams]
+        workers = [grab_thread(cam, CameraDescriptor(i, cam.serial_number), mailbox)
+                   for i, (cam, mailbox) in enumerate(zip(cams, mailboxes))]
+        for worker in workers:
+            worker.start()
+        threaded = run(lambda: [(mailbox.latest.take(), mailbox.drain()) for mailbox in mailboxes])
+        for worker in workers:
+            worker.stop()
+            worker.join()
+        for cam in cams:
+            cam.EndAcquisition()
+            cam.DeInit()
+        results[exposure_time] = {'poll': poll, 'thread': threaded}
+        logger.info(f'Exposure {1000 * exposure_time:.0f} ms: UI frame time p50/max {poll[0]:.1f}/{poll[1]:.1f} ms '
+                    f'polling, {threaded[0]:.1f}/{threaded[1]:.1f} ms with grab threads')
+    return results
+
+
+if __name__ == '__main__':
+    benchmark()
+    frame_time_benchmark()
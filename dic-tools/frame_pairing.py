@@ -0,0 +1,96 @@
+"""
+Timestamp-based pairing of frames from N cameras.
+
+``FramePairer`` buffers frames per camera in deques, which stay sorted because each camera's timestamps only
+increase. Whenever every camera has a frame waiting, the oldest heads are either emitted together (all within the
+tolerance) or the oldest head is discarded as an orphan. Every frame is appended and popped exactly once, so
+matching is O(1) per frame and a single dropped frame costs one orphan instead of shifting every later pair.
+"""
+import time
+from collections import deque, namedtuple
+from loguru import logger
+
+MatchedFrames = namedtuple('MatchedFrames', 'timestamp frames')
+
+
+def frame_timestamp(image_result):
+    """
+    :return: The chunk timestamp of an image if chunk data is enabled, otherwise its buffer timestamp, in ns.
+    :rtype: int
+    """
+    try:
+        return image_result.GetChunkData().GetTimestamp()
+    except Exception:
+        return image_result.GetTimeStamp()
+
+
+class FramePairer:
+    """
+    Emits tuples of one frame per camera whose timestamps lie within ``tolerance_ns`` of each other.
+
+    Camera clocks are independent, so each camera's timestamps are shifted by its entry in ``clock_offsets``
+    (device time minus host ``perf_counter_ns`` time) before matching. A camera without an offset gets one
+    estimated from the arrival time of its first frame.
+
+    :param n_cameras: Number of cameras.
+    :param tolerance_ns: Largest timestamp spread allowed within a tuple.
+    :param clock_offsets: Per-camera clock offsets in ns, e.g. from ``acquistion.latch_clock_offsets``.
+    :param max_pending: Frames buffered per camera before the oldest is discarded, so a stalled camera cannot grow
+        the buffers without bound.
+    """
+
+    def __init__(self, n_cameras, tolerance_ns, clock_offsets=None, max_pending=256):
+        self.n_cameras = n_cameras
+        self.tolerance_ns = tolerance_ns
+        self.clock_offsets = list(clock_offsets) if clock_offsets is not None else [None] * n_cameras
+        self.max_pending = max_pending
+        self.pending = [deque() for _ in range(n_cameras)]
+        self.matched = 0
+        self.orphans = [0] * n_cameras
+
+    def push(self, camera_index, timestamp, frame):
+        """
+        Adds a frame and returns every tuple it completes.
+
+        :param camera_index: Index of the camera the frame came from.
+        :param timestamp: Device timestamp of the frame, in ns.
+        :param frame: Anything; handed back in the matched tuple.
+        :return: Matched tuples, usually none or one, ordered by camera index.
+        :rtype: list of MatchedFrames
+        """
+        if self.clock_offsets[camera_index] is None:
+            self.clock_offsets[camera_index] = timestamp - time.perf_counter_ns()
+        pending = self.pending[camera_index]
+        pending.append((timestamp - self.clock_offsets[camera_index], frame))
+        if len(pending) > self.max_pending:
+            pending.popleft()
+            self.orphans[camera_index] += 1
+        matches = []
+        while all(self.pending):
+            heads = [p[0][0] for p in self.pending]
+            oldest = min(heads)
+            if max(heads) - oldest <= self.tolerance_ns:
+                frames = tuple(p.popleft()[1] for p in self.pending)
+                matches.append(MatchedFrames(oldest, frames))
+                self.matched += 1
+            else:
+                k = heads.index(oldest)
+                self.pending[k].popleft()
+                self.orphans[k] += 1
+        return matches
+
+    def stats(self):
+        """
+        :return: Matched tuple count, orphans per camera and frames still waiting per camera.
+        :rtype: dict
+        """
+        return {'matched': self.matched, 'orphans': list(self.orphans),
+                'pending': [len(p) for p in self.pending]}
+
+    def log_stats(self):
+        stats = self.stats()
+        if any(stats['orphans']):
+            logger.warning(f'Frame pairing: {stats}')
+        else:
+            logger.info(f'Frame pairing: {stats}')
+        return stats
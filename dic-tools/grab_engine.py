@@ -0,0 +1,257 @@
+"""
+Concurrent grab engine: one worker thread per camera feeding a shared downstream stage.
+
+Each ``CameraGrabWorker`` owns its camera's ``GetNextImage``/``Release`` loop, so one camera's frame never waits
+behind another camera's conversion or disk write. Grabbed frames are put on a single queue and handed to
+``handler`` by a small pool of sink threads.
+
+Run this module directly to compare it against the old one-camera-after-another loop using simulated cameras.
+"""
+import queue
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+if __name__ == '__main__':
+    # run as a script, the benchmark uses simulated cameras, installed before anything imports PySpin
+    import simulated_pyspin
+    simulated_pyspin.install()
+import PySpin
+from loguru import logger
+from frame_pairing import frame_timestamp
+from acquisition_health import AcquisitionHealth, HealthMonitor
+import instrumentation
+
+GrabbedFrame = namedtuple('GrabbedFrame', 'camera frame_number frame_id timestamp image')
+# a worker gives up on its camera after this many errors other than timeouts in a row, e.g. once it was unplugged
+MAX_CONSECUTIVE_ERRORS = 10
+
+
+def convert_mono8(image_result):
+    """Default per-frame processing: a Mono8 copy that stays valid after the camera buffer is released."""
+    return image_result.Convert(PySpin.PixelFormat_Mono8, PySpin.HQ_LINEAR)
+
+
+def _is_timeout(ex):
+    return getattr(ex, 'errorcode', None) == getattr(PySpin, 'SPINNAKER_ERR_TIMEOUT', -1011)
+
+
+class CameraGrabWorker(threading.Thread):
+    """
+    Grabs frames from a single camera and puts them on the downstream queue.
+
+    :param cam: Camera to grab from. Acquisition must already have begun.
+    :type cam: CameraPtr
+    :param camera: Descriptor of the camera, attached to each frame.
+    :type camera: acquistion.CameraDescriptor
+    :param downstream: Queue shared by all workers of an engine.
+    :type downstream: queue.Queue
+    :param num_frames: Number of frames to grab, or None to run until stopped.
+    :type num_frames: int or None
+    :param timeout: ``GetNextImage`` timeout in milliseconds; bounds how long a stop request can go unnoticed.
+    :type timeout: int
+    :param process: Callable applied to each complete image before its buffer is released, or None to pass the
+        image on unreleased. Incomplete and duplicate images are always released here.
+    :param health: Tracker fed every image, or None for one without stream statistics.
+    :type health: acquisition_health.AcquisitionHealth or None
+    """
+
+    def __init__(self, cam, camera, downstream, num_frames=None, timeout=1000, process=convert_mono8, health=None):
+        super(CameraGrabWorker, self).__init__(name=f'grab-{camera.index}', daemon=True)
+        self.cam = cam
+        self.camera = camera
+        self.camera_index = camera.index
+        self.downstream = downstream
+        self.num_frames = num_frames
+        self.timeout = timeout
+        self.process = process
+        self.frames_grabbed = 0
+        self.health = health if health is not None else AcquisitionHealth(f'Camera {camera.index}')
+        self.errors = 0
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def run(self):
+        frame_number = 0
+        consecutive_errors = 0
+        while not self._stop_event.is_set() and (self.num_frames is None or frame_number < self.num_frames):
+            started = instrumentation.start()
+            try:
+                image_result = self.cam.GetNextImage(self.timeout)
+            except PySpin.SpinnakerException as ex:
+                if not _is_timeout(ex):
+                    logger.error('Camera %d error: %s' % (self.camera_index, ex))
+                    self.errors += 1
+                    consecutive_errors += 1
+                    if consecutive_errors >= MAX_CONSECUTIVE_ERRORS:
+                        logger.error('Camera %d failed %d times in a row, giving up after %d frames'
+                                     % (self.camera_index, consecutive_errors, self.frames_grabbed))
+                        return
+                continue
+            consecutive_errors = 0
+            instrumentation.stop('grab', self.camera.serial_number, started)
+            passed_on = False
+            try:
+                if image_result.IsIncomplete():
+                    logger.warning('Camera %d image incomplete with image status %d ...'
+                                   % (self.camera_index, image_result.GetImageStatus()))
+                    self.health.observe(image_result)
+                elif self.health.observe(image_result):
+                    started = instrumentation.start()
+                    image = self.process(image_result) if self.process is not None else image_result
+                    instrumentation.stop('convert', self.camera.serial_number, started)
+                    self.downstream.put(GrabbedFrame(self.camera, frame_number,
+                                                     image_result.GetFrameID(), frame_timestamp(image_result),
+                                                     image))
+                    passed_on = self.process is None
+                    self.frames_grabbed += 1
+            except PySpin.SpinnakerException as ex:
+                logger.error('Camera %d error: %s' % (self.camera_index, ex))
+                self.errors += 1
+            finally:
+                if not passed_on:
+                    image_result.Release()
+            frame_number += 1
+
+
+class GrabEngine:
+    """
+    Runs one ``CameraGrabWorker`` per camera and ``sink_workers`` threads that call ``handler`` on every frame.
+
+    :param cam_list: Cameras to grab from. Acquisition must already have begun.
+    :type cam_list: CameraList or list
+    :param cameras: Descriptor of each camera, attached to its frames.
+    :type cameras: list
+    :param handler: Called with each ``GrabbedFrame`` from a sink thread.
+    :param num_frames: Frames to grab per camera, or None to run until ``stop``.
+    :type num_frames: int or None
+    :param queue_size: Bound on frames waiting for the downstream stage; workers block when it is full.
+    :type queue_size: int
+    :param sink_workers: Number of downstream threads. Defaults to one per camera.
+    :type sink_workers: int or None
+    :param health: Tracker for each camera; sampled once a second while the engine runs.
+    :type health: list or None
+    """
+
+    def __init__(self, cam_list, cameras, handler, num_frames=None, queue_size=64, sink_workers=None, timeout=1000,
+                 process=convert_mono8, health=None):
+        cams = list(cam_list)
+        self.num_frames = num_frames
+        self.handler = handler
+        self.frames = queue.Queue(maxsize=queue_size)
+        health = health or [None] * len(cams)
+        self.workers = [CameraGrabWorker(cam, camera, self.frames, num_frames, timeout, process, tracker)
+                        for cam, camera, tracker in zip(cams, cameras, health)]
+        self.monitor = HealthMonitor([worker.health for worker in self.workers])
+        self.sinks = [threading.Thread(target=self._sink, name=f'grab-sink-{i}', daemon=True)
+                      for i in range(sink_workers or max(len(cams), 1))]
+        self.handler_errors = 0
+        self._errors_lock = threading.Lock()
+
+    def _sink(self):
+        while True:
+            frame = self.frames.get()
+            try:
+                if frame is None:
+                    return
+                self.handler(frame)
+            except Exception as ex:
+                logger.error('Error handling frame %d from camera %d: %s' % (frame.frame_number,
+                                                                             frame.camera.index, ex))
+                with self._errors_lock:
+                    self.handler_errors += 1
+            finally:
+                self.frames.task_done()
+
+    def start(self):
+        for thread in self.sinks + self.workers:
+            thread.start()
+        self.monitor.start()
+        return self
+
+    def stop(self):
+        """Asks the workers to finish after their current ``GetNextImage``."""
+        for worker in self.workers:
+            worker.stop()
+
+    def join(self):
+        """
+        Waits for all workers to finish and the downstream stage to drain.
+
+        :return: True if no frame was lost to an error, False otherwise.
+        :rtype: bool
+        """
+        for worker in self.workers:
+            worker.join()
+        self.monitor.stop()
+        for _ in self.sinks:
+            self.frames.put(None)
+        for sink in self.sinks:
+            sink.join()
+        return self.handler_errors == 0 and all(w.errors == 0 and w.health.lost == 0 for w in self.workers)
+
+    @property
+    def frames_grabbed(self):
+        return sum(w.frames_grabbed for w in self.workers)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # a counted run finishes on its own; an open-ended one runs for the duration of the block
+        if exc_type is not None or self.num_frames is None:
+            self.stop()
+        self.join()
+
+
+def _save_to(directory):
+    def save(frame):
+        frame.image.Save(str(Path(directory) / f'{frame.camera.serial_number}-{frame.frame_number}.raw'))
+    return save
+
+
+def benchmark(camera_counts=(1, 2, 4), num_frames=40, fps=30.0, convert_time=0.005, save_time=0.02, shape=(480, 640)):
+    """
+    Compares aggregate throughput of the sequential grab loop with the grab engine on simulated cameras.
+
+    :return: ``{num_cameras: (sequential_fps, engine_fps)}``
+    :rtype: dict
+    """
+    from acquistion import CameraDescriptor
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        save = _save_to(directory)
+        for num_cameras in camera_counts:
+            def make_cams():
+                cams = simulated_pyspin.open_cameras(num_cameras, width=shape[1], height=shape[0], fps=fps,
+                                                     convert_time=convert_time, save_time=save_time)
+                for cam in cams:
+                    cam.BeginAcquisition()
+                return cams
+
+            cams = make_cams()
+            start = time.perf_counter()
+            for n in range(num_frames):
+                for i, cam in enumerate(cams):
+                    image_result = cam.GetNextImage()
+                    save(GrabbedFrame(CameraDescriptor(i, cam.serial_number), n, image_result.GetFrameID(), 0,
+                                      convert_mono8(image_result)))
+                    image_result.Release()
+            sequential = num_cameras * num_frames / (time.perf_counter() - start)
+
+            cams = make_cams()
+            start = time.perf_counter()
+            cameras = [CameraDescriptor(i, cam.serial_number) for i, cam in enumerate(cams)]
+            with GrabEngine(cams, cameras, save, num_frames) as engine:
+                pass
+            concurrent = engine.frames_grabbed / (time.perf_counter() - start)
+            results[num_cameras] = (sequential, concurrent)
+            logger.info(f'{num_cameras} camera(s): sequential {sequential:.1f} fps, engine {concurrent:.1f} fps')
+    return results
+
+
+if __name__ == '__main__':
+    benchmark()
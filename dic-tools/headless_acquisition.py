@@ -0,0 +1,330 @@
+"""
+Headless acquisition for unattended tests, without the Kivy UI.
+
+Records from every connected camera (or the ones chosen by serial number) until one of these happens:
+
+* ``--count N``: N frames per camera were recorded,
+* ``--duration SECONDS``: the time is up,
+* neither: the run is stopped with Ctrl+C or by creating the ``--stop-file``.
+
+Cameras either free-run at ``--rate`` frames per second or are software triggered together at ``--rate`` triggers
+per second on an absolute timeline (``--trigger timed``), so the rate does not drift however long the run. For
+creep and fatigue tests, ``--schedule`` triggers at the times of a variable-rate schedule instead, e.g. densely
+around load steps, and the cameras stay armed and idle in between; planned and actual trigger times are logged to
+``schedule_log.csv`` in the save directory. With ``--trigger counter`` the host takes no part in the timing: the
+counter of the first camera outputs a strobe at ``--rate`` on its output line, which has to be wired to the trigger
+input of the other cameras (see ``acquistion.configure_counter_trigger``), so every pair is exposed together at rates
+Python could not pace.
+
+Frames go to the fastest writer by default, a ``sequence`` file, where each frame is a copy into a memory-mapped
+slot; ``raw`` writes one ``.raw`` file per frame and ``jpeg`` encodes every frame. ``shared_memory`` also writes
+``.raw`` files but grabs from a process per camera (see ``shared_memory_acquisition``), so per-frame Python work does
+not share one GIL; it only works with free-running cameras.
+
+    python headless_acquisition.py D:/fatigue --duration 43200 --trigger timed --rate 2 --exposure 5000
+    python headless_acquisition.py D:/creep --schedule creep.json --policy skip --format raw
+    python headless_acquisition.py D:/impact --count 2000 --trigger counter --rate 150 --exposure 2000 --format raw
+
+Set ``DIC_TOOLS_SIMULATE=1`` to try it out on simulated cameras.
+"""
+import argparse
+import itertools
+import sys
+import time
+from datetime import datetime as dt
+from pathlib import Path
+from loguru import logger
+import simulated_pyspin
+simulated_pyspin.install_if_requested()  # DIC_TOOLS_SIMULATE runs the recording on simulated cameras
+import acquistion as cam_aq
+import PySpin
+import acquisition_health
+import camera_startup
+import event_acquisition
+import grab_engine
+import image_writer
+import instrumentation
+import interval_scheduler
+import raw_capture
+import stereo_sequence
+import trigger_dispatch
+
+FREE = 'free'
+TIMED = 'timed'
+COUNTER = 'counter'
+SHARED_MEMORY = 'shared_memory'
+FORMATS = ('sequence', 'raw', 'jpeg', SHARED_MEMORY)
+SCHEDULE_LOG = 'schedule_log.csv'
+
+
+class StopConditions:
+    """
+    Decides when a run is over.
+
+    :param count: Frames per camera to record, or None.
+    :param duration: Seconds to record for, or None.
+    :param stop_file: File whose appearance stops the run, or None.
+    """
+
+    def __init__(self, count=None, duration=None, stop_file=None):
+        self.count = count
+        self.duration = duration
+        self.stop_file = Path(stop_file) if stop_file is not None else None
+        self.started = None
+        self.reason = None
+
+    def start(self):
+        self.started = time.monotonic()
+
+    def reached(self, engine):
+        return self.reached_frames([worker.frames_grabbed for worker in engine.workers],
+                                   any(worker.is_alive() for worker in engine.workers))
+
+    def reached_frames(self, frames, running):
+        """
+        :param frames: Frames recorded from each camera so far.
+        :param running: Whether any camera is still recording.
+        """
+        if self.count is not None and all(recorded >= self.count for recorded in frames):
+            self.reason = f'{self.count} frames recorded'
+        elif self.duration is not None and time.monotonic() - self.started >= self.duration:
+            self.reason = f'{self.duration} s elapsed'
+        elif self.stop_file is not None and self.stop_file.exists():
+            self.reason = f'{self.stop_file} appeared'
+        elif not running:
+            self.reason = 'every camera stopped'
+        return self.reason is not None
+
+
+def open_writer(image_format, save_directory, cameras, project_name):
+    """
+    Sets up the writer for one run.
+
+    :return: The grab engine's ``process`` step, its frame handler and a function closing the writer that returns
+        True if nothing was lost.
+    :rtype: tuple
+    """
+    if image_format == 'sequence':
+        path = save_directory / f'{project_name}_{dt.now():%Y%m%d_%H%M%S}{stereo_sequence.EXTENSION}'
+        first = cameras[0]
+        sequence = stereo_sequence.StereoSequence.create(
+            path, len(cameras), first.height, first.width, first.dtype, project_name=project_name,
+            serial_numbers=[camera.serial_number for camera in cameras],
+            cameras=[camera.metadata() for camera in cameras])
+        logger.info(f'Recording sequence to {path}')
+
+        def write(frame):
+            sequence.write(frame.frame_number, frame.camera.index, frame.image.GetNDArray(),
+                           frame_id=frame.frame_id, timestamp=frame.timestamp)
+
+        def close():
+            logger.info(f'Sequence closed with {len(sequence)} frames: {path}')
+            sequence.close()
+            return True
+        return event_acquisition.copy_frame, write, close
+
+    if image_format == 'raw':
+        process, extension = raw_capture.copy_raw_frame, 'raw'
+    else:
+        process, extension = grab_engine.convert_mono8, 'jpg'
+    writer = image_writer.ImageWriterPool(workers=cam_aq.WRITER_WORKERS, max_queue=cam_aq.WRITER_QUEUE_SIZE,
+                                          policy=cam_aq.WRITER_POLICY, spill_path=save_directory / 'spill.raw')
+    write = cam_aq.write_grabbed_frames(writer, cam_aq.grabbed_frame_templates(save_directory, cameras, extension),
+                                        log_frames=False)
+
+    def close():
+        writer.close()
+        return writer.errors == 0 and writer.dropped == 0
+    return process, write, close
+
+
+def fire_timed(dispatcher, schedule, stop, engine, policy=interval_scheduler.SKIP, log_path=None):
+    """
+    Fires every camera's trigger at the planned times of ``schedule`` until it ends or ``stop`` is reached.
+
+    :return: Triggers fired, skipped and failed, as counted by the scheduler.
+    :rtype: dict
+    """
+    if stop.count is not None:
+        schedule = itertools.islice(schedule, stop.count)
+    scheduler = interval_scheduler.IntervalScheduler(schedule, lambda n: dispatcher.fire(), policy, log_path)
+    counts = scheduler.run(lambda: stop.reached(engine))
+    if stop.reason is None:
+        # the schedule ended, so give the last frames a second to arrive before calling them lost
+        deadline = time.monotonic() + 1.0
+        while not stop.reached(engine) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if stop.reason is None:
+            stop.reason = 'frames missing after the last trigger' if stop.count is not None else 'schedule ended'
+    return counts
+
+
+def run(save_directory, count=None, duration=None, stop_file=None, trigger=FREE, rate=10.0, exposure_time=None,
+        image_format='sequence', serial_numbers=None, project_name='headless', schedule=None,
+        policy=interval_scheduler.SKIP):
+    """
+    Records until a stop condition is reached.
+
+    :param save_directory: Directory the frames are saved in; created if needed.
+    :param count: Frames per camera to record, or None.
+    :param duration: Seconds to record for, or None.
+    :param stop_file: File whose appearance stops the run, or None.
+    :param trigger: ``'free'`` to free-run at ``rate``, ``'timed'`` for software triggers at ``rate`` or
+        ``'counter'`` for hardware triggers at ``rate`` from the first camera's counter.
+    :param rate: Frames or triggers per second.
+    :param exposure_time: Exposure time in microseconds, or None to keep the camera's.
+    :param image_format: One of ``FORMATS``.
+    :param serial_numbers: Cameras to use, or None for every camera found.
+    :param schedule: Planned trigger times in seconds from the start, see ``interval_scheduler``; implies timed
+        triggering. None triggers at ``rate``.
+    :param policy: What to do with triggers that are overdue, ``interval_scheduler.SKIP`` or ``CATCH_UP``.
+    :return: True if every camera recorded without losing frames, False otherwise.
+    :rtype: bool
+    """
+    save_directory = Path(save_directory).absolute()
+    if schedule is not None:
+        trigger = TIMED
+    if image_format == SHARED_MEMORY and trigger != FREE:
+        logger.error(f'{SHARED_MEMORY} only records free-running cameras. Aborting...')
+        return False
+    save_directory.mkdir(parents=True, exist_ok=True)
+    system = PySpin.System.GetInstance()
+    camera_list = system.GetCameras()
+    cam_list = [cam for cam in camera_list if serial_numbers is None or serial_number(cam) in serial_numbers]
+    logger.info(f'{len(cam_list)} of {camera_list.GetSize()} cameras selected')
+
+    def start_camera(i, cam):
+        cam.Init()
+        cam_aq.invalidate_camera_nodes(cam)
+        if cam_aq.configure_camera(cam, buffer_mode='OldestFirst') is False or \
+                not cam_aq.enable_chunk_timestamps(cam):
+            return False
+        if trigger == TIMED:
+            return cam_aq.configure_frame_rate(cam, exposure_time=exposure_time) and \
+                cam_aq.configure_trigger(cam, cam_aq.triggers.software)
+        if trigger == COUNTER:
+            return cam_aq.configure_frame_rate(cam, exposure_time=exposure_time) and \
+                cam_aq.configure_counter_trigger(cam, i == 0, rate)
+        cam_aq.reset_trigger(cam_aq.camera_nodes(cam))
+        return cam_aq.configure_frame_rate(cam, rate, exposure_time)
+
+    result = False
+    startup = camera_startup.start_cameras(cam_list, start_camera, timeout=cam_aq.STARTUP_TIMEOUT)
+    ready = [started.cam for started in startup if started.ok]
+    if ready and len(ready) == len(cam_list) and image_format == SHARED_MEMORY:
+        result = record_shared_memory(ready, save_directory, StopConditions(count, duration, stop_file), rate)
+    elif ready and len(ready) == len(cam_list):
+        result = record(ready, save_directory, StopConditions(count, duration, stop_file), trigger, rate,
+                        image_format, project_name, schedule, policy)
+    else:
+        logger.error('Not every camera could be started. Aborting...')
+    deinitialize(cam_list)
+    # every camera reference has to be gone before the system is released
+    del ready, startup, cam_list
+    camera_list.Clear()
+    system.ReleaseInstance()
+    return result
+
+
+def serial_number(cam):
+    """:return: The serial number of a camera, read from the transport layer without initializing it."""
+    node = cam_aq.camera_nodes(cam).string('DeviceSerialNumber', cam_aq.TL_DEVICE_NODEMAP)
+    return node.GetValue() if node is not None else None
+
+
+def deinitialize(cam_list):
+    for cam in cam_list:
+        if cam.IsInitialized():
+            cam.DeInit()
+
+
+def record(cam_list, save_directory, stop, trigger, rate, image_format, project_name, schedule=None,
+           policy=interval_scheduler.SKIP):
+    cameras = [cam_aq.describe_camera(cam, i) for i, cam in enumerate(cam_list)]
+    process, write, close_writer = open_writer(image_format, save_directory, cameras, project_name)
+    health = [acquisition_health.AcquisitionHealth('Camera %d (%s)' % (camera.index, camera.serial_number),
+                                                   cam_aq.camera_nodes(cam)) for cam, camera in zip(cam_list, cameras)]
+    dispatcher = trigger_dispatch.TriggerDispatcher.from_nodes(
+        [cam_aq.camera_nodes(cam) for cam in cam_list], [camera.serial_number for camera in cameras]) \
+        if trigger == TIMED else None
+    for cam in cam_list:
+        cam.BeginAcquisition()
+    engine = grab_engine.GrabEngine(cam_list, cameras, write, num_frames=stop.count, process=process,
+                                    sink_workers=1 if image_format == 'sequence' else None, health=health).start()
+    # every camera is armed, so all of them see the first pulse
+    strobe = cam_aq.start_counter_strobe(cam_aq.camera_nodes(cam_list[0])) if trigger == COUNTER else None
+    if schedule is not None:
+        logger.info(f'Recording {image_format} from {len(cam_list)} cameras, triggered on a schedule')
+    else:
+        logger.info(f'Recording {image_format} from {len(cam_list)} cameras, {trigger} at {rate} per second')
+    stop.start()
+    try:
+        if dispatcher is not None:
+            if schedule is None:
+                schedule = interval_scheduler.fixed_interval(1.0 / rate)
+            fire_timed(dispatcher, schedule, stop, engine, policy, save_directory / SCHEDULE_LOG)
+        else:
+            while not stop.reached(engine):
+                time.sleep(0.1)
+    except KeyboardInterrupt:
+        stop.reason = 'interrupted'
+    elapsed = time.monotonic() - stop.started
+    logger.info(f'Stopping: {stop.reason}')
+    if strobe:
+        cam_aq.stop_counter_strobe(cam_aq.camera_nodes(cam_list[0]))
+    engine.stop()
+    result = engine.join() and strobe is not False
+    if dispatcher is not None:
+        dispatcher.close()
+    for cam in cam_list:
+        cam.EndAcquisition()
+        if trigger != FREE:
+            cam_aq.reset_trigger(cam_aq.camera_nodes(cam))
+    result &= close_writer()
+    instrumentation.dump_report(save_directory / cam_aq.LATENCY_REPORT)
+    logger.info(f'Recorded {[worker.frames_grabbed for worker in engine.workers]} frames per camera in '
+                f'{elapsed:.1f} s')
+    return result
+
+
+def record_shared_memory(cam_list, save_directory, stop, rate):
+    """Records free-running cameras with a process per camera; see ``acquistion.acquire_shared_memory``."""
+    logger.info(f'Recording {SHARED_MEMORY} from {len(cam_list)} cameras, free at {rate} per second')
+    stop.start()
+    try:
+        result = cam_aq.acquire_shared_memory(cam_list, save_directory, stop.count, until=stop.reached_frames)
+    except KeyboardInterrupt:
+        stop.reason = 'interrupted'
+        result = False
+    logger.info(f'Stopped: {stop.reason or "every camera finished"} after {time.monotonic() - stop.started:.1f} s')
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Record from the cameras without the UI.')
+    parser.add_argument('save_directory', type=Path)
+    until = parser.add_mutually_exclusive_group()
+    until.add_argument('--count', type=int, default=None, help='frames per camera to record')
+    until.add_argument('--duration', type=float, default=None, help='seconds to record for')
+    parser.add_argument('--stop-file', type=Path, default=None, help='stop once this file exists')
+    parser.add_argument('--trigger', choices=(FREE, TIMED, COUNTER), default=FREE)
+    parser.add_argument('--rate', type=float, default=10.0, help='frames or triggers per second')
+    parser.add_argument('--schedule', type=Path, default=None,
+                        help='JSON schedule of trigger times, see interval_scheduler.load_schedule; implies timed')
+    parser.add_argument('--policy', choices=(interval_scheduler.SKIP, interval_scheduler.CATCH_UP),
+                        default=interval_scheduler.SKIP, help='what to do with overdue triggers')
+    parser.add_argument('--exposure', type=float, default=None, help='exposure time in microseconds')
+    parser.add_argument('--format', choices=FORMATS, default=FORMATS[0])
+    parser.add_argument('--cameras', nargs='+', default=None, help='serial numbers of the cameras to use')
+    parser.add_argument('--project', default='headless', help='project name used in file names')
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args(argv)
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    schedule = interval_scheduler.load_schedule(args.schedule) if args.schedule is not None else None
+    return run(args.save_directory, args.count, args.duration, args.stop_file, args.trigger, args.rate,
+               args.exposure, args.format, args.cameras, args.project, schedule, args.policy)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,324 @@
+"""
+Background image writer: a pool of threads fed by a bounded queue.
+
+Grabbers call ``ImageWriterPool.submit`` instead of ``image.Save`` so that encoding and disk writes never stall the
+grab path. When the queue is full the pool either blocks the caller, drops the oldest queued image, or spills the
+image's raw pixels to a single append-only file that is far cheaper to write than a JPEG.
+
+Every path handed to the pool is absolute, built from ``FilenameTemplates`` computed once per session, so writer
+threads never depend on the process's working directory and any number of them can save at the same time. Run this
+module directly to hammer the pool with concurrent saves from several simulated cameras.
+"""
+import json
+import os
+import queue
+import tempfile
+import threading
+import time
+from pathlib import Path
+import numpy as np
+from loguru import logger
+import instrumentation
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop_oldest'
+SPILL = 'spill'
+POLICIES = (BLOCK, DROP_OLDEST, SPILL)
+
+
+def save_image(image, path):
+    """Default write function: lets the image encode itself based on the file extension."""
+    image.Save(str(path))
+
+
+def _escape_braces(value):
+    """Doubles the braces of a string so that ``str.format`` leaves it as it is."""
+    return value.replace('{', '{{').replace('}', '}}') if isinstance(value, str) else value
+
+
+def image_array(image):
+    """Returns the pixels of a PySpin image or NumPy array as an array."""
+    return image if isinstance(image, np.ndarray) else image.GetNDArray()
+
+
+class FilenameTemplates:
+    """
+    Absolute filename templates for every camera of one recording session.
+
+    The session and camera fields of ``pattern`` are filled in once; per-frame fields are written in double braces
+    and filled in by ``path``, so building a frame's filename is a single ``str.format`` call.
+
+    :param directory: Directory the session is saved in; made absolute immediately.
+    :type directory: str or Path
+    :param pattern: Filename pattern, e.g. ``'{project_name}_{{image_id:03d}}_S#{serial_number}.{extension}'``.
+        ``{index}`` and ``{serial_number}`` are available for each camera.
+    :type pattern: str
+    :param serial_numbers: Serial number of each camera, in camera index order.
+    :type serial_numbers: list of str
+    :param session: Further fields shared by the whole session, e.g. ``project_name`` and ``extension``.
+    """
+
+    def __init__(self, directory, pattern, serial_numbers, **session):
+        self.directory = Path(directory).absolute()
+        self.serial_numbers = list(serial_numbers)
+        self.session = session
+        # the directory and session values are formatted a second time by path, so braces in them must be escaped
+        directory = _escape_braces(str(self.directory))
+        escaped = {key: _escape_braces(value) for key, value in session.items()}
+        self.templates = [directory + os.sep + pattern.format(index=index, serial_number=_escape_braces(serial_number),
+                                                              **escaped)
+                          for index, serial_number in enumerate(serial_numbers)]
+
+    def path(self, camera_index, **frame):
+        """
+        :return: The absolute path of a frame from a camera, e.g. ``templates.path(0, image_id=12)``.
+        :rtype: Path
+        """
+        return Path(self.templates[camera_index].format(**frame))
+
+    def matches(self, directory, serial_numbers, **session):
+        """Whether these templates were built for the given directory, cameras and session fields."""
+        return (self.directory == Path(directory).absolute() and self.serial_numbers == list(serial_numbers)
+                and self.session == session)
+
+
+class LatencyCounter:
+    """Running count, mean and maximum of a latency in seconds."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self):
+        return {'count': self.count, 'mean': self.total / self.count if self.count else 0.0, 'max': self.max}
+
+
+class ImageWriterPool:
+    """
+    Writes images from worker threads.
+
+    :param workers: Number of writer threads.
+    :type workers: int
+    :param max_queue: Number of images allowed to wait for a writer.
+    :type max_queue: int
+    :param policy: What ``submit`` does when the queue is full: ``'block'``, ``'drop_oldest'`` or ``'spill'``.
+    :type policy: str
+    :param spill_path: Raw file appended to under the ``'spill'`` policy. A ``.jsonl`` index of what was spilled
+        is written next to it.
+    :type spill_path: str or Path or None
+    :param write: Called as ``write(image, path)`` from a writer thread.
+    """
+
+    def __init__(self, workers=2, max_queue=64, policy=BLOCK, spill_path=None, write=save_image):
+        if policy not in POLICIES:
+            raise ValueError(f'Unknown full queue policy {policy!r}, expected one of {POLICIES}')
+        if policy == SPILL and spill_path is None:
+            raise ValueError('A spill path is required for the spill policy')
+        self.policy = policy
+        self.spill_path = Path(spill_path) if spill_path is not None else None
+        self.write = write
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+        self.max_queue_depth = 0
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.errors = 0
+        self._closed = False
+        self.write_latency = LatencyCounter()
+        self.total_latency = LatencyCounter()
+        self._threads = [threading.Thread(target=self._run, name=f'image-writer-{i}', daemon=True)
+                         for i in range(workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, image, path, camera=None):
+        """
+        Queues an image to be written to ``path``.
+
+        :param camera: Label the write latency is recorded under by ``instrumentation``, e.g. a serial number.
+
+        :return: True if the image was queued, False if it was spilled or caused another image to be dropped.
+        :rtype: bool
+        """
+        if self._closed:
+            raise RuntimeError('Cannot submit to a closed image writer')
+        job = (image, path, time.perf_counter(), camera)
+        if self.policy == BLOCK:
+            self._queue.put(job)
+            queued = True
+        else:
+            try:
+                self._queue.put_nowait(job)
+                queued = True
+            except queue.Full:
+                queued = False
+                if self.policy == SPILL:
+                    self._spill(image, path)
+                else:
+                    self._drop_oldest_and_put(job)
+        depth = self._queue.qsize()
+        with self._lock:
+            if depth > self.max_queue_depth:
+                self.max_queue_depth = depth
+        return queued
+
+    def _drop_oldest_and_put(self, job):
+        while True:
+            try:
+                self._queue.get_nowait()
+                self._queue.task_done()
+                with self._lock:
+                    self.dropped += 1
+            except queue.Empty:
+                pass
+            try:
+                self._queue.put_nowait(job)
+                return
+            except queue.Full:
+                continue
+
+    def spill_to(self, spill_path):
+        """Spills to another file from now on, e.g. when the session or its save directory changes."""
+        with self._spill_lock:
+            self.spill_path = Path(spill_path)
+
+    def _spill(self, image, path):
+        arr = image_array(image)
+        with self._spill_lock:
+            spill_path = self.spill_path
+            with open(spill_path, 'ab') as spill_file:
+                offset = spill_file.tell()
+                spill_file.write(np.ascontiguousarray(arr).data)
+            with open(str(spill_path) + '.jsonl', 'a') as index_file:
+                index_file.write(json.dumps({'path': str(path), 'offset': offset, 'shape': list(arr.shape),
+                                             'dtype': str(arr.dtype)}) + '\n')
+            self.spilled += 1
+        logger.warning(f'Writer queue full, spilled {path} to {spill_path}')
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            try:
+                if job is None:
+                    return
+                image, path, submitted, camera = job
+                start = time.perf_counter()
+                self.write(image, path)
+                done = time.perf_counter()
+                # PySpin encodes and writes in one Save call, so both land in the 'write' stage
+                if instrumentation.enabled:
+                    instrumentation.record('queue', camera, start - submitted)
+                    instrumentation.record('write', camera, done - start)
+                with self._lock:
+                    self.written += 1
+                    self.write_latency.add(done - start)
+                    self.total_latency.add(done - submitted)
+            except Exception as ex:
+                logger.error(f'Error writing {job[1]}: {ex}')
+                with self._lock:
+                    self.errors += 1
+            finally:
+                self._queue.task_done()
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize()
+
+    def stats(self):
+        """
+        Snapshot of the pool's counters.
+
+        :return: Queue depth, maximum queue depth, written/dropped/spilled/error counts, and the latency of the
+            write alone and from ``submit`` to written, in seconds.
+        :rtype: dict
+        """
+        with self._lock:
+            return {'queue_depth': self.queue_depth, 'max_queue_depth': self.max_queue_depth,
+                    'written': self.written, 'dropped': self.dropped, 'spilled': self.spilled,
+                    'errors': self.errors, 'write_latency': self.write_latency.as_dict(),
+                    'total_latency': self.total_latency.as_dict()}
+
+    def flush(self):
+        """Blocks until every queued image has been written."""
+        self._queue.join()
+
+    def close(self):
+        """Writes everything still queued and stops the writer threads."""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        logger.info(f'Image writer closed: {self.stats()}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def stress_concurrent_saves(num_cameras=4, frames_per_camera=250, workers=8, shape=(256, 320)):
+    """
+    Stress check, run by hand: saves frames from several simulated cameras through one pool with many writer threads
+    and checks that every file landed at its own absolute path with its own frame. Each frame carries its camera
+    index and image ID in its first pixels, so a frame written under another frame's path does not go unnoticed.
+
+    :return: The pool's stats after closing.
+    :rtype: dict
+    :raises AssertionError: If a file is missing, has the wrong content, or the pool reported errors.
+    """
+    import simulated_pyspin
+    cams = simulated_pyspin.open_cameras(num_cameras, width=shape[1], height=shape[0], fps=0.0)
+    for cam in cams:
+        cam.BeginAcquisition()
+    with tempfile.TemporaryDirectory() as directory:
+        templates = FilenameTemplates(directory, 'stress_{{image_id:04d}}_S#{serial_number}.raw',
+                                      [cam.serial_number for cam in cams])
+        expected = {}
+
+        def grab(index, cam):
+            for image_id in range(frames_per_camera):
+                image_result = cam.GetNextImage()
+                array = image_result.GetNDArray().copy()
+                image_result.Release()
+                array.reshape(-1)[:4] = np.array([index, image_id], dtype='<u2').view(np.uint8)
+                path = templates.path(index, image_id=image_id)
+                expected[path] = array
+                pool.submit(simulated_pyspin.Image(array), path, cam.serial_number)
+
+        start = time.perf_counter()
+        with ImageWriterPool(workers=workers, max_queue=4 * workers) as pool:
+            grabbers = [threading.Thread(target=grab, args=(i, cam)) for i, cam in enumerate(cams)]
+            for thread in grabbers:
+                thread.start()
+            for thread in grabbers:
+                thread.join()
+        elapsed = time.perf_counter() - start
+        for cam in cams:
+            cam.EndAcquisition()
+            cam.DeInit()
+        stats = pool.stats()
+        assert stats['errors'] == 0 and stats['written'] == num_cameras * frames_per_camera, stats
+        assert len(list(Path(directory).iterdir())) == len(expected)
+        for path, array in expected.items():
+            assert np.array_equal(np.fromfile(str(path), dtype=array.dtype).reshape(array.shape), array), path
+    logger.info(f'{len(expected)} concurrent saves from {num_cameras} cameras on {workers} writer threads in '
+                f'{elapsed:.2f} s, all files intact')
+    return stats
+
+
+if __name__ == '__main__':
+    stress_concurrent_saves()
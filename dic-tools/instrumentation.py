@@ -0,0 +1,153 @@
+"""
+Lightweight per-stage latency instrumentation.
+
+Code on the frame path brackets each stage with ``start`` and ``stop``::
+
+    t = instrumentation.start()
+    image_result = cam.GetNextImage()
+    instrumentation.stop('grab', serial_number, t)
+
+While disabled ``start`` returns 0 and ``stop`` returns on its first comparison, so the calls can stay in place.
+While enabled each (stage, camera) pair gets a histogram with fixed log-spaced buckets from 1 us to 10 s; recording a
+sample is a bisect and an increment under that histogram's own lock, so only threads recording the same stage of the
+same camera ever wait for each other. ``report`` turns the histograms into p50/p95/p99 latencies and ``dump_report``
+writes them to a JSON file at the end of a session. Set ``DIC_TOOLS_INSTRUMENT=1`` or call ``enable`` to turn it on.
+"""
+import bisect
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from loguru import logger
+
+# bucket i holds samples in (BUCKET_EDGES[i - 1], BUCKET_EDGES[i]]; the last bucket holds everything above 10 s
+BUCKETS_PER_DECADE = 20
+BUCKET_EDGES = [10 ** (exponent / BUCKETS_PER_DECADE) for exponent in range(-6 * BUCKETS_PER_DECADE,
+                                                                             1 * BUCKETS_PER_DECADE + 1)]
+
+enabled = os.environ.get('DIC_TOOLS_INSTRUMENT', '') not in ('', '0')
+_histograms = {}
+_lock = threading.Lock()
+
+
+class StageHistogram:
+    """Latency histogram of one stage on one camera, in seconds."""
+
+    __slots__ = ('counts', 'count', 'total', 'max', 'lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKET_EDGES) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        # a stage may be recorded from several threads, e.g. the writer pool's
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        bucket = bisect.bisect_left(BUCKET_EDGES, seconds)
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, q):
+        """
+        :return: Upper edge of the bucket holding the ``q``-th percentile, or the maximum for the overflow bucket.
+        :rtype: float
+        """
+        if not self.count:
+            return 0.0
+        target = q / 100 * self.count
+        cumulative = 0
+        for i, bucket_count in enumerate(self.counts):
+            cumulative += bucket_count
+            if cumulative >= target:
+                return min(BUCKET_EDGES[i], self.max) if i < len(BUCKET_EDGES) else self.max
+        return self.max
+
+    def summary(self):
+        with self.lock:
+            return self._summary()
+
+    def _summary(self):
+        return {'count': self.count, 'mean_ms': self.total / self.count * 1000 if self.count else 0.0,
+                'p50_ms': self.percentile(50) * 1000, 'p95_ms': self.percentile(95) * 1000,
+                'p99_ms': self.percentile(99) * 1000, 'max_ms': self.max * 1000}
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def reset():
+    with _lock:
+        _histograms.clear()
+
+
+def start():
+    """
+    :return: Start time of a stage, or 0 while instrumentation is disabled.
+    :rtype: float
+    """
+    return time.perf_counter() if enabled else 0.0
+
+
+def stop(stage, camera, started):
+    """
+    Records the time since ``started`` against ``stage`` of ``camera``.
+
+    :param stage: Stage name, e.g. ``'grab'``, ``'convert'``, ``'save'``.
+    :param camera: Camera label, e.g. its serial number.
+    :param started: Value returned by ``start``.
+    """
+    if not started:
+        return
+    record(stage, camera, time.perf_counter() - started)
+
+
+def record(stage, camera, seconds):
+    """Records a latency measured by the caller, e.g. the time an item waited in a queue."""
+    key = (stage, camera)
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(key, StageHistogram())
+    histogram.record(seconds)
+
+
+def report():
+    """
+    :return: ``{camera: {stage: latency summary}}`` for every stage recorded so far.
+    :rtype: dict
+    """
+    result = {}
+    with _lock:
+        items = list(_histograms.items())
+    for (stage, camera), histogram in sorted(items, key=lambda item: (str(item[0][1]), item[0][0])):
+        result.setdefault(str(camera), {})[stage] = histogram.summary()
+    return result
+
+
+def dump_report(path):
+    """
+    Writes ``report()`` to a JSON file if anything was recorded.
+
+    :return: The path written, or None.
+    """
+    latencies = report()
+    if not latencies:
+        return None
+    path = Path(path)
+    with open(path, 'w') as report_file:
+        json.dump({'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'latencies': latencies}, report_file, indent=2)
+    logger.info(f'Latency report written to {path.absolute()}')
+    return path
@@ -0,0 +1,222 @@
+"""
+Drift-free capture scheduling for long time-lapse tests.
+
+A schedule is a sequence of planned capture times, in seconds from the start of the test. ``IntervalScheduler``
+waits for each one against ``time.monotonic`` and the start time only, so a late capture never shifts the ones after
+it: after three days at one pair every 5 s the last capture is still planned at exactly 51840 periods. When the
+host falls behind, the policy decides what happens to the captures that are already overdue:
+
+* ``skip``: only the most recent overdue capture is taken and the others are logged as skipped,
+* ``catch_up``: every overdue capture is taken, back to back.
+
+Schedules need not be regular. ``segments`` chains constant-rate phases and ``around_events`` captures densely
+around known moments such as load steps and sparsely in between; both can be loaded from a JSON file with
+``load_schedule``.
+
+Every capture's planned and actual time and its outcome are written to a CSV log, and the lateness is summarized
+when the run ends. Between captures nothing happens on the cameras: they stay armed in trigger mode and idle.
+"""
+import csv
+import json
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime as dt
+from loguru import logger
+from instrumentation import StageHistogram
+
+SKIP = 'skip'
+CATCH_UP = 'catch_up'
+FIRED = 'fired'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+Segment = namedtuple('Segment', 'duration period')
+CaptureRecord = namedtuple('CaptureRecord', 'index planned actual status')
+
+
+def fixed_interval(period, count=None):
+    """
+    :param period: Seconds between captures.
+    :param count: Number of captures, or None for an endless schedule.
+    :return: Planned capture times in seconds from the start.
+    :rtype: iterator of float
+    """
+    n = 0
+    while count is None or n < count:
+        yield n * period
+        n += 1
+
+
+def segments(segment_list, repeat_last=False):
+    """
+    Chains constant-rate phases, e.g. ``[Segment(3600, 10), Segment(60, 0.5), Segment(86400, 60)]``.
+
+    :param segment_list: Phases of ``Segment(duration, period)``, in seconds.
+    :param repeat_last: Keep capturing at the last period after the last phase ends.
+    :rtype: iterator of float
+    """
+    start = 0.0
+    period = None
+    for duration, period in segment_list:
+        # every time is computed from the phase start, so rounding errors do not accumulate within a phase
+        n = 0
+        while n * period < duration:
+            yield start + n * period
+            n += 1
+        start += duration
+    if repeat_last and period is not None:
+        for offset in fixed_interval(period):
+            yield start + offset
+
+
+def around_events(events, dense_period, window, sparse_period, end=None):
+    """
+    Captures every ``dense_period`` seconds within ``window`` seconds either side of each event and every
+    ``sparse_period`` seconds otherwise.
+
+    :param events: Times of the events, e.g. load steps, in seconds from the start.
+    :param end: Last time to plan a capture at, or None to stop a window after the last event.
+    :rtype: iterator of float
+    """
+    windows = sorted((max(event - window, 0.0), event + window) for event in events)
+    end = end if end is not None else (windows[-1][1] if windows else 0.0)
+    t = 0.0
+    while t <= end:
+        yield t
+        dense = any(low <= t < high for low, high in windows)
+        following = t + (dense_period if dense else sparse_period)
+        # do not step over the start of a dense window
+        starts = [low for low, high in windows if t < low < following]
+        t = min(starts) if starts else following
+
+
+def load_schedule(path):
+    """
+    Reads a schedule from JSON: either ``{"segments": [[duration, period], ...], "repeat_last": false}`` or
+    ``{"events": [...], "dense_period": 0.5, "window": 30, "sparse_period": 10, "end": 86400}``.
+
+    :rtype: iterator of float
+    """
+    with open(path) as schedule_file:
+        description = json.load(schedule_file)
+    if 'segments' in description:
+        return segments([Segment(*segment) for segment in description['segments']],
+                        description.get('repeat_last', False))
+    return around_events(description['events'], description['dense_period'], description['window'],
+                         description['sparse_period'], description.get('end'))
+
+
+class IntervalScheduler:
+    """
+    Calls ``capture`` at the planned times of a schedule.
+
+    :param schedule: Planned capture times in seconds from the start, in increasing order.
+    :param capture: Called with the capture number; returning False logs the capture as failed.
+    :param policy: ``SKIP`` or ``CATCH_UP``, what to do with captures that are already overdue.
+    :param log_path: CSV file that receives one line per planned capture, or None.
+    :param clock: Monotonic clock in seconds.
+    """
+
+    def __init__(self, schedule, capture, policy=SKIP, log_path=None, clock=time.monotonic):
+        if policy not in (SKIP, CATCH_UP):
+            raise ValueError(f'Unknown policy {policy!r}')
+        self.schedule = schedule
+        self.capture = capture
+        self.policy = policy
+        self.log_path = log_path
+        self.clock = clock
+        self.lateness = StageHistogram()
+        self.counts = {FIRED: 0, SKIPPED: 0, FAILED: 0}
+        self.started = None
+        self._stop = threading.Event()
+
+    def stop(self):
+        """Makes ``run`` return before the next capture; safe to call from any thread."""
+        self._stop.set()
+
+    def run(self, stop=None):
+        """
+        Runs the schedule to its end or until stopped.
+
+        :param stop: Checked at least every 100 ms while waiting; returning True ends the run. Optional.
+        :return: Captures fired, skipped and failed.
+        :rtype: dict
+        """
+        self.started = self.clock()
+        log_file = open(self.log_path, 'w', newline='') if self.log_path is not None else None
+        log = csv.writer(log_file) if log_file is not None else None
+        if log is not None:
+            log.writerow(['index', 'planned_s', 'actual_s', 'lateness_ms', 'status', 'wall_time'])
+        schedule = iter(self.schedule)
+        following = next(schedule, None)
+        n = 0
+        try:
+            while following is not None:
+                planned, following = following, next(schedule, None)
+                due = self.started + planned
+                if not self._wait_until(due, stop):
+                    break
+                now, wall = self.clock(), dt.now()
+                if self.policy == SKIP and following is not None and now >= self.started + following:
+                    status = SKIPPED
+                else:
+                    status = FIRED if self.capture(n) is not False else FAILED
+                    self.lateness.record(max(now - due, 0.0))
+                self.counts[status] += 1
+                record = CaptureRecord(n, planned, now - self.started, status)
+                if log is not None:
+                    log.writerow([record.index, f'{record.planned:.6f}', f'{record.actual:.6f}',
+                                  f'{1000 * (record.actual - record.planned):.3f}', record.status,
+                                  wall.isoformat()])
+                    log_file.flush()
+                n += 1
+        finally:
+            if log_file is not None:
+                log_file.close()
+        summary = self.lateness.summary()
+        logger.info(f'Schedule ended after {n} planned captures: {self.counts}, lateness p50 {summary["p50_ms"]:.2f} '
+                    f'ms, p99 {summary["p99_ms"]:.2f} ms, max {summary["max_ms"]:.2f} ms')
+        return dict(self.counts)
+
+    def _wait_until(self, due, stop):
+        while True:
+            if self._stop.is_set() or (stop is not None and stop()):
+                return False
+            remaining = due - self.clock()
+            if remaining <= 0:
+                return True
+            # short waits keep stop requests responsive during intervals of minutes
+            self._stop.wait(min(remaining, 0.1))
+
+
+def benchmark(period=0.05, count=100, work=0.002):
+    """
+    Compares the drift of a ``time.sleep(period)`` loop with the scheduler over ``count`` captures that each take
+    ``work`` seconds.
+
+    :return: ``{'sleep': lag of the last capture in ms, 'scheduler': ...}``
+    :rtype: dict
+    """
+    start = time.monotonic()
+    for n in range(count):
+        time.sleep(work)
+        if n < count - 1:
+            time.sleep(period)
+    results = {'sleep': 1000 * (time.monotonic() - work - start - (count - 1) * period)}
+    times = []
+
+    def capture(n):
+        times.append(time.monotonic())
+        time.sleep(work)
+
+    scheduler = IntervalScheduler(fixed_interval(period, count), capture)
+    scheduler.run()
+    results['scheduler'] = 1000 * (times[-1] - scheduler.started - (count - 1) * period)
+    logger.info(f'Lag of capture {count} after {(count - 1) * period:.1f} s: sleep loop {results["sleep"]:.1f} ms, '
+                f'scheduler {results["scheduler"]:.1f} ms')
+    return results
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,262 @@
+"""
+Preview path from a camera frame to a Kivy texture.
+
+``PreviewTexture`` keeps one texture per camera and only creates a new one when the frame size or pixel type
+changes. Frames are blitted straight from their own buffer: sensor rows run top to bottom while OpenGL textures
+run bottom to top, so the texture is flipped once through its texture coordinates instead of copying every frame
+with ``np.flipud``.
+
+The preview widget is usually a few hundred pixels wide, so frames are first decimated by a whole factor to the
+widget's size on screen with a vectorized box filter. The factor follows the widget's size and zoom; zoomed in far
+enough the full resolution is uploaded. Only the preview is decimated; recording always uses the original buffer.
+
+When zoomed in, most of the frame lies outside the viewport. ``visible_region`` maps the viewport back through the
+scatter transform onto the frame, and only that crop is blitted into its place in the texture, so focus can be
+checked pixel by pixel on a 12 MP sensor while uploading little more than the viewport's worth of pixels.
+
+Run this module directly to compare the allocations of the old copy-and-create path with this one.
+"""
+import time
+import tracemalloc
+import numpy as np
+from kivy.graphics.texture import Texture
+from loguru import logger
+
+BUFFER_FORMATS = {np.dtype(np.uint8): 'ubyte', np.dtype(np.uint16): 'ushort'}
+BOX = 'box'
+STRIDE = 'stride'
+
+
+def decimation_factor(frame_size, target_size, zoom=1.0):
+    """
+    :param frame_size: ``(width, height)`` of the frame in pixels.
+    :param target_size: ``(width, height)`` of the widget on screen in pixels.
+    :param zoom: Scale of the widget; zooming in shows fewer frame pixels per screen pixel.
+    :return: The largest whole factor that keeps the decimated frame at least as large as the widget on screen.
+    :rtype: int
+    """
+    target_width, target_height = target_size[0] * zoom, target_size[1] * zoom
+    if target_width <= 0 or target_height <= 0:
+        return 1
+    return max(1, int(min(frame_size[0] / target_width, frame_size[1] / target_height)))
+
+
+def decimate(image_arr, factor, method=BOX):
+    """
+    Shrinks a frame by a whole factor in both directions.
+
+    :param method: ``'box'`` averages each ``factor`` x ``factor`` block, which keeps speckle from aliasing;
+        ``'stride'`` keeps every ``factor``-th pixel, which is cheaper.
+    :return: The decimated frame, with the dtype of the original. Rows and columns that do not fill a whole block
+        are dropped.
+    :rtype: numpy.ndarray
+    """
+    if factor <= 1:
+        return image_arr
+    if method == STRIDE:
+        return image_arr[::factor, ::factor]
+    height, width = image_arr.shape[0] // factor, image_arr.shape[1] // factor
+    image_arr = image_arr[:height * factor, :width * factor]
+    # summing strided slices keeps every pass over memory in row order, several times faster than a 4-d reshape
+    accumulator = np.uint16 if image_arr.dtype.itemsize == 1 and factor <= 16 else np.uint32
+    rows = np.zeros((height, width * factor), dtype=accumulator)
+    for i in range(factor):
+        rows += image_arr[i::factor]
+    blocks = np.zeros((height, width), dtype=accumulator)
+    for j in range(factor):
+        blocks += rows[:, j::factor]
+    blocks //= factor * factor
+    return blocks.astype(image_arr.dtype)
+
+
+def visible_region(image_widget, viewport):
+    """
+    Finds the part of a frame that is on screen.
+
+    :param image_widget: Image widget showing the frame, possibly inside a scatter. Rotation is not supported.
+    :type image_widget: kivy.uix.image.Image
+    :param viewport: Widget whose bounds are the visible area, e.g. the parent of the scatter.
+    :return: ``(left, top, right, bottom)`` fractions of the frame's width and height, with rows counted from the
+        top like the sensor, or None if the whole frame is visible.
+    :rtype: tuple or None
+    """
+    norm_width, norm_height = image_widget.norm_image_size
+    if norm_width <= 0 or norm_height <= 0:
+        return None
+    # the texture is drawn centred in the widget at its aspect ratio
+    left = image_widget.center_x - norm_width / 2
+    bottom = image_widget.center_y - norm_height / 2
+    x0, y0 = image_widget.to_widget(*viewport.to_window(viewport.x, viewport.y))
+    x1, y1 = image_widget.to_widget(*viewport.to_window(viewport.right, viewport.top))
+    u0, u1 = sorted(min(max((x - left) / norm_width, 0.0), 1.0) for x in (x0, x1))
+    v0, v1 = sorted(min(max((y - bottom) / norm_height, 0.0), 1.0) for y in (y0, y1))
+    if u0 <= 0 and v0 <= 0 and u1 >= 1 and v1 >= 1:
+        return None
+    return u0, 1 - v1, u1, 1 - v0
+
+
+def region_bounds(region, width, height, margin=1):
+    """
+    :param region: Fractions returned by ``visible_region``.
+    :return: ``(row_start, row_stop, column_start, column_stop)`` of the region in a ``width`` x ``height`` frame,
+        widened by ``margin`` pixels so that texture filtering at the edges has valid neighbours.
+    :rtype: tuple
+    """
+    left, top, right, bottom = region
+    return (max(int(top * height) - margin, 0), min(int(np.ceil(bottom * height)) + margin, height),
+            max(int(left * width) - margin, 0), min(int(np.ceil(right * width)) + margin, width))
+
+
+def preview_buffer(image_arr):
+    """
+    :return: The pixels of a frame as a flat byte buffer, without copying unless the frame is not contiguous.
+    :rtype: numpy.ndarray
+    """
+    return np.ascontiguousarray(image_arr).reshape(-1).view(np.uint8)
+
+
+class PreviewTexture:
+    """
+    The reusable texture of one camera's preview.
+
+    :param widget: Image widget the texture is shown on; its size sets the decimation factor.
+    :type widget: kivy.uix.image.Image
+    :param method: Decimation method, see ``decimate``.
+    :type method: str
+    :param create_texture: Called like ``Texture.create`` to make the texture; defaults to ``Texture.create``.
+    """
+
+    def __init__(self, widget, method=BOX, create_texture=None):
+        self.widget = widget
+        self.method = method
+        self.create_texture = create_texture if create_texture is not None else Texture.create
+        self.texture = None
+        self.textures_created = 0
+        self.uploads = 0
+        self.uploaded_pixels = 0
+        self.zoom = 1.0
+        self.target_size = tuple(widget.size)
+        widget.bind(size=self.on_widget_size)
+
+    def on_widget_size(self, widget, size):
+        # the next frame is decimated for the new size, which recreates the texture once
+        self.target_size = tuple(size)
+
+    def _texture_for(self, width, height, dtype):
+        bufferfmt = BUFFER_FORMATS.get(dtype, 'ubyte')
+        if self.texture is None or self.texture.size != (width, height) or self.texture.bufferfmt != bufferfmt:
+            self.texture = self.create_texture(size=(width, height), colorfmt='luminance', bufferfmt=bufferfmt)
+            self.texture.flip_vertical()
+            self.textures_created += 1
+            self.widget.texture = self.texture
+            logger.debug(f'Preview texture created for {width}x{height} {dtype} frames')
+        return self.texture
+
+    def update(self, image_arr, region=None):
+        """
+        Decimates a frame to the widget's size and uploads it, creating the texture only if the decimated size or the
+        pixel type changed.
+
+        :param region: Visible part of the frame as returned by ``visible_region``; only that crop is uploaded, into
+            its place in the texture. None uploads the whole frame.
+        """
+        factor = decimation_factor((image_arr.shape[1], image_arr.shape[0]), self.target_size, self.zoom)
+        width, height = image_arr.shape[1] // factor, image_arr.shape[0] // factor
+        texture = self._texture_for(width, height, image_arr.dtype)
+        if region is None:
+            row_start, row_stop, column_start, column_stop = 0, height, 0, width
+        else:
+            row_start, row_stop, column_start, column_stop = region_bounds(region, width, height)
+            if row_stop <= row_start or column_stop <= column_start:
+                return
+        crop = decimate(image_arr[row_start * factor:row_stop * factor, column_start * factor:column_stop * factor],
+                        factor, self.method)
+        # texture rows are sensor rows; the flipped texture coordinates put row 0 at the top
+        texture.blit_buffer(preview_buffer(crop), size=(crop.shape[1], crop.shape[0]), pos=(column_start, row_start),
+                            colorfmt='luminance', bufferfmt=texture.bufferfmt)
+        self.uploads += 1
+        self.uploaded_pixels = crop.size
+        # the widget still references the same texture, so its canvas has to be told the pixels changed
+        self.widget.canvas.ask_update()
+
+
+class _BenchmarkTexture:
+    """Stands in for a GL texture: ``blit_buffer`` only counts the bytes that would be uploaded."""
+
+    def __init__(self, size, colorfmt='luminance', bufferfmt='ubyte'):
+        self.size = tuple(size)
+        self.bufferfmt = bufferfmt
+        self.uploaded_bytes = 0
+
+    def flip_vertical(self):
+        pass
+
+    def blit_buffer(self, pbuffer, size=None, pos=None, colorfmt=None, bufferfmt=None):
+        self.uploaded_bytes += memoryview(pbuffer).nbytes
+
+
+class _BenchmarkWidget:
+    def __init__(self, size):
+        self.size = size
+        self.texture = None
+        self.canvas = self
+
+    def bind(self, **kwargs):
+        pass
+
+    def ask_update(self):
+        pass
+
+
+def benchmark(shape=(2048, 2448), num_frames=60, widget_size=(600, 500)):
+    """
+    Measures the host memory allocated, the time and the textures created per previewed frame, for the old path
+    (flip copy, ``tobytes`` copy and a new texture every frame) and for ``PreviewTexture.update`` at full
+    resolution (``reuse``) and decimated to a ``widget_size`` widget (``decimated``).
+
+    The textures are stand-ins that count the uploaded bytes, so the times cover everything on the host up to the
+    upload but not the upload itself, which needs a GL context.
+
+    :return: ``{'copy': (MB allocated per frame, ms per frame, textures created), 'reuse': (...), 'decimated': ...}``
+    :rtype: dict
+    """
+    frame = np.random.default_rng(0).integers(0, 256, size=shape, dtype=np.uint8)
+    created = []
+
+    def create_texture(**kwargs):
+        texture = _BenchmarkTexture(**kwargs)
+        created.append(texture)
+        return texture
+
+    def show_copy(arr):
+        # the old FLIRCamera.show_image
+        texture = create_texture(size=(arr.shape[1], arr.shape[0]), colorfmt='luminance')
+        texture.blit_buffer(np.copy(np.flipud(arr)).tobytes(), colorfmt='luminance', bufferfmt='ubyte')
+
+    def measure(show):
+        del created[:]
+        start = time.perf_counter()
+        for _ in range(num_frames):
+            show(frame)
+        elapsed = time.perf_counter() - start
+        textures = len(created)
+        # peak traced memory of a single frame is what that frame allocated
+        tracemalloc.start()
+        show(frame)
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        return allocated / 1e6, 1000 * elapsed / num_frames, textures
+
+    results = {'copy': measure(show_copy),
+               'reuse': measure(PreviewTexture(_BenchmarkWidget((shape[1], shape[0])),
+                                               create_texture=create_texture).update),
+               'decimated': measure(PreviewTexture(_BenchmarkWidget(widget_size),
+                                                   create_texture=create_texture).update)}
+    for name, (megabytes, milliseconds, textures) in results.items():
+        logger.info(f'{name}: {megabytes:.2f} MB allocated and {milliseconds:.2f} ms per frame, '
+                    f'{textures} texture(s) created for {num_frames} frames')
+    return results
+
+
+if __name__ == '__main__':
+    benchmark()
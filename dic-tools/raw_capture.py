@@ -0,0 +1,162 @@
+"""
+Raw-buffer capture and offline development.
+
+During a test each frame's untouched sensor buffer is copied and written straight to a ``.raw`` file, skipping pixel
+conversion and lossy JPEG encoding. Each directory gets a ``raw_index.jsonl`` holding one line of metadata per frame.
+After the test the ``develop`` command converts the recorded sequence to TIFF or PNG in parallel:
+
+    python raw_capture.py develop <directory> --format tiff --workers 8
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from loguru import logger
+
+INDEX_NAME = 'raw_index.jsonl'
+_index_lock = threading.Lock()
+
+
+class RawFrame:
+    """
+    Untouched copy of a camera buffer plus the metadata needed to develop it later.
+
+    It quacks enough like a PySpin image (``GetNDArray``, ``GetWidth``, ``GetHeight``, ``Save``) to go through the
+    grab engine and the image writer pool unchanged.
+    """
+
+    def __init__(self, data, metadata):
+        self.data = data
+        self.metadata = metadata
+
+    @classmethod
+    def from_image(cls, image_result, **extra_metadata):
+        """
+        Copies the buffer of ``image_result`` so it can be released straight away.
+
+        :param image_result: Image from ``GetNextImage``.
+        :type image_result: ImagePtr
+        :param extra_metadata: Additional values stored in the index, e.g. the serial number.
+        """
+        metadata = {'width': image_result.GetWidth(), 'height': image_result.GetHeight(),
+                    'offset_x': image_result.GetXOffset(), 'offset_y': image_result.GetYOffset(),
+                    'pixel_format': image_result.GetPixelFormatName(), 'frame_id': image_result.GetFrameID(),
+                    'timestamp': image_result.GetTimeStamp()}
+        metadata.update(extra_metadata)
+        return cls(np.array(image_result.GetData(), copy=True), metadata)
+
+    def GetNDArray(self):
+        """
+        :return: The buffer as a ``(height, width)`` array of 8 or 16 bit pixels.
+        :raises ValueError: For packed pixel formats, which have to be developed first.
+        """
+        height, width = self.metadata['height'], self.metadata['width']
+        dtype = np.dtype(np.uint8 if self.metadata['pixel_format'].endswith('8') else '<u2')
+        if self.data.nbytes != height * width * dtype.itemsize:
+            raise ValueError(f'{self.metadata["pixel_format"]} buffer of {self.data.nbytes} bytes is not a plain '
+                             f'{height}x{width} image')
+        return self.data.view(dtype).reshape(height, width)
+
+    def GetWidth(self):
+        return self.metadata['width']
+
+    def GetHeight(self):
+        return self.metadata['height']
+
+    def Save(self, filename, indexed_name=None):
+        """
+        Writes the buffer to ``filename`` and records it in the index of that directory.
+
+        :param indexed_name: Name recorded in the index, e.g. the final name of a file written under a temporary
+            one. Defaults to the name of ``filename``.
+        """
+        path = Path(filename)
+        self.data.tofile(str(path))
+        line = json.dumps(dict(self.metadata, file=indexed_name or path.name)) + '\n'
+        with _index_lock:
+            with open(path.parent / INDEX_NAME, 'a') as index_file:
+                index_file.write(line)
+
+
+def copy_raw_frame(image_result):
+    """Grab engine ``process`` step for raw capture."""
+    return RawFrame.from_image(image_result)
+
+
+def read_index(directory):
+    """
+    :return: Metadata of every frame recorded in ``directory``, in recording order.
+    :rtype: list
+    """
+    with open(Path(directory) / INDEX_NAME) as index_file:
+        return [json.loads(line) for line in index_file if line.strip()]
+
+
+def develop_frame(raw_path, metadata, output_path, pixel_format='Mono8'):
+    """
+    Converts one raw frame to an image file whose type follows the extension of ``output_path``.
+
+    :return: ``output_path``
+    """
+    import PySpin
+    data = np.fromfile(str(raw_path), dtype=np.uint8)
+    image = PySpin.Image.Create(metadata['width'], metadata['height'], metadata['offset_x'],
+                                metadata['offset_y'], getattr(PySpin, 'PixelFormat_' + metadata['pixel_format']),
+                                data)
+    if metadata['pixel_format'] != pixel_format:
+        image = image.Convert(getattr(PySpin, 'PixelFormat_' + pixel_format), PySpin.HQ_LINEAR)
+    image.Save(str(output_path))
+    return output_path
+
+
+def develop(directory, output_directory=None, image_format='tiff', pixel_format='Mono8', workers=None):
+    """
+    Converts every raw frame recorded in ``directory`` using a pool of processes.
+
+    :param directory: Directory holding the ``.raw`` files and their index.
+    :param output_directory: Where to write the images. Defaults to ``directory``.
+    :param image_format: ``'tiff'`` or ``'png'``; both are lossless.
+    :param pixel_format: PySpin pixel format name to convert to, e.g. ``'Mono8'`` or ``'Mono16'``.
+    :param workers: Number of processes. Defaults to the number of CPUs.
+    :return: True if every frame was developed, False otherwise.
+    :rtype: bool
+    """
+    directory = Path(directory)
+    output_directory = Path(output_directory) if output_directory is not None else directory
+    output_directory.mkdir(parents=True, exist_ok=True)
+    entries = read_index(directory)
+    logger.info(f'Developing {len(entries)} raw frames from {directory} to {image_format}')
+    result = True
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(develop_frame, directory / entry['file'], entry,
+                                   output_directory / f'{Path(entry["file"]).stem}.{image_format}', pixel_format)
+                   for entry in entries]
+        for entry, future in zip(entries, futures):
+            try:
+                logger.debug(f'Developed {future.result()}')
+            except Exception as ex:
+                logger.error(f'Unable to develop {entry["file"]}: {ex}')
+                result = False
+    logger.success('Done!')
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tools for raw captures.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    develop_parser = commands.add_parser('develop', help='convert a raw sequence to lossless images')
+    develop_parser.add_argument('directory', type=Path)
+    develop_parser.add_argument('--output', type=Path, default=None)
+    develop_parser.add_argument('--format', choices=('tiff', 'png'), default='tiff')
+    develop_parser.add_argument('--pixel-format', default='Mono8')
+    develop_parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    return develop(args.directory, args.output, args.format, args.pixel_format, args.workers)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,435 @@
+"""
+Multiprocess acquisition: one process per camera, frames handed over through shared memory.
+
+Every camera process grabs into its own ring of frame slots in a ``multiprocessing.shared_memory`` block. A slot
+travels between two queues: the camera process takes a free slot, copies the frame into it, runs the per-frame
+work and puts the slot number plus the frame's metadata on the filled queue. The coordinator reads the slot through
+a NumPy view of the same memory, without copying, and hands the slot back to the free queue with ``release``. Only
+slot numbers and metadata are pickled, so the pixels are copied once, out of the camera buffer.
+
+Per-frame Python work then runs under one GIL per camera instead of one GIL for all of them. A camera process that
+dies is noticed from its exit code, reported once and left out; the other cameras carry on.
+
+Processes are started with ``spawn``, the only method on Windows, so cameras are described by picklable factories
+that open them inside the camera process: ``SimulatedCameraFactory`` and ``SpinnakerCameraFactory``. Every frame
+must match the ring's shape and dtype; a camera delivering anything else fails like a crashed one.
+
+``acquire_raw`` records raw frames with it; select it with ``CAPTURE_MODE = capture_modes.shared_memory`` in
+acquistion.py or ``--format shared_memory`` in the headless runner. The cameras free-run while they record.
+
+Run this module directly to compare, with simulated cameras, a thread per camera with a process per camera.
+"""
+import multiprocessing
+import queue
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+from pathlib import Path
+import numpy as np
+from loguru import logger
+
+SharedFrame = namedtuple('SharedFrame', 'camera_index slot frame_id timestamp result array')
+
+
+class SimulatedCameraFactory:
+    """
+    Opens a ``simulated_pyspin`` camera inside a camera process.
+
+    :param index: Index of the camera; cameras with different indices have their own serial number and view.
+    :param fail_after: Number of frames after which ``GetNextImage`` raises, to exercise crash handling, or None.
+    :param kwargs: Fields of ``simulated_pyspin.SimulationSettings``.
+    """
+
+    def __init__(self, index=0, fail_after=None, **kwargs):
+        self.index = index
+        self.fail_after = fail_after
+        self.kwargs = kwargs
+        self.cam = None
+
+    def open(self):
+        import simulated_pyspin
+        self.cam = cam = simulated_pyspin.open_cameras(self.index + 1, **self.kwargs)[self.index]
+        if self.fail_after is not None:
+            grab = cam.GetNextImage
+
+            def failing_grab(timeout=None):
+                image_result = grab(timeout)
+                if image_result.GetFrameID() >= self.fail_after:
+                    image_result.Release()
+                    raise simulated_pyspin.SpinnakerException(f'Simulated failure of camera {cam.serial_number}')
+                return image_result
+            cam.GetNextImage = failing_grab
+        return cam
+
+    def close(self):
+        if self.cam is not None:
+            self.cam.DeInit()
+            self.cam = None
+
+
+class SpinnakerCameraFactory:
+    """
+    Opens a FLIR camera by serial number inside a camera process and configures it to free-run with chunk
+    timestamps. The camera must not be initialized by any other process.
+
+    :param serial_number: Serial number of the camera.
+    :type serial_number: str
+    """
+
+    def __init__(self, serial_number):
+        self.serial_number = str(serial_number)
+        self.system = None
+        self.cameras = None
+        self.cam = None
+
+    def open(self):
+        # the camera process is an entry point of its own, so DIC_TOOLS_SIMULATE has to be honoured here too
+        import simulated_pyspin
+        simulated_pyspin.install_if_requested()
+        import acquistion as cam_aq
+        import PySpin
+        self.system = PySpin.System.GetInstance()
+        self.cameras = self.system.GetCameras()
+        self.cam = self.cameras.GetBySerial(self.serial_number)
+        self.cam.Init()
+        if cam_aq.configure_camera(self.cam, buffer_mode='OldestFirst') is False or \
+                cam_aq.enable_chunk_timestamps(self.cam) is False or \
+                cam_aq.reset_trigger(cam_aq.camera_nodes(self.cam)) is False:
+            raise RuntimeError(f'Unable to configure camera {self.serial_number}')
+        return self.cam
+
+    def close(self):
+        """Deinitializes the camera and releases the system. The caller must have dropped its camera reference."""
+        if self.cam is not None:
+            if self.cam.IsInitialized():
+                self.cam.DeInit()
+            self.cam = None
+        if self.cameras is not None:
+            self.cameras.Clear()
+            self.cameras = None
+        if self.system is not None:
+            # Spinnaker refuses to release the system while any camera reference is alive
+            self.system.ReleaseInstance()
+            self.system = None
+
+
+def _camera_process(factory, shm_name, num_slots, shape, dtype, free_slots, filled_slots, stop, num_frames,
+                    timeout, work):
+    """Grab loop of one camera process."""
+    from frame_pairing import frame_timestamp
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = np.ndarray((num_slots,) + shape, dtype=dtype, buffer=shm.buf)
+    cam = image_result = image_arr = None
+    try:
+        cam = factory.open()
+        # only now, once a simulated camera has installed its PySpin, grab_engine may import PySpin
+        from grab_engine import _is_timeout
+        cam.BeginAcquisition()
+        grabbed = 0
+        slot = None
+        while not stop.is_set() and (num_frames is None or grabbed < num_frames):
+            if slot is None:
+                try:
+                    slot = free_slots.get(timeout=0.1)
+                except queue.Empty:
+                    continue  # the coordinator holds every slot
+            try:
+                image_result = cam.GetNextImage(timeout)
+            except Exception as ex:
+                if _is_timeout(ex):
+                    continue
+                raise
+            try:
+                if image_result.IsIncomplete():
+                    continue  # the slot is reused for the next frame
+                image_arr = image_result.GetNDArray()
+                if image_arr.shape != ring.shape[1:] or image_arr.dtype != ring.dtype:
+                    raise ValueError(f'Frame of {image_arr.shape} {image_arr.dtype} does not fit slots of '
+                                     f'{ring.shape[1:]} {ring.dtype}')
+                ring[slot] = image_arr
+                metadata = (slot, image_result.GetFrameID(), frame_timestamp(image_result))
+            finally:
+                image_result.Release()
+            # the per-frame work runs on the copy in shared memory, after the camera buffer is back with the SDK
+            filled_slots.put(metadata + (work(ring[slot]) if work is not None else None,))
+            slot = None
+            grabbed += 1
+        cam.EndAcquisition()
+        filled_slots.put(None)
+    finally:
+        # the factory can only release the SDK once no camera or image reference is left here
+        del cam, image_result, image_arr
+        factory.close()
+        del ring
+        shm.close()
+
+
+class CameraProcess:
+    """
+    One camera process, its ring of frame slots and the queues that pass slots back and forth.
+
+    :param index: Index of the camera.
+    :param factory: Picklable object whose ``open()`` returns the camera and ``close()`` releases it.
+    :param shape: Shape of a frame in pixels, ``(height, width)``.
+    :param dtype: Pixel type.
+    :param num_slots: Frames the ring holds; the camera process waits while the coordinator holds all of them.
+    """
+
+    def __init__(self, context, index, factory, shape, dtype=np.uint8, num_slots=8, num_frames=None, timeout=1000,
+                 work=None):
+        self.index = index
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.shm = shared_memory.SharedMemory(create=True, size=num_slots * int(np.prod(self.shape)) *
+                                              self.dtype.itemsize)
+        self.ring = np.ndarray((num_slots,) + self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.free_slots = context.Queue()
+        self.filled_slots = context.Queue()
+        self.stop_event = context.Event()
+        for slot in range(num_slots):
+            self.free_slots.put(slot)
+        self.process = context.Process(target=_camera_process, name=f'camera-{index}', daemon=True,
+                                       args=(factory, self.shm.name, num_slots, self.shape, self.dtype.str,
+                                             self.free_slots, self.filled_slots, self.stop_event, num_frames,
+                                             timeout, work))
+        self.finished = False
+        self.failed = False
+        self.frames = 0
+
+    def poll(self):
+        """
+        :return: The next filled frame, or None if there is none yet.
+        :rtype: SharedFrame or None
+        """
+        try:
+            message = self.filled_slots.get_nowait()
+        except queue.Empty:
+            if self.process.exitcode is None:
+                return None
+            try:
+                # what the process put on the queue just before it exited may still be on its way
+                message = self.filled_slots.get(timeout=0.1)
+            except queue.Empty:
+                self._crashed()
+                return None
+        if message is None:
+            self.finished = True
+            return None
+        slot, frame_id, timestamp, result = message
+        self.frames += 1
+        return SharedFrame(self.index, slot, frame_id, timestamp, result, self.ring[slot])
+
+    def _crashed(self):
+        # a process that exits without its end marker crashed
+        self.finished = self.failed = True
+        logger.error(f'Camera process {self.index} exited with code {self.process.exitcode}; '
+                     f'continuing without it after {self.frames} frames')
+
+    def release(self, frame):
+        """Hands a slot back to the camera process. Views of it must not be used afterwards."""
+        self.free_slots.put(frame.slot)
+
+    def close(self):
+        self.stop_event.set()
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        del self.ring
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedMemoryAcquisition:
+    """
+    Runs one process per camera and collects their frames.
+
+    :param factories: One picklable camera factory per camera, see ``SimulatedCameraFactory``.
+    :param shape: Shape of every frame in pixels, ``(height, width)``.
+    :param dtype: Pixel type.
+    :param num_slots: Frames each camera's ring holds.
+    :param num_frames: Frames to grab per camera, or None to run until ``stop``.
+    :param timeout: ``GetNextImage`` timeout in milliseconds; bounds how long a stop request can go unnoticed.
+    :param work: Picklable function applied to each frame in its camera process; its result arrives with the frame.
+    """
+
+    def __init__(self, factories, shape, dtype=np.uint8, num_slots=8, num_frames=None, timeout=1000, work=None):
+        context = multiprocessing.get_context('spawn')
+        self.cameras = [CameraProcess(context, i, factory, shape, dtype, num_slots, num_frames, timeout, work)
+                        for i, factory in enumerate(factories)]
+
+    def start(self):
+        for camera in self.cameras:
+            camera.process.start()
+        return self
+
+    def stop(self):
+        """Asks every camera process to finish after its current frame."""
+        for camera in self.cameras:
+            camera.stop_event.set()
+
+    @property
+    def running(self):
+        return not all(camera.finished for camera in self.cameras)
+
+    def frames(self, idle=0.001, until=None):
+        """
+        Yields filled frames from every camera until all of them finished or failed. Each frame must be handed back
+        with ``release`` once it is no longer used; its ``array`` is a view of the shared slot, not a copy.
+
+        :param idle: Seconds to sleep when no camera has a frame ready.
+        :param until: Called with the frames received from each camera so far and whether any camera is still
+            running; once it returns True every camera is asked to stop. None runs until the cameras finish.
+        :rtype: iterator of SharedFrame
+        """
+        stopping = False
+        while self.running:
+            if until is not None and not stopping:
+                alive = any(camera.process.is_alive() for camera in self.cameras)
+                if until([camera.frames for camera in self.cameras], alive):
+                    self.stop()
+                    stopping = True
+            received = False
+            for camera in self.cameras:
+                if camera.finished:
+                    continue
+                frame = camera.poll()
+                if frame is not None:
+                    received = True
+                    yield frame
+            if not received:
+                time.sleep(idle)
+
+    def release(self, frame):
+        self.cameras[frame.camera_index].release(frame)
+
+    def close(self):
+        """Stops and joins every camera process and frees the shared memory."""
+        self.stop()
+        for camera in self.cameras:
+            camera.close()
+        logger.info(f'Shared memory acquisition: {[camera.frames for camera in self.cameras]} frames per camera'
+                    + (f', cameras {self.failed} failed' if self.failed else ''))
+
+    @property
+    def failed(self):
+        return [camera.index for camera in self.cameras if camera.failed]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def acquire_raw(cameras, num_frames=None, save_directory='.', num_slots=8, until=None):
+    """
+    Records frames from each camera with a process per camera, writing each frame straight from shared memory to a
+    ``.raw`` file with its ``raw_capture`` index entry.
+
+    :param cameras: Descriptor of each camera, see ``acquistion.describe_camera``; none of the cameras may be
+        initialized in this process. All of them must deliver frames of the same size and pixel format.
+    :type cameras: list of CameraDescriptor
+    :param num_frames: Frames to record per camera, or None to record until ``until`` stops the recording.
+    :param until: See ``SharedMemoryAcquisition.frames``.
+    :return: True if no camera failed and each delivered all its frames, False otherwise.
+    :rtype: bool
+    """
+    from raw_capture import RawFrame
+    first = cameras[0]
+    if any((camera.height, camera.width, camera.pixel_format) != (first.height, first.width, first.pixel_format)
+           for camera in cameras):
+        raise ValueError('Every camera must deliver frames of the same size and pixel format')
+    save_directory = Path(save_directory)
+    save_directory.mkdir(parents=True, exist_ok=True)
+    factories = [SpinnakerCameraFactory(camera.serial_number) for camera in cameras]
+    with SharedMemoryAcquisition(factories, (first.height, first.width), first.dtype, num_slots=num_slots,
+                                 num_frames=num_frames) as acquisition:
+        for frame in acquisition.frames(until=until):
+            camera = cameras[frame.camera_index]
+            RawFrame(frame.array, dict(camera.metadata(), offset_x=0, offset_y=0, frame_id=frame.frame_id,
+                                       timestamp=frame.timestamp)).Save(
+                save_directory / f'AcquisitionMultipleCamera-{camera.serial_number}-{frame.frame_id}.raw')
+            acquisition.release(frame)
+    return not acquisition.failed and (num_frames is None or
+                                       all(camera.frames == num_frames for camera in acquisition.cameras))
+
+
+def busy_frame_work(array, cpu_time=0.004):
+    """
+    Stand-in for the Python-side work done per frame (statistics, metadata, logging): holds the GIL for
+    ``cpu_time`` seconds of CPU time and returns the frame's mean.
+    """
+    end = time.thread_time() + cpu_time
+    while time.thread_time() < end:
+        pass
+    return float(array[::16, ::16].mean())
+
+
+def benchmark(camera_counts=(1, 2, 4), num_frames=100, shape=(1024, 1224), fps=100.0):
+    """
+    Compares aggregate throughput of a grab thread per camera with a process per camera, both running
+    ``busy_frame_work`` on every frame of free-running simulated cameras. Threads share one GIL, so their rate stops
+    growing at one core's worth of work; processes keep scaling up to the number of cores.
+
+    :return: ``{num_cameras: (thread_fps, process_fps)}``
+    :rtype: dict
+    """
+    import simulated_pyspin
+    settings = {'width': shape[1], 'height': shape[0], 'fps': fps}
+    results = {}
+    logger.info(f'{multiprocessing.cpu_count()} CPU cores')
+    for num_cameras in camera_counts:
+        cams = simulated_pyspin.open_cameras(num_cameras, **settings)
+        # imported once the simulation is installed, so that they use the simulated PySpin
+        from acquistion import CameraDescriptor
+        from grab_engine import GrabEngine
+        for cam in cams:
+            cam.BeginAcquisition()
+        cameras = [CameraDescriptor(i, cam.serial_number) for i, cam in enumerate(cams)]
+        start = time.perf_counter()
+        with GrabEngine(cams, cameras, lambda frame: None, num_frames,
+                        process=lambda image: busy_frame_work(image.GetNDArray())) as engine:
+            pass
+        threaded = engine.frames_grabbed / (time.perf_counter() - start)
+        for cam in cams:
+            cam.EndAcquisition()
+            cam.DeInit()
+
+        factories = [SimulatedCameraFactory(i, **settings) for i in range(num_cameras)]
+        with SharedMemoryAcquisition(factories, shape, num_frames=num_frames, work=busy_frame_work) as acquisition:
+            # processes are timed from their first frame so that spawning the interpreters is not counted
+            start = None
+            received = 0
+            for frame in acquisition.frames():
+                start = start or time.perf_counter()
+                received += 1
+                acquisition.release(frame)
+            multiprocess = (received - 1) / (time.perf_counter() - start)
+        results[num_cameras] = (threaded, multiprocess)
+        logger.info(f'{num_cameras} camera(s): threads {threaded:.1f} fps, processes {multiprocess:.1f} fps')
+    return results
+
+
+def crash_isolation_check(num_cameras=3, num_frames=50, fail_after=10, shape=(480, 640)):
+    """
+    Runs simulated cameras of which the first fails part way through.
+
+    :return: True if the failed camera was reported and every other camera delivered all its frames.
+    :rtype: bool
+    """
+    factories = [SimulatedCameraFactory(i, fail_after=fail_after if i == 0 else None, width=shape[1], height=shape[0],
+                                        fps=100.0) for i in range(num_cameras)]
+    with SharedMemoryAcquisition(factories, shape, num_frames=num_frames) as acquisition:
+        for frame in acquisition.frames():
+            acquisition.release(frame)
+    frames = [camera.frames for camera in acquisition.cameras]
+    isolated = acquisition.failed == [0] and frames[1:] == [num_frames] * (num_cameras - 1)
+    logger.info(f'Crash isolation: frames per camera {frames}, failed {acquisition.failed}, '
+                f'{"ok" if isolated else "NOT isolated"}')
+    return isolated
+
+
+if __name__ == '__main__':
+    crash_isolation_check()
+    benchmark()
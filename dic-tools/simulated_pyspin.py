@@ -0,0 +1,831 @@
+"""
+Simulated Spinnaker backend: a stand-in for the ``PySpin`` module that generates speckle images.
+
+It mimics the subset of ``PySpin`` used by acquistion.py and stereo_gui.py: ``System``, ``CameraList`` and
+``CameraPtr`` (including the QuickSpin attributes such as ``cam.ExposureTime``), the device, transport layer device
+and stream nodemaps with the nodes the code reads and writes, ``GetNextImage`` and the image methods, chunk
+timestamps, software triggers, counter strobes and image event handlers. Frames are windows onto a synthetic speckle
+pattern that drifts a little every frame, so the whole pipeline, from grabbing to pairing and saving, can be run and
+measured without FLIR hardware.
+
+Set ``DIC_TOOLS_SIMULATE`` to use it in place of the SDK. ``1`` simulates the default cameras; a comma separated
+list of ``key=value`` settings overrides any field of ``SimulationSettings``:
+
+    DIC_TOOLS_SIMULATE=cameras=4,width=2448,height=2048,fps=30,jitter=0.0005,drop_rate=0.001 python stereo_gui.py
+
+Cameras free-run at ``fps``, limited by the exposure time, on an absolute timeline. Each frame arrives up to
+``jitter`` seconds (standard deviation) early or late, a fraction ``drop_rate`` of frames is lost in transport
+(their frame IDs are skipped, as with a real camera) and a fraction ``incomplete_rate`` arrives incomplete. Stream
+buffer handling follows ``StreamBufferHandlingMode``: ``NewestOnly`` skips to the newest frame when the reader falls
+behind, ``OldestFirst`` queues up to ``StreamBufferCountManual`` frames and then drops the oldest. ``Save`` writes
+the raw pixels whatever the extension, after ``save_time`` seconds standing in for the encode, and ``Convert`` takes
+``convert_time`` seconds. A software trigger's ``Execute`` returns ``command_time`` seconds after it triggered the
+camera, standing in for the USB round trip.
+
+Every camera's output lines are wired to every other camera's input lines, so a counter strobe on the first camera
+(see ``acquistion.configure_counter_trigger``) triggers the others on exactly the pulse times.
+"""
+import os
+import sys
+import threading
+import time
+from collections import namedtuple
+import numpy as np
+
+ENVIRONMENT_VARIABLE = 'DIC_TOOLS_SIMULATE'
+
+# access modes and the constants the acquisition code compares against
+NI, NA, WO, RO, RW = range(5)
+ExposureAuto_Off, ExposureAuto_Once, ExposureAuto_Continuous = range(3)
+GainAuto_Off, GainAuto_Once, GainAuto_Continuous = range(3)
+PixelFormat_Mono8, PixelFormat_Mono16 = 0, 1
+NEAREST_NEIGHBOR, EDGE_SENSING, HQ_LINEAR = range(3)
+SPINNAKER_ERR_TIMEOUT = -1011
+SPINNAKER_ERR_NOT_AVAILABLE = -1013
+IMAGE_NO_ERROR, IMAGE_DATA_INCOMPLETE = 0, 7
+# GPIO lines of a Blackfly S and their mode at power-up; Line0 is input and Line1 output only
+LINES = {'Line0': 'Input', 'Line1': 'Output', 'Line2': 'Input', 'Line3': 'Input'}
+
+SimulationSettings = namedtuple('SimulationSettings', 'cameras width height fps exposure_time jitter drop_rate '
+                                                      'incomplete_rate drift save_time convert_time command_time seed')
+SimulationSettings.__new__.__defaults__ = (2, 2448, 2048, 30.0, 0.005, 0.0, 0.0, 0.0, 0.5, 0.0, 0.0, 0.0, 0)
+
+_settings = SimulationSettings()
+
+
+class SpinnakerException(Exception):
+    """Raised like ``PySpin.SpinnakerException``, with the Spinnaker error code in ``errorcode``."""
+
+    def __init__(self, message, errorcode=-1001):
+        super(SpinnakerException, self).__init__(message)
+        self.message = message
+        self.errorcode = errorcode
+
+
+def parse_settings(spec):
+    """
+    :param spec: ``'1'`` for the defaults or comma separated ``key=value`` pairs, e.g. ``'cameras=4,fps=60'``.
+    :rtype: SimulationSettings
+    """
+    values = {}
+    for item in spec.split(','):
+        if '=' not in item:
+            continue
+        key, value = (part.strip() for part in item.split('=', 1))
+        if key not in SimulationSettings._fields:
+            raise ValueError(f'Unknown simulation setting {key!r}; expected one of {SimulationSettings._fields}')
+        default = getattr(SimulationSettings(), key)
+        values[key] = type(default)(float(value)) if isinstance(default, int) else type(default)(value)
+    return SimulationSettings(**values)
+
+
+def configure(settings=None, **kwargs):
+    """
+    Sets the cameras the next ``System.GetInstance().GetCameras()`` returns.
+
+    :param settings: Complete settings, or None to change only ``kwargs`` of the current ones.
+    :type settings: SimulationSettings or None
+    """
+    global _settings
+    _settings = (settings or _settings)._replace(**kwargs)
+    return _settings
+
+
+def install(settings=None, **kwargs):
+    """Makes ``import PySpin`` return this module from now on."""
+    configure(settings, **kwargs)
+    sys.modules['PySpin'] = sys.modules[__name__]
+
+
+def install_if_requested():
+    """
+    Installs the simulation if ``DIC_TOOLS_SIMULATE`` is set. Call it before the first ``import PySpin``; once the
+    simulation is installed, later calls keep its settings.
+
+    :return: True if the simulation is installed.
+    :rtype: bool
+    """
+    if sys.modules.get('PySpin') is sys.modules[__name__]:
+        return True
+    spec = os.environ.get(ENVIRONMENT_VARIABLE, '')
+    if spec in ('', '0'):
+        return False
+    install(parse_settings(spec))
+    return True
+
+
+def open_cameras(count=None, **kwargs):
+    """
+    Creates initialized cameras apart from ``System``, for the benchmarks of the other modules. They are wired to
+    each other like the cameras of ``System``.
+
+    Installs the simulation if nothing imported ``PySpin`` yet. The modules under test catch
+    ``PySpin.SpinnakerException``, so a benchmark run as a script installs the simulation before its module imports
+    ``PySpin``.
+
+    :param count: Number of cameras, or None for ``cameras`` of the current settings.
+    :param kwargs: Fields of ``SimulationSettings`` that differ from the current settings.
+    :rtype: list of CameraPtr
+    :raises RuntimeError: If ``PySpin`` is the real SDK.
+    """
+    if 'PySpin' not in sys.modules:
+        install()
+    elif sys.modules['PySpin'] is not sys.modules[__name__]:
+        raise RuntimeError(f'PySpin is already imported; set {ENVIRONMENT_VARIABLE}=1 to run on simulated cameras')
+    if count is not None:
+        kwargs['cameras'] = count
+    cams = System(_settings._replace(**kwargs)).cameras
+    for cam in cams:
+        cam.Init()
+    return cams
+
+
+def IsAvailable(node):
+    return node is not None and node.GetAccessMode() not in (NI, NA)
+
+
+def IsReadable(node):
+    return node is not None and node.GetAccessMode() in (RO, RW)
+
+
+def IsWritable(node):
+    return node is not None and node.GetAccessMode() in (WO, RW)
+
+
+def _pointer(node):
+    # the typed pointers of PySpin wrap a node; here the node already has every method
+    return node if node is not None else _MissingNode()
+
+
+CValuePtr = CCategoryPtr = CEnumerationPtr = CCommandPtr = CIntegerPtr = CFloatPtr = CBooleanPtr = CStringPtr = \
+    _pointer
+
+
+class _MissingNode:
+    """What ``GetNode`` returns for a node the camera does not have."""
+
+    def GetAccessMode(self):
+        return NI
+
+    def __getattr__(self, name):
+        def unavailable(*args):
+            raise SpinnakerException('Node is not available', SPINNAKER_ERR_NOT_AVAILABLE)
+        return unavailable
+
+
+class Node:
+    """
+    A value node: integer, float, boolean, string or command.
+
+    :param on_set: Called with the new value after it was set.
+    :param writable: Function returning whether the node is writable right now, or a constant.
+    """
+
+    def __init__(self, name, value=None, writable=True, on_set=None, on_get=None):
+        self.name = name
+        self._value = value
+        self._writable = writable
+        self._on_set = on_set
+        self._on_get = on_get
+
+    def GetName(self):
+        return self.name
+
+    def GetAccessMode(self):
+        writable = self._writable() if callable(self._writable) else self._writable
+        return RW if writable else RO
+
+    def GetValue(self):
+        return self._on_get() if self._on_get is not None else self._value
+
+    def SetValue(self, value):
+        if self.GetAccessMode() != RW:
+            raise SpinnakerException(f'Node {self.name} is not writable', -1010)
+        self._value = value
+        if self._on_set is not None:
+            self._on_set(value)
+
+    def ToString(self):
+        return str(self.GetValue())
+
+    def Execute(self):
+        self.SetValue(None)
+
+    # enumerations are set through their integer value either way
+    GetIntValue = GetValue
+    SetIntValue = SetValue
+
+
+class EnumEntry:
+    def __init__(self, name, value):
+        self.name = name
+        self.value = value
+
+    def GetAccessMode(self):
+        return RO
+
+    def GetName(self):
+        return 'EnumEntry_' + self.name
+
+    def GetSymbolic(self):
+        return self.name
+
+    def GetValue(self):
+        return self.value
+
+
+class EnumerationNode(Node):
+    """
+    An enumeration node. Its value is the integer value of the current entry.
+
+    :param entries: Symbolic names of the entries, numbered in order.
+    """
+
+    def __init__(self, name, entries, current=None, writable=True, on_set=None):
+        self.entries = {entry: EnumEntry(entry, value) for value, entry in enumerate(entries)}
+        super(EnumerationNode, self).__init__(name, self.entries[current or entries[0]].value, writable, on_set)
+
+    def GetEntryByName(self, name):
+        return self.entries.get(name)
+
+    def GetCurrentEntry(self):
+        return next(entry for entry in self.entries.values() if entry.value == self._value)
+
+    def GetEntries(self):
+        return list(self.entries.values())
+
+    def symbolic(self):
+        return self.GetCurrentEntry().name
+
+    def ToString(self):
+        return self.symbolic()
+
+
+class CategoryNode(Node):
+    def __init__(self, name, features):
+        super(CategoryNode, self).__init__(name, writable=False)
+        self.features = features
+
+    def GetFeatures(self):
+        return list(self.features)
+
+
+class NodeMap:
+    def __init__(self, nodes):
+        self.nodes = {node.name: node for node in nodes}
+
+    def GetNode(self, name):
+        return self.nodes.get(name)
+
+
+_patterns = {}
+_patterns_lock = threading.Lock()
+
+
+def speckle_pattern(height, width, speckle_size=3.0, seed=0):
+    """
+    Generates a speckle pattern like a sprayed DIC target: band-limited random noise, contrast stretched to 8 bits.
+    Patterns are cached, so every camera of the same resolution films the same target.
+
+    :param speckle_size: Standard deviation of the speckles in pixels.
+    :rtype: numpy.ndarray
+    """
+    key = (height, width, speckle_size, seed)
+    with _patterns_lock:
+        if key not in _patterns:
+            noise = np.random.default_rng(seed).standard_normal((height, width)).astype(np.float32)
+            # a Gaussian low-pass in the frequency domain turns white noise into blobs of ``speckle_size``
+            fy = np.fft.fftfreq(height).astype(np.float32)[:, None]
+            fx = np.fft.rfftfreq(width).astype(np.float32)[None, :]
+            low_pass = np.exp(-2 * (np.pi * speckle_size) ** 2 * (fx ** 2 + fy ** 2))
+            speckle = np.fft.irfft2(np.fft.rfft2(noise) * low_pass, s=(height, width))
+            speckle -= speckle.mean()
+            speckle *= 64 / speckle.std()
+            _patterns[key] = np.clip(speckle + 128, 0, 255).astype(np.uint8)
+        return _patterns[key]
+
+
+def target_pattern(settings=None):
+    """
+    :return: The speckle target the simulated cameras film, with a margin for their offsets and drift. Generating
+        it takes a moment at full resolution, so benchmarks call this before they start timing.
+    :rtype: numpy.ndarray
+    """
+    settings = settings or _settings
+    return speckle_pattern(settings.height + 64, settings.width + 64, seed=settings.seed)
+
+
+class ChunkData:
+    def __init__(self, frame_id, timestamp):
+        self._frame_id = frame_id
+        self._timestamp = timestamp
+
+    def GetFrameID(self):
+        return self._frame_id
+
+    def GetTimestamp(self):
+        return self._timestamp
+
+
+class Image:
+    """Mimics ``PySpin.ImagePtr``; also provides ``Image.Create`` like ``PySpin.Image``."""
+
+    def __init__(self, array, frame_id=0, timestamp=0, incomplete=False, chunk_data=False, save_time=0.0,
+                 convert_time=0.0):
+        self._array = array
+        self._frame_id = frame_id
+        self._timestamp = timestamp
+        self._incomplete = incomplete
+        self._chunk_data = chunk_data
+        self._save_time = save_time
+        self._convert_time = convert_time
+        self.released = False
+
+    @staticmethod
+    def Create(width, height, offset_x, offset_y, pixel_format, data):
+        dtype = np.uint16 if pixel_format == PixelFormat_Mono16 else np.uint8
+        return Image(np.frombuffer(np.ascontiguousarray(data), dtype=dtype)[:width * height].reshape(height, width))
+
+    def IsIncomplete(self):
+        return self._incomplete
+
+    def GetImageStatus(self):
+        return IMAGE_DATA_INCOMPLETE if self._incomplete else IMAGE_NO_ERROR
+
+    def GetWidth(self):
+        return self._array.shape[1]
+
+    def GetHeight(self):
+        return self._array.shape[0]
+
+    def GetXOffset(self):
+        return 0
+
+    def GetYOffset(self):
+        return 0
+
+    def GetPixelFormat(self):
+        return PixelFormat_Mono16 if self._array.dtype == np.uint16 else PixelFormat_Mono8
+
+    def GetPixelFormatName(self):
+        return 'Mono16' if self._array.dtype == np.uint16 else 'Mono8'
+
+    def GetNDArray(self):
+        return self._array
+
+    def GetData(self):
+        return np.ascontiguousarray(self._array).reshape(-1).view(np.uint8)
+
+    def GetBufferSize(self):
+        return self._array.nbytes
+
+    def GetFrameID(self):
+        return self._frame_id
+
+    def GetTimeStamp(self):
+        return self._timestamp
+
+    def GetChunkData(self):
+        if not self._chunk_data:
+            raise SpinnakerException('Chunk data is not enabled', SPINNAKER_ERR_NOT_AVAILABLE)
+        return ChunkData(self._frame_id, self._timestamp)
+
+    def Convert(self, pixel_format, algorithm=HQ_LINEAR):
+        if self._convert_time:
+            time.sleep(self._convert_time)
+        if pixel_format == PixelFormat_Mono16:
+            array = self._array.astype(np.uint16) * 257 if self._array.dtype == np.uint8 else self._array.copy()
+        else:
+            array = (self._array >> 8).astype(np.uint8) if self._array.dtype == np.uint16 else self._array.copy()
+        return Image(array, self._frame_id, self._timestamp, self._incomplete, self._chunk_data, self._save_time,
+                     self._convert_time)
+
+    def Save(self, filename, *args):
+        if self._save_time:
+            time.sleep(self._save_time)  # stands in for the encode
+        np.ascontiguousarray(self._array).tofile(str(filename))
+
+    def Release(self):
+        self.released = True
+
+
+class ImageEventHandler:
+    """Base class of image event handlers; override ``OnImageEvent``."""
+
+    def OnImageEvent(self, image):
+        pass
+
+
+class CameraPtr:
+    """
+    A simulated camera. Nodes are reachable through the nodemaps and as QuickSpin attributes.
+
+    :param serial_number: Serial number reported by the transport layer.
+    :param settings: Resolution, timing and fault rates.
+    :type settings: SimulationSettings
+    :param index: Position in the camera list; cameras look at the target from slightly different places.
+    """
+
+    model_name = 'Simulated Blackfly S BFS-U3-51S5M'
+
+    def __init__(self, serial_number, settings, index=0):
+        self.serial_number = str(serial_number)
+        self.settings = settings
+        self.index = index
+        self._rng = np.random.default_rng(settings.seed + index)
+        # device clocks start at arbitrary values, like cameras powered up at different times
+        self._clock_offset = int(self._rng.integers(1e9, 1e12))
+        self._initialized = False
+        self._streaming = False
+        self._lock = threading.Lock()
+        self._triggered = threading.Condition(self._lock)
+        self._triggers = []
+        self._event_handlers = []
+        self._event_thread = None
+        self._latched = 0
+        self.frames_delivered = 0
+        self.frames_dropped = 0
+        # cameras whose input lines this camera's output lines are wired to; see System
+        self.peers = []
+        self._lines = {line: {'mode': ['Input', 'Output'].index(mode), 'source': 0} for line, mode in LINES.items()}
+        self._counter_generation = 0
+        self._build_nodemaps()
+
+    def _build_nodemaps(self):
+        settings = self.settings
+        idle = self._idle
+        device = [
+            EnumerationNode('AcquisitionMode', ['Continuous', 'SingleFrame', 'MultiFrame'], writable=idle),
+            Node('AcquisitionFrameRateEnable', False),
+            Node('AcquisitionFrameRate', float(settings.fps)),
+            Node('AcquisitionResultingFrameRate', writable=False, on_get=lambda: 1 / self._frame_period()),
+            EnumerationNode('ExposureAuto', ['Off', 'Once', 'Continuous'], 'Continuous'),
+            Node('ExposureTime', settings.exposure_time * 1e6),
+            EnumerationNode('GainAuto', ['Off', 'Once', 'Continuous'], 'Continuous'),
+            Node('Gain', 0.0),
+            EnumerationNode('TriggerMode', ['Off', 'On']),
+            EnumerationNode('TriggerSelector', ['FrameStart', 'AcquisitionStart', 'FrameBurstStart']),
+            EnumerationNode('TriggerSource', ['Software', 'Line0', 'Line1', 'Line2', 'Line3', 'Counter0Start',
+                                              'Counter0End']),
+            EnumerationNode('TriggerActivation', ['RisingEdge', 'FallingEdge']),
+            EnumerationNode('TriggerOverlap', ['Off', 'ReadOut']),
+            Node('TriggerSoftware', writable=lambda: self._trigger_source() == 'Software',
+                 on_set=lambda _: self.software_trigger()),
+            EnumerationNode('CounterSelector', ['Counter0']),
+            EnumerationNode('CounterEventSource', ['Off', 'MHzTick']),
+            Node('CounterDuration', 1),
+            Node('CounterDelay', 0),
+            EnumerationNode('CounterTriggerSource', ['Off', 'Counter0End', 'Line0', 'Line3'],
+                            on_set=lambda _: self._counter_changed()),
+            EnumerationNode('CounterTriggerActivation', ['RisingEdge', 'FallingEdge', 'LevelHigh', 'LevelLow']),
+            Node('CounterReset', on_set=lambda _: self._reset_counter()),
+            EnumerationNode('LineSelector', list(LINES), on_set=lambda _: self._select_line()),
+            EnumerationNode('LineMode', ['Input', 'Output'], writable=lambda: self._symbolic('LineSelector') in (
+                'Line2', 'Line3'), on_set=lambda value: self._set_line('mode', value)),
+            EnumerationNode('LineSource', ['Off', 'Counter0Active', 'ExposureActive', 'UserOutput0'],
+                            on_set=lambda value: self._set_line('source', value)),
+            Node('V3_3Enable', False),
+            Node('ChunkModeActive', False, writable=idle),
+            EnumerationNode('ChunkSelector', ['Timestamp', 'FrameID', 'ExposureTime', 'Gain']),
+            Node('ChunkEnable', True),
+            Node('TimestampLatch', on_set=lambda _: self._latch()),
+            Node('TimestampLatchValue', writable=False, on_get=lambda: self._latched),
+            Node('Width', settings.width, writable=idle),
+            Node('Height', settings.height, writable=idle),
+            Node('WidthMax', settings.width, writable=False),
+            Node('HeightMax', settings.height, writable=False),
+            EnumerationNode('PixelFormat', ['Mono8', 'Mono16'], writable=idle),
+            Node('DeviceUserID', ''),
+        ]
+        information = [Node('DeviceSerialNumber', self.serial_number, writable=False),
+                       Node('DeviceModelName', self.model_name, writable=False),
+                       Node('DeviceVendorName', 'Simulated', writable=False)]
+        stream = [
+            EnumerationNode('StreamBufferHandlingMode', ['OldestFirst', 'OldestFirstOverwrite', 'NewestOnly',
+                                                         'NewestFirst'], 'OldestFirst'),
+            Node('StreamBufferCountManual', 10, writable=idle),
+            Node('StreamTotalBufferCount', writable=False, on_get=lambda: self.frames_delivered),
+            Node('StreamFailedBufferCount', 0, writable=False),
+            Node('StreamBufferUnderrunCount', 0, writable=False),
+            Node('StreamLostFrameCount', writable=False, on_get=lambda: self.frames_dropped),
+            Node('StreamDroppedFrameCount', 0, writable=False),
+        ]
+        self._device_nodemap = NodeMap(device)
+        self._tl_device_nodemap = NodeMap(information + [CategoryNode('DeviceInformation', information)])
+        self._stream_nodemap = NodeMap(stream)
+
+    def GetNodeMap(self):
+        self._check_initialized()
+        return self._device_nodemap
+
+    def GetTLDeviceNodeMap(self):
+        return self._tl_device_nodemap
+
+    def GetTLStreamNodeMap(self):
+        return self._stream_nodemap
+
+    def __getattr__(self, name):
+        # QuickSpin: cam.ExposureTime, cam.TriggerSoftware, cam.TLStream.StreamBufferHandlingMode, ...
+        if name.startswith('_'):
+            raise AttributeError(name)
+        for nodemap in (self.__dict__.get('_device_nodemap'), self.__dict__.get('_stream_nodemap'),
+                        self.__dict__.get('_tl_device_nodemap')):
+            if nodemap is not None and name in nodemap.nodes:
+                return nodemap.nodes[name]
+        raise AttributeError(f'{type(self).__name__} has no node or attribute {name!r}')
+
+    def _idle(self):
+        return not self._streaming
+
+    def _value(self, name, nodemap=None):
+        return (nodemap or self._device_nodemap).nodes[name].GetValue()
+
+    def _symbolic(self, name, nodemap=None):
+        return (nodemap or self._device_nodemap).nodes[name].symbolic()
+
+    def _trigger_source(self):
+        return self._symbolic('TriggerSource')
+
+    def _trigger_mode(self):
+        return self._symbolic('TriggerMode') == 'On'
+
+    def _frame_period(self):
+        period = 1 / self._value('AcquisitionFrameRate') if self._value('AcquisitionFrameRateEnable') else 0.0
+        return max(period, 1 / self.settings.fps if self.settings.fps else 0.0, self._value('ExposureTime') / 1e6)
+
+    def device_time(self):
+        """:return: The camera clock in ns."""
+        return time.perf_counter_ns() + self._clock_offset
+
+    def _latch(self):
+        self._latched = self.device_time()
+
+    def GetUniqueID(self):
+        return self.serial_number
+
+    def Init(self):
+        self._initialized = True
+
+    def DeInit(self):
+        if self._streaming:
+            self.EndAcquisition()
+        self._counter_generation += 1
+        self._initialized = False
+
+    def IsInitialized(self):
+        return self._initialized
+
+    def IsValid(self):
+        return True
+
+    def IsStreaming(self):
+        return self._streaming
+
+    def _check_initialized(self):
+        if not self._initialized:
+            raise SpinnakerException(f'Camera {self.serial_number} is not initialized', -1002)
+
+    def RegisterEventHandler(self, handler):
+        self._event_handlers.append(handler)
+
+    def UnregisterEventHandler(self, handler):
+        self._event_handlers.remove(handler)
+
+    def BeginAcquisition(self):
+        self._check_initialized()
+        if self._streaming:
+            raise SpinnakerException(f'Camera {self.serial_number} is already streaming', -1002)
+        self._start = time.perf_counter()
+        self._next_frame = 0
+        self._triggers = []
+        self._streaming = True
+        if self._event_handlers:
+            self._event_thread = threading.Thread(target=self._deliver_events, name=f'events-{self.serial_number}',
+                                                  daemon=True)
+            self._event_thread.start()
+
+    def EndAcquisition(self):
+        with self._lock:
+            self._streaming = False
+            self._triggered.notify_all()
+        if self._event_thread is not None:
+            self._event_thread.join()
+            self._event_thread = None
+
+    def _deliver_events(self):
+        while self._streaming:
+            try:
+                image = self.GetNextImage(100)
+            except SpinnakerException:
+                continue
+            for handler in list(self._event_handlers):
+                handler.OnImageEvent(image)
+            image.Release()
+
+    def software_trigger(self):
+        if not self._streaming:
+            raise SpinnakerException(f'Camera {self.serial_number} is not streaming', -1002)
+        with self._lock:
+            self._triggers.append(time.perf_counter())
+            self._triggered.notify_all()
+        if self.settings.command_time:
+            time.sleep(self.settings.command_time)
+
+    def _hardware_trigger(self, at):
+        # triggers arriving while the camera is not acquiring are ignored, as on a real camera
+        with self._lock:
+            if self._streaming and self._trigger_mode():
+                self._triggers.append(at)
+                self._triggered.notify_all()
+
+    def _select_line(self):
+        line = self._lines[self._symbolic('LineSelector')]
+        self._device_nodemap.nodes['LineMode']._value = line['mode']
+        self._device_nodemap.nodes['LineSource']._value = line['source']
+
+    def _set_line(self, key, value):
+        self._lines[self._symbolic('LineSelector')][key] = value
+
+    def _line_edge(self, edge, at):
+        source = self._trigger_source()
+        if source in self._lines and self._lines[source]['mode'] == 0 and self._symbolic('TriggerActivation') == edge:
+            self._hardware_trigger(at)
+
+    def _counter_changed(self):
+        if self._symbolic('CounterTriggerSource') != 'Counter0End':
+            self._counter_generation += 1
+
+    def _reset_counter(self):
+        self._counter_generation += 1
+        if self._symbolic('CounterTriggerSource') == 'Counter0End' and \
+                self._symbolic('CounterEventSource') == 'MHzTick':
+            threading.Thread(target=self._run_counter, name=f'counter-{self.serial_number}', daemon=True,
+                             args=(self._counter_generation, self._value('CounterDelay') / 1e6,
+                                   self._value('CounterDuration') / 1e6)).start()
+
+    def _run_counter(self, generation, delay, duration):
+        # a self-restarting counter on an absolute timeline: Counter0Start, then Counter0Active after the delay
+        # until Counter0End, which starts the next period
+        start = time.perf_counter()
+        period = delay + duration
+        cycle = 0
+        while True:
+            began = start + cycle * period
+            edges = (('Counter0Start', began), ('RisingEdge', began + delay), ('Counter0End', began + period))
+            for edge, at in edges:
+                remaining = at - time.perf_counter()
+                if remaining > 0:
+                    time.sleep(remaining)
+                if self._counter_generation != generation:
+                    return
+                if edge == self._trigger_source():
+                    self._hardware_trigger(at)
+                if edge != 'Counter0Start' and any(self._lines[line]['mode'] == 1 and self._lines[line]['source'] == 1
+                                                   for line in self._lines):
+                    for peer in self.peers:
+                        peer._line_edge('FallingEdge' if edge == 'Counter0End' else edge, at)
+            cycle += 1
+
+    def _frame_time(self, frame_id, period):
+        # absolute timeline with per-frame jitter
+        jitter = self._rng.normal(0, self.settings.jitter) if self.settings.jitter else 0.0
+        return self._start + (frame_id + 1) * period + min(max(jitter, -period / 2), period / 2)
+
+    def _wait_for_trigger(self, deadline):
+        with self._lock:
+            while not self._triggers and self._streaming:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    return None
+                self._triggered.wait(remaining)
+            if not self._streaming:
+                return None
+            return self._triggers.pop(0)
+
+    def _next_free_running(self, period, deadline):
+        now = time.perf_counter()
+        newest = int((now - self._start) / period) - 1  # last frame whose readout finished
+        if self._symbolic('StreamBufferHandlingMode', self._stream_nodemap).startswith('Newest'):
+            frame_id = max(self._next_frame, newest)
+        else:
+            frame_id = max(self._next_frame, newest - self._value('StreamBufferCountManual', self._stream_nodemap) + 1)
+        # frames the buffer handling discarded because the reader fell behind
+        self.frames_dropped += frame_id - self._next_frame
+        arrival = self._frame_time(frame_id, period)
+        if arrival > deadline:
+            return None, None
+        delay = arrival - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        return frame_id, arrival
+
+    def GetNextImage(self, grabTimeout=None):
+        """
+        Waits for the next frame.
+
+        :param grabTimeout: Timeout in milliseconds, or None to wait indefinitely.
+        :raises SpinnakerException: With ``errorcode`` ``SPINNAKER_ERR_TIMEOUT`` if no frame arrived in time.
+        """
+        if not self._streaming:
+            raise SpinnakerException(f'Camera {self.serial_number} is not streaming', -1002)
+        deadline = time.perf_counter() + (grabTimeout / 1000 if grabTimeout is not None else 1e9)
+        period = self._frame_period()
+        while True:
+            if self._trigger_mode():
+                triggered = self._wait_for_trigger(deadline)
+                if triggered is None:
+                    break
+                frame_id, exposed = self._next_frame, triggered
+                # the frame is read out one exposure after the trigger
+                delay = triggered + self._value('ExposureTime') / 1e6 - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            else:
+                frame_id, exposed = self._next_free_running(period, deadline)
+                if frame_id is None:
+                    break
+            self._next_frame = frame_id + 1
+            if self.settings.drop_rate and self._rng.random() < self.settings.drop_rate:
+                self.frames_dropped += 1
+                continue  # lost in transport; its frame ID is never seen
+            return self._image(frame_id, exposed)
+        raise SpinnakerException(f'Camera {self.serial_number}: no image within {grabTimeout} ms',
+                                 SPINNAKER_ERR_TIMEOUT)
+
+    def _image(self, frame_id, exposed):
+        height, width = self._value('Height'), self._value('Width')
+        pattern = target_pattern(self.settings)
+        # the target drifts slowly across the field of view, and each camera sees it from a different offset
+        shift = int(frame_id * self.settings.drift) % 32
+        top, left = (8 * self.index + shift) % 32, shift
+        array = pattern[top:top + height, left:left + width]
+        if self._symbolic('PixelFormat') == 'Mono16':
+            array = array.astype(np.uint16) << 8
+        incomplete = bool(self.settings.incomplete_rate) and self._rng.random() < self.settings.incomplete_rate
+        self.frames_delivered += 1
+        # stamped on the device clock at the nominal exposure time, not when Python got round to it
+        return Image(array, frame_id, int(exposed * 1e9) + self._clock_offset, incomplete,
+                     self._value('ChunkModeActive'), self.settings.save_time, self.settings.convert_time)
+
+
+class CameraList:
+    def __init__(self, cameras):
+        self._cameras = list(cameras)
+
+    def GetSize(self):
+        return len(self._cameras)
+
+    def GetByIndex(self, index):
+        return self._cameras[index]
+
+    def GetBySerial(self, serial_number):
+        for cam in self._cameras:
+            if cam.serial_number == str(serial_number):
+                return cam
+        raise SpinnakerException(f'No camera with serial number {serial_number}', -1015)
+
+    def Clear(self):
+        self._cameras = []
+
+    def __len__(self):
+        return len(self._cameras)
+
+    def __getitem__(self, index):
+        return self._cameras[index]
+
+    def __iter__(self):
+        return iter(self._cameras)
+
+
+LibraryVersion = namedtuple('LibraryVersion', 'major minor type build')
+
+
+class System:
+    """Singleton like ``PySpin.System``; its cameras follow the settings in effect when it was first created."""
+
+    _instance = None
+
+    def __init__(self, settings):
+        self.settings = settings
+        self.cameras = [CameraPtr(f'{19000000 + i}', settings, i) for i in range(settings.cameras)]
+        # one GPIO harness: every camera's output lines drive every other camera's input lines
+        for cam in self.cameras:
+            cam.peers = [other for other in self.cameras if other is not cam]
+
+    @classmethod
+    def GetInstance(cls):
+        if cls._instance is None:
+            cls._instance = cls(_settings)
+        return cls._instance
+
+    def ReleaseInstance(self):
+        System._instance = None
+
+    def IsInUse(self):
+        return System._instance is self
+
+    def GetCameras(self):
+        return CameraList(self.cameras)
+
+    def GetLibraryVersion(self):
+        return LibraryVersion(2, 0, 0, 0)
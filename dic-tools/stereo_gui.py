@@ -2,10 +2,13 @@ import os
 
 os.environ['KIVY_NO_ARGS'] = '1'
 import sys
+import threading
 from kivymd.app import MDApp
 from kivymd.uix.boxlayout import MDBoxLayout
 from kivy.uix.scatterlayout import ScatterLayout
 from kivy.graphics.transformation import Matrix
+import simulated_pyspin
+simulated_pyspin.install_if_requested()  # DIC_TOOLS_SIMULATE runs the application on simulated cameras
 import acquistion as cam_aq
 from pathlib import Path
 from kivy.lang import Builder
@@ -13,13 +16,26 @@ import kivymd.utils.asynckivy as ak
 import PySpin
 import numpy as np
 from kivy.clock import Clock
-from kivy.graphics.texture import Texture
 from kivy.uix.image import Image
 from kivy.properties import BoundedNumericProperty, ReferenceListProperty, BooleanProperty, NumericProperty, \
-    StringProperty
+    StringProperty, OptionProperty
 from kivy.core.window import Window
 from loguru import logger
 import plyer
+import image_writer
+import raw_capture
+import stereo_sequence
+import burst_buffer
+import frame_pairing
+import acquisition_health
+import event_acquisition
+import camera_startup
+import grab_engine
+import stereo_snapshot
+import instrumentation
+import preview
+import math
+from datetime import datetime as dt
 
 Window.minimum_width = '725dp'
 Window.minimum_height = '550dp'
@@ -59,6 +75,10 @@ class ResizableDraggablePicture(ScatterLayout):
         self.center = self.init_pos
         self.scale = 1
 
+    def visible_region(self, image_widget):
+        # part of the frame inside the box holding the picture, from the scatter transform; None when all of it is
+        return preview.visible_region(image_widget, self.parent) if self.scale > 1 else None
+
 
 class FLIRImage(Image):
     pass
@@ -70,22 +90,58 @@ class FLIRCamera(MDBoxLayout):
     exposure_time = NumericProperty()
     fps = NumericProperty()
     cam_settings = ReferenceListProperty(acquiring, gain, exposure_time, fps)
-    image_id = NumericProperty(0)
+    health_text = StringProperty('')
 
     def __init__(self, camera, **kwargs):
         super(FLIRCamera, self).__init__(**kwargs)
         self.hardware_cam = camera
         self.frame_id = -1
         self.image = None
-        self.serial_number = None
+        self.descriptor = None
+        self.health = None
+        self.history = None
+        self.preview = None
+        # set while frames are pushed to the UI instead of polled; see StereoCamerasApp.acquisition_backend
+        self.mailbox = None
+        self.event_handler = None
+        self.grab_thread = None
+        self._publish_scheduled = False
+
+    @property
+    def serial_number(self):
+        return self.descriptor.serial_number if self.descriptor is not None else None
 
     def on_acquiring(self, switch, value):
         # self.acquiring = value
         if value:
+            # streaming and triggered snapshots cannot share the camera
+            MDApp.get_running_app().release_snapshot()
+            self.health.reset()
+            backend = MDApp.get_running_app().acquisition_backend
+            if backend != 'poll':
+                self.mailbox = event_acquisition.FrameMailbox(notify=self.schedule_publish)
+            if backend == 'events':
+                self.event_handler = event_acquisition.FrameEventHandler(self.health, self.mailbox)
+                self.hardware_cam.RegisterEventHandler(self.event_handler)
             self.hardware_cam.BeginAcquisition()
+            if backend == 'thread':
+                self.grab_thread = event_acquisition.grab_thread(self.hardware_cam, self.descriptor, self.mailbox,
+                                                                 self.health)
+                self.grab_thread.start()
             logger.debug('Acquisition started.')
         else:
+            if self.grab_thread is not None:
+                self.grab_thread.stop()
+                self.grab_thread.join()
+                self.grab_thread = None
             self.hardware_cam.EndAcquisition()
+            if self.event_handler is not None:
+                self.hardware_cam.UnregisterEventHandler(self.event_handler)
+                self.event_handler = None
+            if self.mailbox is not None:
+                if self.mailbox.overflow:
+                    logger.warning(f'{self.serial_number} Recording queue overflowed by {self.mailbox.overflow} frames')
+                self.mailbox = None
             logger.debug('Acquisition ended.')
 
     def on_gain(self, source, value):
@@ -103,9 +159,6 @@ class FLIRCamera(MDBoxLayout):
     async def configure_camera(self, fps, exposure_time, acquisition_mode='Continuous', buffer_mode='NewestOnly'):
 
         # Set acquisition mode to continuous
-        if self.serial_number is None:
-            self.serial_number = self.hardware_cam.DeviceSerialNumber.GetValue()
-        logger.debug('Serial Number Grabbed')
         node_acquisition_mode = self.hardware_cam.AcquisitionMode
         if not PySpin.IsAvailable(node_acquisition_mode) or not PySpin.IsWritable(node_acquisition_mode):
             logger.error('Unable to set acquisition mode to continuous (node retrieval; camera). Aborting... \n')
@@ -159,38 +212,113 @@ class FLIRCamera(MDBoxLayout):
     async def get_next_image(self, app, save_image=False, update_view=True, stop_stream=False):
         # trigger?
         logger.debug(f'{self.serial_number} Acquiring')
-        image_result = self.hardware_cam.GetNextImage()
-        current_frame_id = image_result.GetFrameID()
-        logger.debug('Image Result Grabbed')
-        if not image_result.IsIncomplete() and self.frame_id != current_frame_id:
-            self.image = image_result
-            self.frame_id = current_frame_id
-            width = image_result.GetWidth()
-            height = image_result.GetHeight()
-            if update_view:
-                image_arr = image_result.GetNDArray()
-                logger.debug(f'{self.serial_number} Array Gotten')
-                arr = np.copy(np.flipud(image_arr)).tobytes()
-                image_texture = Texture.create(size=(width, height), colorfmt='luminance')
-                image_texture.blit_buffer(arr, colorfmt='luminance')
-                logger.debug(f'{self.serial_number} Texture blitted')
-                image_view = self.ids['image_view']
-                image_view.texture = image_texture
-                logger.debug(f'{self.serial_number} Texture assigned')
-            if save_image or app.record_stream:
-                ak.start(self.save_image(app, image_result))
-                self.image_id += 1
-            if stop_stream:
-                self.ids['stream_switch'].active = False
-
-    async def save_image(self, app, image_result):
-        with cam_aq.working_directory(app.screen.ids['settings_grid'].ids['save_dir_input'].text):
-            image_converted = image_result.Convert(PySpin.PixelFormat_Mono8, PySpin.HQ_LINEAR)
-            image_id_str = f'{"0" * (3 - len(str(self.image_id)))}{self.image_id}'
-            filename = f'{app.project_name}_{image_id_str}_S#{self.serial_number}.jpg'
-            # Save image
-            image_converted.Save(filename)
-            logger.debug('Image saved at %s' % filename)
+        if self.mailbox is not None:
+            # frames are already being pushed to the mailbox, so the UI thread never waits for one: it takes the
+            # newest frame not shown yet, or else the last one publish_frames handled
+            image_result = self.mailbox.latest.take()
+            if image_result is None:
+                image_result = self.image
+            if image_result is None:
+                logger.warning(f'{self.serial_number} No frame received yet')
+            else:
+                self.use_image(app, image_result, save_image, update_view, record=False)
+        else:
+            started = instrumentation.start()
+            image_result = self.hardware_cam.GetNextImage()
+            instrumentation.stop('grab', self.serial_number, started)
+            logger.debug('Image Result Grabbed')
+            # counts frame id gaps and incomplete images; False for incomplete images and repeats
+            if self.health.observe(image_result):
+                self.use_image(app, image_result, save_image, update_view)
+        if stop_stream:
+            self.ids['stream_switch'].active = False
+
+    def schedule_publish(self):
+        # called from the grab or SDK thread; one UI callback covers every frame published before it runs, so the
+        # display rate follows the UI and the acquisition rate follows the camera
+        if not self._publish_scheduled:
+            self._publish_scheduled = True
+            Clock.schedule_once(self.publish_frames)
+
+    def publish_frames(self, dt):
+        self._publish_scheduled = False
+        mailbox = self.mailbox
+        if mailbox is None:
+            return
+        app = MDApp.get_running_app()
+        for image_result in mailbox.drain():
+            self.use_image(app, image_result, update_view=False)
+        latest = mailbox.latest.take()
+        if latest is not None:
+            self.show_image(latest)
+
+    def use_image(self, app, image_result, save_image=False, update_view=True, record=True):
+        self.image = image_result
+        self.frame_id = image_result.GetFrameID()
+        if record and not app.record_stream:
+            self.remember(app, image_result)
+        if update_view:
+            self.show_image(image_result)
+        if record and app.record_stream:
+            # saved once every camera has a frame with a matching timestamp
+            app.pair_frame(self, image_result)
+        elif save_image:
+            ak.start(self.save_image(app, image_result, app.image_id))
+
+    def show_image(self, image_result):
+        if self.preview is None:
+            # decimated to the widget's size; zooming in through the picture raises the resolution again
+            self.preview = preview.PreviewTexture(self.ids['image_view'])
+            self.ids['picture'].bind(scale=self.on_preview_zoom)
+        started = instrumentation.start()
+        # only the preview is decimated or cropped to what is on screen; recording keeps using image_result itself
+        self.preview.update(image_result.GetNDArray(), self.ids['picture'].visible_region(self.ids['image_view']))
+        instrumentation.stop('texture_upload', self.serial_number, started)
+        logger.debug(f'{self.serial_number} Texture updated')
+
+    def on_preview_zoom(self, picture, scale):
+        self.preview.zoom = scale
+
+    def remember(self, app, image_result):
+        # rolling pre-trigger window: a fixed set of reused frame buffers covering the last history_seconds
+        image_arr = image_result.GetNDArray()
+        n_slots = int(math.ceil(app.history_seconds * (self.fps or app.main_fps)))
+        if n_slots <= 0:
+            self.history = None
+            return
+        if self.history is None or not self.history.matches(n_slots, image_arr.shape, image_arr.dtype):
+            self.history = burst_buffer.FrameRingBuffer(n_slots, image_arr.shape, image_arr.dtype)
+        self.history.push(image_result)
+
+    def flush_history(self, app):
+        # pair and write the pre-trigger window ahead of the live stream
+        if self.history is None:
+            return
+        for slot in self.history.ordered_slots():
+            app.pair_frame(self, self.history.copy_out(slot))
+        logger.debug(f'{self.serial_number} flushed {len(self.history)} pre-trigger frames')
+        self.history.clear()
+
+    async def save_image(self, app, image_result, image_id):
+        if app.record_format == 'sequence' and app.record_stream:
+            # a memcpy into the memory-mapped sequence file on the sequence writer; no per-frame file or encode
+            app.write_to_sequence(self, image_result, image_id)
+            return
+        if app.record_format == 'raw':
+            # untouched sensor buffer; develop it after the test with `raw_capture.py develop`
+            image_to_save = raw_capture.RawFrame.from_image(image_result, image_id=image_id,
+                                                            **self.descriptor.metadata())
+            extension = 'raw'
+        else:
+            started = instrumentation.start()
+            image_to_save = image_result.Convert(PySpin.PixelFormat_Mono8, PySpin.HQ_LINEAR)
+            instrumentation.stop('convert', self.serial_number, started)
+            extension = 'jpg'
+        # absolute paths from templates computed once per session, so writer threads can save concurrently
+        filename = app.filename_templates(extension).path(self.descriptor.index, image_id=image_id)
+        # Encoding and writing happen on the writer pool so they don't stall the stream
+        app.writer.submit(image_to_save, filename, self.serial_number)
+        logger.debug('Image queued for %s' % filename)
 
 
 class SettingsGrid(MDBoxLayout):
@@ -200,17 +328,14 @@ class SettingsGrid(MDBoxLayout):
         super(SettingsGrid, self).__init__(**kwargs)
 
     def snap_picture(self, app):
-        # save current images (one shot).
+        # save current images (one shot): one common trigger, one frame per camera, written as a pair
         directory = Path(self.ids['save_dir_input'].text)
         if directory.is_dir() is True and str(directory) != '.':
-            for cam in app.cam_list:
-                # stop streaming on all cameras
-                if cam.acquiring is False:
-                    cam.ids['stream_switch'].active = True
-                # take picture with all cameras
-                ak.start(cam.get_next_image(app, save_image=True, stop_stream=True))
-            # app.image_id += 1
-            plyer.notification.notify(title='Stereo Cameras', message=f'{len(app.cam_list)} Captured Images displayed')
+            if app.capture_snapshot():
+                plyer.notification.notify(title='Stereo Cameras',
+                                          message=f'{len(app.cam_list)} Captured Images displayed')
+            else:
+                plyer.notification.notify(title='Stereo Cameras', message='Snapshot failed, see the log')
         else:
             self.ids['save_dir_input'].focus = True
             self.ids['save_dir_input'].focus = False
@@ -247,9 +372,32 @@ class StereoCamerasApp(MDApp):
     main_fps = BoundedNumericProperty(16.5, min=1.33, max=19)
     project_name = StringProperty('DIC Project')
     record_stream = BooleanProperty(False)
+    # background image writer settings; see image_writer.ImageWriterPool
+    writer_workers = NumericProperty(2)
+    writer_queue_size = NumericProperty(64)
+    writer_policy = OptionProperty(image_writer.BLOCK, options=image_writer.POLICIES)
+    record_format = OptionProperty('jpeg', options=['jpeg', 'raw', 'sequence'])
+    history_seconds = NumericProperty(5)  # pre-trigger window written out when recording starts
+    image_id = NumericProperty(0)  # shared by all cameras; frames saved together get the same id
+    snapshot_tolerance_ms = NumericProperty(1)  # largest device timestamp spread within a snapshot pair
+    snapshot_timeout = NumericProperty(1.0)  # seconds a snapshot may take before it is given up
+    startup_timeout = NumericProperty(10.0)  # seconds all cameras together may take to initialize
+    pair_tolerance_ms = NumericProperty(0)  # largest timestamp spread within a saved set; 0 for half a frame period
+    # 'thread' grabs on one thread per camera and 'events' has the SDK push frames, both publishing to the UI
+    # through Clock.schedule_once; 'poll' calls GetNextImage from the UI clock
+    acquisition_backend = OptionProperty('thread', options=['thread', 'events', 'poll'])
 
     def __init__(self, **kwargs):
         super(StereoCamerasApp, self).__init__(**kwargs)
+        self.writer = None
+        self.sequence_writer = None
+        self.sequence = None
+        self.sequence_start_id = 0
+        self.pairer = None
+        self.templates = {}
+        self.snapshot = None  # cameras stay armed between snapshots until a stream is started
+        self.snapshot_format = None
+        self.snapshot_writer = None
         # print(self.built)
 
     def build(self):
@@ -263,11 +411,134 @@ class StereoCamerasApp(MDApp):
         return self.screen
 
     def on_start(self):
+        self.writer = image_writer.ImageWriterPool(workers=int(self.writer_workers),
+                                                   max_queue=int(self.writer_queue_size), policy=self.writer_policy,
+                                                   spill_path=self.spill_path())
+        # one thread keeps the copies into the sequence file off the UI thread
+        self.sequence_writer = image_writer.ImageWriterPool(workers=1, max_queue=int(self.writer_queue_size),
+                                                            write=stereo_sequence.write_slot)
         Clock.schedule_interval(self.run_cameras, 1.0 / 60.0)
+        Clock.schedule_interval(self.sample_health, 1.0)
 
     def on_stop(self):
         # todo release images and uninit any active cameras
         ak.start(self.connect_flir_system(False))
+        self.close_sequence()
+        self.sequence_writer.close()
+        self.release_snapshot()
+        self.writer.close()
+        if self.snapshot_writer is not None:
+            self.snapshot_writer.close()
+        instrumentation.dump_report(Path(cam_aq.LATENCY_REPORT).absolute())
+
+    def cycle_record_format(self):
+        options = self.property('record_format').options
+        self.record_format = options[(options.index(self.record_format) + 1) % len(options)]
+        logger.info(f'Recording format set to {self.record_format}')
+
+    def on_record_stream(self, source, value):
+        if value:
+            self.sequence_start_id = self.image_id
+            tolerance_ns = self.pair_tolerance_ms * 1e6 if self.pair_tolerance_ms else 0.5e9 / self.main_fps
+            history_frames = max([len(cam.history) for cam in self.cam_list if cam.history is not None] or [0])
+            self.pairer = frame_pairing.FramePairer(
+                len(self.cam_list), tolerance_ns, cam_aq.latch_clock_offsets([c.hardware_cam for c in self.cam_list]),
+                max_pending=history_frames + 64)
+            # the saved sequence starts with the pre-trigger window
+            for cam in self.cam_list:
+                cam.flush_history(self)
+        else:
+            logger.info(f'Recording stopped, image writer: {self.writer.stats()}')
+            if self.pairer is not None:
+                self.pairer.log_stats()
+                self.pairer = None
+            self.close_sequence()
+
+    def pair_frame(self, cam, image_result):
+        for match in self.pairer.push(cam.descriptor.index, frame_pairing.frame_timestamp(image_result),
+                                      (cam, image_result)):
+            for matched_cam, matched_image in match.frames:
+                ak.start(matched_cam.save_image(self, matched_image, self.image_id))
+            self.image_id += 1
+
+    def filename_templates(self, extension):
+        # rebuilt only when the save directory, project name or cameras change
+        directory = self.screen.ids['settings_grid'].ids['save_dir_input'].text
+        serial_numbers = [cam.serial_number for cam in self.cam_list]
+        templates = self.templates.get(extension)
+        if templates is None or not templates.matches(directory, serial_numbers, project_name=self.project_name,
+                                                      extension=extension):
+            templates = image_writer.FilenameTemplates(
+                directory, '{project_name}_{{image_id:03d}}_S#{serial_number}.{extension}', serial_numbers,
+                project_name=self.project_name, extension=extension)
+            self.templates[extension] = templates
+            self.writer.spill_to(self.spill_path())
+        return templates
+
+    def spill_path(self):
+        # frames the writer cannot keep up with are spilled next to the session's own files, named like its sequences
+        directory = Path(self.screen.ids['settings_grid'].ids['save_dir_input'].text).absolute()
+        return directory / f'{self.project_name}_{dt.now():%Y%m%d_%H%M%S}_spill.raw'
+
+    def capture_snapshot(self):
+        snapshot_format = 'raw' if self.record_format == 'raw' else 'jpeg'
+        if self.snapshot is not None and self.snapshot_format != snapshot_format:
+            self.release_snapshot()
+        if self.snapshot is None:
+            for cam in self.cam_list:
+                if cam.acquiring:
+                    cam.ids['stream_switch'].active = False
+            process = raw_capture.copy_raw_frame if snapshot_format == 'raw' else grab_engine.convert_mono8
+            self.snapshot = stereo_snapshot.StereoSnapshot.arm(
+                [cam.hardware_cam for cam in self.cam_list], tolerance_ns=self.snapshot_tolerance_ms * 1e6,
+                timeout=self.snapshot_timeout, process=process)
+            if self.snapshot is None:
+                return False
+            self.snapshot_format = snapshot_format
+        result = self.snapshot.capture()
+        if result is None:
+            return False
+        if self.snapshot_writer is None:
+            # one job per pair; the pair is renamed into place only once both images are written
+            self.snapshot_writer = image_writer.ImageWriterPool(workers=1, write=stereo_snapshot.write_snapshot)
+        extension = 'raw' if snapshot_format == 'raw' else 'jpg'
+        paths = []
+        for cam, image in zip(self.cam_list, result.images):
+            if snapshot_format == 'raw':
+                image.metadata.update(cam.descriptor.metadata(), image_id=self.image_id)
+            paths.append(self.filename_templates(extension).path(cam.descriptor.index, image_id=self.image_id))
+            cam.show_image(image)
+        self.snapshot_writer.submit(result.images, paths)
+        logger.info(f'Snapshot {self.image_id} captured, timestamp spread {result.spread_ns / 1000:.0f} us')
+        self.image_id += 1
+        return True
+
+    def release_snapshot(self):
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def write_to_sequence(self, cam, image_result, image_id):
+        image_arr = image_result.GetNDArray()
+        if self.sequence is None:
+            directory = Path(self.screen.ids['settings_grid'].ids['save_dir_input'].text).absolute()
+            path = directory / f'{self.project_name}_{dt.now():%Y%m%d_%H%M%S}{stereo_sequence.EXTENSION}'
+            self.sequence = stereo_sequence.StereoSequence.create(
+                path, len(self.cam_list), image_arr.shape[0], image_arr.shape[1], image_arr.dtype,
+                serial_numbers=[c.serial_number for c in self.cam_list], project_name=self.project_name,
+                cameras=[c.descriptor.metadata() for c in self.cam_list], first_image_id=self.sequence_start_id)
+            logger.info(f'Recording sequence to {path}')
+        self.sequence_writer.submit(image_result, stereo_sequence.SequenceSlot(
+            self.sequence, image_id - self.sequence_start_id, cam.descriptor.index, image_result.GetFrameID(),
+            frame_pairing.frame_timestamp(image_result), cam.exposure_time, cam.gain), cam.serial_number)
+
+    def close_sequence(self):
+        if self.sequence is not None:
+            # every queued frame lands in the file before it is closed
+            self.sequence_writer.flush()
+            logger.info(f'Sequence closed with {len(self.sequence)} frames: {self.sequence.path}')
+            self.sequence.close()
+            self.sequence = None
 
     def on_main_exposure_time(self, source, value):
         for cam in self.cam_list:
@@ -282,12 +553,23 @@ class StereoCamerasApp(MDApp):
             self.system = PySpin.System.GetInstance()
             # Retrieve list of cameras from the system
             cameras = self.system.GetCameras()
-            self.cam_list = [FLIRCamera(cam) for cam in cameras]
+            candidates = [FLIRCamera(cam) for cam in cameras]
             cameras.Clear()
-            for cam in self.cam_list:
-                self.camera_box.add_widget(cam)
+            self.cam_list = []
+
+            def start_camera(i, cam):
+                # runs on a thread per camera; only SDK calls here, the Kivy side is configured on the UI thread
                 cam.hardware_cam.Init()
-                ak.start(cam.configure_camera(self.main_fps, self.main_exposure_time))
+                cam_aq.invalidate_camera_nodes(cam.hardware_cam)
+                return cam_aq.enable_chunk_timestamps(cam.hardware_cam)
+
+            def start_all(system):
+                # Init overlaps across cameras; a camera that fails or hangs is left out
+                startup = camera_startup.start_cameras(candidates, start_camera, timeout=self.startup_timeout)
+                Clock.schedule_once(lambda dt: ak.start(self._add_cameras(system, startup)))
+
+            # off the UI thread, so the window stays responsive while the cameras start
+            threading.Thread(target=start_all, args=(self.system,), name='camera-startup', daemon=True).start()
         else:
             for camera in self.cam_list:
                 # camera.hardware_cam.DeInit()
@@ -298,9 +580,35 @@ class StereoCamerasApp(MDApp):
             self.system.ReleaseInstance()
             del self.system
 
-    def run_cameras(self, dt):
+    async def _add_cameras(self, system, startup):
+        if getattr(self, 'system', None) is not system:
+            logger.warning('Camera system was reset while the cameras started; discarding them')
+            return
+        cam_list = []
+        for result in startup:
+            if not result.ok:
+                continue
+            if await result.cam.configure_camera(self.main_fps, self.main_exposure_time) is False:
+                logger.error(f'Camera {result.index} could not be configured; leaving it out')
+                continue
+            cam_list.append(result.cam)
+        for i, cam in enumerate(cam_list):
+            # indices follow the cameras that actually started, since pairing and recording use them
+            cam.descriptor = cam_aq.describe_camera(cam.hardware_cam, i)
+            cam.health = acquisition_health.AcquisitionHealth(f'S#{cam.serial_number}',
+                                                              cam_aq.camera_nodes(cam.hardware_cam))
+            self.camera_box.add_widget(cam)
+        self.cam_list = cam_list
+
+    def sample_health(self, dt):
         for cam in self.cam_list:
             if cam.acquiring:
+                drop_rate = cam.health.sample()
+                cam.health_text = f'Lost {cam.health.lost} ({drop_rate:.1f}/s)'
+
+    def run_cameras(self, dt):
+        for cam in self.cam_list:
+            if cam.acquiring and cam.mailbox is None:
                 ak.start(cam.get_next_image(self, update_view=True))
 
     def reset_camera_system(self):
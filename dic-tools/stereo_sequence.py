@@ -0,0 +1,274 @@
+"""
+Single-file, chunked, memory-mapped container for a stereo (or N-camera) image sequence.
+
+Layout::
+
+    header   HEADER_SIZE bytes: MAGIC followed by a JSON description, zero padded
+    chunk 0  metadata table (chunk_frames x n_cameras records of METADATA_DTYPE), padded to ALIGNMENT
+             frame slots    (chunk_frames x n_cameras x height x width)
+    chunk 1  ...
+
+Every slot has a fixed size, so frame *n* of camera *k* lives at a computable offset and is read as a zero-copy
+NumPy view. The file grows one chunk at a time while recording, or is reserved up front when the length is known.
+It only ever grows by writing past its end: Windows refuses to truncate, and so to resize, a file while any part
+of it is mapped. ``export`` writes the sequence back out as per-frame images named the way DICe expects:
+
+    python stereo_sequence.py export <sequence file> <output directory> --format tiff
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+import numpy as np
+from loguru import logger
+
+MAGIC = b'DICSEQ01'
+HEADER_SIZE = 4096
+ALIGNMENT = 4096
+EXTENSION = '.dicseq'
+METADATA_DTYPE = np.dtype([('frame_id', '<i8'), ('timestamp', '<u8'), ('exposure', '<f8'), ('gain', '<f8'),
+                           ('valid', 'u1')])
+
+SequenceSlot = namedtuple('SequenceSlot', 'sequence n k frame_id timestamp exposure gain')
+
+
+def _align(size):
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+class StereoSequence:
+    """
+    A sequence file opened for reading or recording. Use ``create`` or ``open`` rather than the constructor.
+
+    Slots of different frames or cameras may be written from different threads at the same time.
+    """
+
+    def __init__(self, path, header, mode):
+        self.path = Path(path)
+        self.header = header
+        self.mode = mode
+        self.n_cameras = header['n_cameras']
+        self.height = header['height']
+        self.width = header['width']
+        self.dtype = np.dtype(header['dtype'])
+        self.chunk_frames = header['chunk_frames']
+        self.serial_numbers = header['serial_numbers']
+        self._metadata_bytes = _align(self.chunk_frames * self.n_cameras * METADATA_DTYPE.itemsize)
+        self._slot_shape = (self.chunk_frames, self.n_cameras, self.height, self.width)
+        self._chunk_bytes = self._metadata_bytes + _align(int(np.prod(self._slot_shape)) * self.dtype.itemsize)
+        self._chunks = {}
+        self._lock = threading.Lock()
+        self.n_chunks = (os.path.getsize(self.path) - HEADER_SIZE) // self._chunk_bytes
+        self.frame_count = self._count_frames()
+
+    @classmethod
+    def create(cls, path, n_cameras, height, width, dtype=np.uint8, chunk_frames=32, serial_numbers=None,
+               reserve_frames=0, **attributes):
+        """
+        Creates an empty sequence file, replacing any existing one.
+
+        :param chunk_frames: Frames per camera added each time the file grows.
+        :param serial_numbers: Serial number of each camera, used in exported filenames.
+        :param reserve_frames: Frames per camera to allocate before anything is mapped.
+        :param attributes: Extra JSON-serializable values stored in the header, e.g. the project name, or
+            ``first_image_id``, the image ID ``export`` gives frame 0.
+        """
+        header = {'n_cameras': n_cameras, 'height': height, 'width': width, 'dtype': np.dtype(dtype).str,
+                  'chunk_frames': chunk_frames,
+                  'serial_numbers': [str(s) for s in serial_numbers] if serial_numbers else
+                  [str(k) for k in range(n_cameras)]}
+        header.update(attributes)
+        encoded = MAGIC + json.dumps(header).encode()
+        if len(encoded) > HEADER_SIZE:
+            raise ValueError('Sequence header is too large')
+        with open(path, 'wb') as sequence_file:
+            sequence_file.write(encoded.ljust(HEADER_SIZE, b'\0'))
+        sequence = cls(path, header, 'r+')
+        sequence._grow(-(-reserve_frames // chunk_frames))
+        return sequence
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        """
+        Opens an existing sequence file.
+
+        :param mode: ``'r'`` for read-only views, ``'r+'`` to keep recording into it.
+        """
+        with open(path, 'rb') as sequence_file:
+            raw_header = sequence_file.read(HEADER_SIZE)
+        if not raw_header.startswith(MAGIC):
+            raise ValueError(f'{path} is not a stereo sequence file')
+        return cls(path, json.loads(raw_header[len(MAGIC):].rstrip(b'\0')), mode)
+
+    def _chunk(self, chunk_index):
+        chunk = self._chunks.get(chunk_index)
+        if chunk is None:
+            with self._lock:
+                chunk = self._chunks.get(chunk_index)
+                if chunk is None:
+                    if chunk_index >= self.n_chunks:
+                        if self.mode == 'r':
+                            raise IndexError(f'Chunk {chunk_index} is beyond the end of {self.path}')
+                        self._grow(chunk_index + 1)
+                    offset = HEADER_SIZE + chunk_index * self._chunk_bytes
+                    metadata = np.memmap(self.path, METADATA_DTYPE, self.mode, offset,
+                                         (self.chunk_frames, self.n_cameras))
+                    frames = np.memmap(self.path, self.dtype, self.mode, offset + self._metadata_bytes,
+                                       self._slot_shape)
+                    chunk = self._chunks[chunk_index] = (metadata, frames)
+        return chunk
+
+    def _grow(self, n_chunks):
+        if n_chunks <= self.n_chunks:
+            return
+        # extended by writing its last byte rather than with truncate, which fails on Windows while chunks are mapped
+        with open(self.path, 'r+b') as sequence_file:
+            sequence_file.seek(HEADER_SIZE + n_chunks * self._chunk_bytes - 1)
+            sequence_file.write(b'\0')
+        self.n_chunks = n_chunks
+
+    def _count_frames(self):
+        # reserved chunks at the end may not have been written yet
+        for chunk_index in range(self.n_chunks - 1, -1, -1):
+            written = np.flatnonzero(self._chunk(chunk_index)[0]['valid'].any(axis=1))
+            if len(written):
+                return chunk_index * self.chunk_frames + int(written[-1]) + 1
+        return 0
+
+    def __len__(self):
+        return self.frame_count
+
+    def frame(self, n, k):
+        """
+        :return: Zero-copy view of frame ``n`` of camera ``k``.
+        :rtype: np.ndarray
+        """
+        return self._chunk(n // self.chunk_frames)[1][n % self.chunk_frames, k]
+
+    def frames(self, n):
+        """
+        :return: Zero-copy view of frame ``n`` of every camera, shaped ``(n_cameras, height, width)``.
+        :rtype: np.ndarray
+        """
+        return self._chunk(n // self.chunk_frames)[1][n % self.chunk_frames]
+
+    def metadata(self, n, k=None):
+        """
+        :return: Metadata record of frame ``n`` of camera ``k``, or of every camera if ``k`` is None.
+        """
+        table = self._chunk(n // self.chunk_frames)[0][n % self.chunk_frames]
+        return table if k is None else table[k]
+
+    def write(self, n, k, image, frame_id=-1, timestamp=0, exposure=0.0, gain=0.0):
+        """
+        Copies ``image`` into the slot of frame ``n`` of camera ``k`` and records its metadata.
+
+        :raises TypeError: If ``image`` cannot be stored in the sequence's dtype without losing bits.
+        """
+        metadata, frames = self._chunk(n // self.chunk_frames)
+        slot = n % self.chunk_frames
+        np.copyto(frames[slot, k], image, casting='safe')
+        metadata[slot, k] = (frame_id, timestamp, exposure, gain, 1)
+        if n >= self.frame_count:
+            self.frame_count = n + 1
+
+    def flush(self):
+        for metadata, frames in list(self._chunks.values()):
+            metadata.flush()
+            frames.flush()
+
+    def close(self):
+        if self.mode != 'r':
+            self.flush()
+        self._chunks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_slot(image, slot):
+    """
+    Writes an image into a sequence slot. Use it as the write function of an ``image_writer.ImageWriterPool`` to
+    keep the copy off the thread that grabs or displays the frames.
+
+    :param image: Image with a ``GetNDArray()`` method.
+    :type slot: SequenceSlot
+    """
+    slot.sequence.write(slot.n, slot.k, image.GetNDArray(), slot.frame_id, slot.timestamp, slot.exposure, slot.gain)
+
+
+def export_filename(project_name, n, serial_number, image_format):
+    """Per-frame filename in the ``{project}_{id}_S#{serial}`` form used by the GUI recorder."""
+    return f'{project_name}_{n:03d}_S#{serial_number}.{image_format}'
+
+
+_export_sequence = None
+
+
+def _export_frame(path, n, k, output_path):
+    # each process maps the sequence once and reuses it for all of its frames
+    global _export_sequence
+    import PySpin
+    if _export_sequence is None or _export_sequence.path != Path(path):
+        _export_sequence = StereoSequence.open(path)
+    frame = np.ascontiguousarray(_export_sequence.frame(n, k))
+    pixel_format = PySpin.PixelFormat_Mono8 if frame.dtype == np.uint8 else PySpin.PixelFormat_Mono16
+    image = PySpin.Image.Create(frame.shape[1], frame.shape[0], 0, 0, pixel_format, frame)
+    image.Save(str(output_path))
+    return output_path
+
+
+def export(path, output_directory, image_format='tiff', project_name=None, workers=None):
+    """
+    Writes every valid frame of a sequence as a separate image for DICe, using a pool of processes. Frame *n* keeps
+    the image ID it was recorded under, ``first_image_id`` from the header plus *n*.
+
+    :param project_name: Filename prefix. Defaults to the one stored in the header, then the file stem.
+    :return: True if every frame was exported, False otherwise.
+    :rtype: bool
+    """
+    output_directory = Path(output_directory)
+    output_directory.mkdir(parents=True, exist_ok=True)
+    with StereoSequence.open(path) as sequence:
+        project_name = project_name or sequence.header.get('project_name') or Path(path).stem
+        first_image_id = sequence.header.get('first_image_id', 0)
+        jobs = [(n, k, output_directory / export_filename(project_name, first_image_id + n, sequence.serial_numbers[k],
+                                                          image_format))
+                for n in range(len(sequence)) for k in range(sequence.n_cameras)
+                if sequence.metadata(n, k)['valid']]
+    logger.info(f'Exporting {len(jobs)} frames from {path} to {output_directory}')
+    result = True
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(_export_frame, str(path), n, k, output_path) for n, k, output_path in jobs]
+        for (n, k, output_path), future in zip(jobs, futures):
+            try:
+                future.result()
+            except Exception as ex:
+                logger.error(f'Unable to export frame {n} of camera {k}: {ex}')
+                result = False
+    logger.success('Done!')
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Tools for stereo sequence files.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export_parser = commands.add_parser('export', help='write a sequence out as per-frame images for DICe')
+    export_parser.add_argument('sequence', type=Path)
+    export_parser.add_argument('output', type=Path)
+    export_parser.add_argument('--format', choices=('tiff', 'png', 'jpg'), default='tiff')
+    export_parser.add_argument('--project-name', default=None)
+    export_parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    return export(args.sequence, args.output, args.format, args.project_name, args.workers)
+
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,249 @@
+"""
+Synchronized stereo snapshots.
+
+``StereoSnapshot`` keeps every camera armed in software trigger mode. Each ``capture`` fires one common trigger
+through a ``TriggerDispatcher``, takes exactly one frame per camera within a bounded time and accepts the set only
+if the device timestamps agree within a tolerance. Because the cameras stay armed, a snapshot costs one exposure and
+readout rather than starting and stopping streams, so repeated snapshots such as calibration grids run at tens of
+pairs per second.
+
+``write_snapshot`` saves a set under temporary names and renames them into place with ``os.replace`` only once
+every image was written, so a pair on disk is always complete. Use it as the write function of an
+``image_writer.ImageWriterPool`` to keep the encode off the capture path.
+
+Run this module directly to measure the snapshot rate with simulated cameras.
+"""
+import os
+import tempfile
+import time
+from collections import namedtuple
+from pathlib import Path
+if __name__ == '__main__':
+    # run as a script, the benchmark uses simulated cameras, installed before anything imports PySpin
+    import simulated_pyspin
+    simulated_pyspin.install()
+import PySpin
+from loguru import logger
+from frame_pairing import frame_timestamp
+from grab_engine import convert_mono8
+from raw_capture import RawFrame
+from trigger_dispatch import TriggerDispatcher
+
+Snapshot = namedtuple('Snapshot', 'images frame_ids timestamps spread_ns')
+
+
+def write_snapshot(images, paths):
+    """
+    Writes a set of images so that either all of them or none appear under their final names.
+
+    :param images: One image per camera, each with a ``Save(path)`` method.
+    :param paths: Final path of each image. The file extension decides the format.
+    """
+    paths = [Path(path) for path in paths]
+    temporary = [path.with_name('.%s.partial%s' % (path.stem, path.suffix)) for path in paths]
+    try:
+        for image, path, final in zip(images, temporary, paths):
+            if isinstance(image, RawFrame):
+                # the index has to name the file it will be found under
+                image.Save(str(path), indexed_name=final.name)
+            else:
+                image.Save(str(path))
+        for path, final in zip(temporary, paths):
+            os.replace(path, final)
+    except Exception:
+        for path in temporary:
+            if path.exists():
+                path.unlink()
+        raise
+
+
+class StereoSnapshot:
+    """
+    Captures one frame per camera for each common trigger.
+
+    :param cam_list: Cameras in software trigger mode with acquisition begun; see ``arm``.
+    :type cam_list: list of CameraPtr
+    :param dispatcher: Fires every camera's software trigger at once.
+    :type dispatcher: trigger_dispatch.TriggerDispatcher
+    :param tolerance_ns: Largest spread of device timestamps accepted within a snapshot.
+    :param timeout: Longest time a snapshot may take, in seconds.
+    :param clock_offsets: Per-camera device minus host clock offsets in ns, e.g. from
+        ``acquistion.latch_clock_offsets``. Cameras without one are referenced to the host time their first
+        snapshot was triggered at.
+    :param process: Applied to each frame before its buffer is released.
+    """
+
+    def __init__(self, cam_list, dispatcher, tolerance_ns=1e6, timeout=1.0, clock_offsets=None, process=convert_mono8):
+        self.cam_list = list(cam_list)
+        self.dispatcher = dispatcher
+        self.tolerance_ns = tolerance_ns
+        self.timeout = timeout
+        self.clock_offsets = list(clock_offsets) if clock_offsets is not None else [None] * len(self.cam_list)
+        self.process = process
+        self.captured = 0
+        self.rejected = 0
+        self._armed_here = False
+        self._buffer_modes = []
+        self._stale = False
+
+    @classmethod
+    def arm(cls, cam_list, **kwargs):
+        """
+        Puts every camera in software trigger mode with chunk timestamps and an ``OldestFirst`` stream buffer and
+        begins acquisition. ``close`` undoes this again.
+
+        :return: The armed snapshot, or None if a camera could not be configured.
+        :rtype: StereoSnapshot or None
+        """
+        import acquistion as cam_aq
+        cam_list = list(cam_list)
+        buffer_modes = []
+        dispatcher = None
+        started = []
+        armed = False
+        try:
+            for cam in cam_list:
+                node_buffer_mode = cam_aq.camera_nodes(cam).enumeration('StreamBufferHandlingMode',
+                                                                        cam_aq.STREAM_NODEMAP, writable=False)
+                buffer_modes.append(node_buffer_mode.GetCurrentEntry().GetSymbolic()
+                                    if node_buffer_mode is not None else None)
+                cam_aq.configure_camera(cam, buffer_mode='OldestFirst')
+                cam_aq.enable_chunk_timestamps(cam)
+                if not cam_aq.configure_trigger(cam, cam_aq.triggers.software):
+                    return None
+            try:
+                dispatcher = TriggerDispatcher.from_nodes([cam_aq.camera_nodes(cam) for cam in cam_list])
+            except ValueError as ex:
+                logger.error(f'Unable to arm snapshot: {ex}')
+                return None
+            kwargs.setdefault('clock_offsets', cam_aq.latch_clock_offsets(cam_list))
+            for cam in cam_list:
+                cam.BeginAcquisition()
+                started.append(cam)
+            snapshot = cls(cam_list, dispatcher, **kwargs)
+            armed = True
+        finally:
+            if not armed:
+                # whatever failed, no camera is left streaming, in trigger mode or with another buffer mode
+                if dispatcher is not None:
+                    dispatcher.close()
+                for cam in started:
+                    cam.EndAcquisition()
+                for cam, buffer_mode in zip(cam_list, buffer_modes):
+                    cam_aq.reset_trigger(cam_aq.camera_nodes(cam))
+                    if buffer_mode is not None:
+                        cam_aq.configure_camera(cam, buffer_mode=buffer_mode)
+        snapshot._armed_here = True
+        snapshot._buffer_modes = buffer_modes
+        return snapshot
+
+    def _drain(self):
+        # frames a failed snapshot left behind would otherwise be taken for the next trigger's
+        for cam in self.cam_list:
+            while True:
+                try:
+                    cam.GetNextImage(1).Release()
+                except Exception:
+                    break
+        self._stale = False
+
+    def capture(self):
+        """
+        Triggers every camera once and collects the frames.
+
+        :return: The snapshot, or None if a camera did not deliver a complete frame within the timeout or the
+            timestamps spread further than the tolerance.
+        :rtype: Snapshot or None
+        """
+        if self._stale:
+            self._drain()
+        deadline = time.perf_counter() + self.timeout
+        if not self.dispatcher.fire():
+            return self._reject('trigger failed')
+        fired = time.perf_counter_ns()
+        images, frame_ids, timestamps = [], [], []
+        for i, cam in enumerate(self.cam_list):
+            remaining_ms = max(int((deadline - time.perf_counter()) * 1000), 1)
+            try:
+                image_result = cam.GetNextImage(remaining_ms)
+            except Exception as ex:
+                return self._reject(f'camera {i} delivered no frame: {ex}')
+            try:
+                if image_result.IsIncomplete():
+                    return self._reject(f'camera {i} frame incomplete, status {image_result.GetImageStatus()}')
+                timestamp = frame_timestamp(image_result)
+                if self.clock_offsets[i] is None:
+                    self.clock_offsets[i] = timestamp - fired
+                images.append(self.process(image_result))
+                frame_ids.append(image_result.GetFrameID())
+                timestamps.append(timestamp - self.clock_offsets[i])
+            except PySpin.SpinnakerException as ex:
+                return self._reject(f'camera {i} error: {ex}')
+            finally:
+                image_result.Release()
+        spread = max(timestamps) - min(timestamps)
+        if spread > self.tolerance_ns:
+            return self._reject(f'timestamps spread {spread / 1000:.0f} us')
+        self.captured += 1
+        return Snapshot(images, frame_ids, timestamps, spread)
+
+    def _reject(self, reason):
+        logger.warning(f'Snapshot rejected, {reason}')
+        self.rejected += 1
+        self._stale = True
+        return None
+
+    def close(self):
+        """Stops the trigger threads and, if ``arm`` armed the cameras, ends acquisition and turns triggering off."""
+        self.dispatcher.close()
+        if self._armed_here:
+            import acquistion as cam_aq
+            for cam, buffer_mode in zip(self.cam_list, self._buffer_modes):
+                cam.EndAcquisition()
+                cam_aq.reset_trigger(cam_aq.camera_nodes(cam))
+                if buffer_mode is not None:
+                    cam_aq.configure_camera(cam, buffer_mode=buffer_mode)
+            self._armed_here = False
+        logger.info(f'Snapshots: {self.captured} captured, {self.rejected} rejected')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def benchmark(num_cameras=2, num_snapshots=100, exposure_time=0.01, shape=(1024, 1224), tolerance_ms=5.0):
+    """
+    Measures the rate of repeated snapshots from simulated cameras armed by ``StereoSnapshot.arm``, each pair
+    written atomically on a writer pool.
+
+    :param tolerance_ms: Timestamp tolerance. Simulated cameras stamp a frame with the host time their trigger's
+        ``Execute`` ran, which the writer threads delay by up to a few milliseconds through the GIL, unlike the
+        trigger inputs of real cameras.
+
+    :return: Snapshots per second.
+    :rtype: float
+    """
+    from image_writer import ImageWriterPool
+    cams = simulated_pyspin.open_cameras(num_cameras, width=shape[1], height=shape[0], exposure_time=exposure_time)
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        with ImageWriterPool(workers=2, write=write_snapshot) as writer, \
+                StereoSnapshot.arm(cams, tolerance_ns=tolerance_ms * 1e6) as snapshot:
+            for n in range(num_snapshots):
+                result = snapshot.capture()
+                if result is not None:
+                    writer.submit(result.images, [Path(directory) / f'snap_{n:04d}_S#{cam.serial_number}.raw'
+                                                  for cam in cams])
+        rate = snapshot.captured / (time.perf_counter() - start)
+        written = len(list(Path(directory).glob('snap_*')))
+    for cam in cams:
+        cam.DeInit()
+    logger.info(f'{snapshot.captured} snapshots at {rate:.1f} per second, {snapshot.rejected} rejected, '
+                f'{written} files written')
+    return rate
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,27 @@
+"""
+The tests run against simulated cameras: simulated_pyspin is installed as PySpin before any module under test imports
+it, so no Spinnaker SDK or hardware is needed.
+"""
+import sys
+from pathlib import Path
+import pytest
+
+sys.path.insert(0, str(Path(__file__).absolute().parents[1]))
+
+import simulated_pyspin  # noqa: E402
+
+simulated_pyspin.install()
+
+
+@pytest.fixture
+def cams():
+    """Two initialized simulated cameras with a ``NewestOnly`` stream buffer, deinitialized afterwards."""
+    import acquistion as cam_aq
+    cams = simulated_pyspin.open_cameras(2, width=64, height=48, fps=200.0)
+    for cam in cams:
+        # a new simulated system reuses the unique IDs, and so the cached nodes, of the previous test's cameras
+        cam_aq.invalidate_camera_nodes(cam)
+        cam_aq.configure_camera(cam, buffer_mode='NewestOnly')
+    yield cams
+    for cam in cams:
+        cam.DeInit()
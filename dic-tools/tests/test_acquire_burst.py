@@ -0,0 +1,33 @@
+import threading
+import pytest
+import acquistion as cam_aq
+import stereo_sequence
+
+
+def assert_restored(cams):
+    assert not any(thread.name.startswith('burst-') for thread in threading.enumerate())
+    for cam in cams:
+        assert not cam.IsStreaming()
+        node = cam_aq.camera_nodes(cam).enumeration('StreamBufferHandlingMode', cam_aq.STREAM_NODEMAP, writable=False)
+        assert node.GetCurrentEntry().GetSymbolic() == 'NewestOnly'
+
+
+def test_burst_is_saved_and_cameras_restored(cams, tmp_path):
+    assert cam_aq.acquire_burst(cams, 10, pre_trigger_frames=5, save_directory=tmp_path, wait=None)
+    assert len(list(tmp_path.glob('burst_*' + stereo_sequence.EXTENSION))) == 1
+    assert_restored(cams)
+
+
+def test_interrupted_burst_restores_cameras(cams, tmp_path):
+    def interrupt():
+        raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        cam_aq.acquire_burst(cams, 10, pre_trigger_frames=5, save_directory=tmp_path, wait=interrupt)
+    assert_restored(cams)
+
+
+def test_burst_times_out(cams, tmp_path, monkeypatch):
+    monkeypatch.setattr(cam_aq, 'BURST_TIMEOUT', 0.2)
+    # 1000 frames at 200 fps take far longer than the timeout
+    assert not cam_aq.acquire_burst(cams, 1000, pre_trigger_frames=5, save_directory=tmp_path, wait=None)
+    assert_restored(cams)
@@ -0,0 +1,55 @@
+import threading
+import time
+import acquistion as cam_aq
+from acquisition_health import AcquisitionHealth
+from event_acquisition import FrameEventHandler, FrameMailbox, grab_thread
+
+
+def wait_for_frames(mailbox, count, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while mailbox.recording.qsize() < count and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def assert_published(mailbox, count, producer):
+    frames = mailbox.drain()
+    assert len(frames) >= count
+    frame_ids = [frame.GetFrameID() for frame in frames]
+    assert frame_ids == sorted(set(frame_ids))
+    # the preview slot holds a frame from the producer thread
+    latest = mailbox.latest.take()
+    assert latest is not None and latest.GetFrameID() >= frame_ids[0]
+    assert latest.GetNDArray().shape == (48, 64)
+    assert producer and threading.current_thread().name not in producer
+
+
+def test_event_handler_publishes_frames_from_the_camera_thread(cams):
+    cam = cams[0]
+    producer = set()
+    handler = FrameEventHandler(AcquisitionHealth('Camera 0'),
+                                FrameMailbox(notify=lambda: producer.add(threading.current_thread().name)))
+    cam.RegisterEventHandler(handler)
+    cam.BeginAcquisition()
+    try:
+        wait_for_frames(handler.mailbox, 10)
+    finally:
+        cam.EndAcquisition()
+        cam.UnregisterEventHandler(handler)
+    assert handler.errors == 0
+    assert_published(handler.mailbox, 10, producer)
+
+
+def test_grab_thread_publishes_frames(cams):
+    cam = cams[0]
+    producer = set()
+    mailbox = FrameMailbox(notify=lambda: producer.add(threading.current_thread().name))
+    cam.BeginAcquisition()
+    worker = grab_thread(cam, cam_aq.describe_camera(cam, 0), mailbox, timeout=100)
+    worker.start()
+    try:
+        wait_for_frames(mailbox, 10)
+    finally:
+        worker.stop()
+        worker.join()
+        cam.EndAcquisition()
+    assert_published(mailbox, 10, producer)
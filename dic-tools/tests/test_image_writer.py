@@ -0,0 +1,75 @@
+import threading
+import numpy as np
+import simulated_pyspin
+from image_writer import SPILL, FilenameTemplates, ImageWriterPool
+
+
+def test_braces_in_directory_and_session_are_kept(tmp_path):
+    directory = tmp_path / 'run{1}'
+    templates = FilenameTemplates(directory, '{project_name}_{{image_id:03d}}_S#{serial_number}.{extension}',
+                                  ['1{2}'], project_name='dic{x}', extension='png')
+    assert templates.path(0, image_id=1) == directory.absolute() / 'dic{x}_001_S#1{2}.png'
+
+
+def test_concurrent_saves_from_several_cameras(tmp_path):
+    num_cameras, frames_per_camera = 4, 60
+    cams = simulated_pyspin.open_cameras(num_cameras, width=64, height=48, fps=0.0)
+    templates = FilenameTemplates(tmp_path / 'session{0}', 'stress_{{image_id:04d}}_S#{serial_number}.raw',
+                                  [cam.serial_number for cam in cams])
+    templates.directory.mkdir()
+
+    def grab(index, cam):
+        cam.BeginAcquisition()
+        for image_id in range(frames_per_camera):
+            image_result = cam.GetNextImage()
+            array = image_result.GetNDArray().copy()
+            image_result.Release()
+            # the marker: camera index and image ID in the first pixels
+            array.reshape(-1)[:4] = np.array([index, image_id], dtype='<u2').view(np.uint8)
+            pool.submit(simulated_pyspin.Image(array), templates.path(index, image_id=image_id), cam.serial_number)
+        cam.EndAcquisition()
+
+    try:
+        with ImageWriterPool(workers=8, max_queue=16) as pool:
+            grabbers = [threading.Thread(target=grab, args=(i, cam)) for i, cam in enumerate(cams)]
+            for thread in grabbers:
+                thread.start()
+            for thread in grabbers:
+                thread.join()
+    finally:
+        for cam in cams:
+            cam.DeInit()
+
+    stats = pool.stats()
+    assert stats['errors'] == 0 and stats['written'] == num_cameras * frames_per_camera
+    assert len(list(templates.directory.iterdir())) == num_cameras * frames_per_camera
+    for index in range(num_cameras):
+        for image_id in range(frames_per_camera):
+            path = templates.path(index, image_id=image_id)
+            assert path.is_file(), path
+            marker = np.fromfile(str(path), dtype=np.uint8, count=4).view('<u2')
+            assert list(marker) == [index, image_id], path
+
+
+def test_spill_follows_the_session(tmp_path):
+    writing, release = threading.Event(), threading.Event()
+
+    def write(image, path):
+        writing.set()
+        release.wait()
+
+    frame = np.zeros((4, 4), dtype=np.uint8)
+    pool = ImageWriterPool(workers=1, max_queue=1, policy=SPILL, spill_path=tmp_path / 'first_spill.raw',
+                           write=write)
+    try:
+        pool.submit(frame, tmp_path / '0.raw')
+        writing.wait(5)
+        pool.submit(frame, tmp_path / '1.raw')
+        pool.spill_to(tmp_path / 'second_spill.raw')
+        assert not pool.submit(frame, tmp_path / '2.raw')
+    finally:
+        release.set()
+        pool.close()
+    assert not (tmp_path / 'first_spill.raw').exists()
+    assert (tmp_path / 'second_spill.raw').stat().st_size == frame.nbytes
+    assert pool.stats()['max_queue_depth'] == 1
@@ -0,0 +1,33 @@
+import sys
+import threading
+import pytest
+import instrumentation
+
+
+@pytest.fixture
+def switch_often():
+    # make the interpreter switch threads far more often than usual, so a lost update would show
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    instrumentation.reset()
+    yield
+    sys.setswitchinterval(interval)
+    instrumentation.reset()
+
+
+def test_concurrent_records_are_all_counted(switch_often):
+    num_threads, samples = 8, 5000
+
+    def hammer():
+        for i in range(samples):
+            instrumentation.record('write', 'camera', (i % 100 + 1) * 1e-4)
+
+    threads = [threading.Thread(target=hammer) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    summary = instrumentation.report()['camera']['write']
+    assert summary['count'] == num_threads * samples
+    assert summary['max_ms'] == pytest.approx(10.0)
+    assert summary['mean_ms'] == pytest.approx(5.05)
@@ -0,0 +1,41 @@
+import pytest
+import acquistion as cam_aq
+import stereo_snapshot
+from stereo_snapshot import StereoSnapshot
+
+
+def symbolic(cam, name, nodemap=None):
+    nodes = cam_aq.camera_nodes(cam)
+    node = nodes.enumeration(name, nodemap, writable=False) if nodemap else nodes.enumeration(name, writable=False)
+    return node.GetCurrentEntry().GetSymbolic()
+
+
+def assert_disarmed(cams):
+    for cam in cams:
+        assert not cam.IsStreaming()
+        assert symbolic(cam, 'TriggerMode') == 'Off'
+        assert symbolic(cam, 'StreamBufferHandlingMode', cam_aq.STREAM_NODEMAP) == 'NewestOnly'
+
+
+def test_arm_and_close(cams):
+    with StereoSnapshot.arm(cams) as snapshot:
+        assert all(symbolic(cam, 'TriggerMode') == 'On' for cam in cams)
+        assert snapshot.capture() is not None
+    assert_disarmed(cams)
+
+
+def test_arm_rolls_back_when_a_trigger_cannot_be_configured(cams, monkeypatch):
+    configure_trigger = cam_aq.configure_trigger
+    monkeypatch.setattr(cam_aq, 'configure_trigger',
+                        lambda cam, trigger=None: cam is not cams[-1] and configure_trigger(cam, trigger))
+    assert StereoSnapshot.arm(cams) is None
+    assert_disarmed(cams)
+
+
+def test_arm_rolls_back_when_the_dispatcher_cannot_be_built(cams, monkeypatch):
+    def from_nodes(nodes_list, labels=None, clock_offsets=None):
+        raise RuntimeError('no trigger threads')
+    monkeypatch.setattr(stereo_snapshot.TriggerDispatcher, 'from_nodes', from_nodes)
+    with pytest.raises(RuntimeError):
+        StereoSnapshot.arm(cams)
+    assert_disarmed(cams)
@@ -0,0 +1,38 @@
+import threading
+import time
+from trigger_dispatch import TriggerDispatcher
+
+
+class RecordingHandle:
+    """Trigger handle that records when ``Execute`` is called."""
+
+    def __init__(self):
+        self.calls = []
+
+    def Execute(self):
+        self.calls.append(time.perf_counter_ns())
+
+
+def test_every_handle_fires_once_per_fire():
+    handles = [RecordingHandle() for _ in range(3)]
+    num_triggers = 20
+    with TriggerDispatcher(handles, clock_offsets=[0, 1000, -1000]) as dispatcher:
+        for n in range(num_triggers):
+            assert dispatcher.fire()
+            assert [len(handle.calls) for handle in handles] == [n + 1] * len(handles)
+            # the device timestamp of each camera's frame is its call time on that camera's clock
+            for i, (handle, offset) in enumerate(zip(handles, dispatcher.clock_offsets)):
+                dispatcher.record_device_timestamp(n, i, handle.calls[-1] + offset)
+    assert len(dispatcher.host_skews) == num_triggers and len(dispatcher.device_skews) == num_triggers
+    assert all(skew >= 0 for skew in dispatcher.host_skews + dispatcher.device_skews)
+    assert not any(thread.name.startswith('trigger-') for thread in threading.enumerate())
+
+
+def test_failed_execute_is_reported():
+    class FailingHandle:
+        def Execute(self):
+            raise RuntimeError('camera gone')
+
+    with TriggerDispatcher([RecordingHandle(), FailingHandle()]) as dispatcher:
+        assert not dispatcher.fire()
+        assert dispatcher.report()['device'] == {'count': 0}
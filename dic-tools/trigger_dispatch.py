@@ -0,0 +1,194 @@
+"""
+Near-simultaneous software trigger fan-out.
+
+Every camera's ``TriggerSoftware`` command handle is resolved before the first trigger and owned by a dedicated
+thread. ``fire`` releases all of those threads through a shared barrier so the ``Execute`` calls overlap instead of
+queueing one after another behind each camera's round trip. The dispatcher records the skew it achieves, both as
+the spread of host-side call times and from the device timestamps of the resulting frames, which latched clock
+offsets map onto the host clock.
+
+Run this module directly to compare the skew with the sequential loop using simulated cameras.
+"""
+import threading
+import time
+import numpy as np
+from loguru import logger
+import instrumentation
+
+
+def skew_summary(skews_ns):
+    """
+    :return: Count, mean, median, p95 and maximum of a list of skews, in microseconds.
+    :rtype: dict
+    """
+    if not len(skews_ns):
+        return {'count': 0}
+    skews_us = np.asarray(skews_ns, dtype=np.float64) / 1000
+    return {'count': len(skews_us), 'mean_us': float(skews_us.mean()), 'p50_us': float(np.percentile(skews_us, 50)),
+            'p95_us': float(np.percentile(skews_us, 95)), 'max_us': float(skews_us.max())}
+
+
+class TriggerDispatcher:
+    """
+    Fires pre-armed trigger command handles from one thread per camera, released together by a barrier.
+
+    :param trigger_handles: One object per camera with an ``Execute()`` method, e.g. a ``CCommandPtr``.
+    :type trigger_handles: list
+    :param labels: Camera labels the ``Execute`` latency is recorded under by ``instrumentation``. Defaults to the
+        camera indices.
+    :type labels: list or None
+    :param clock_offsets: Per-camera device minus host clock offsets in ns, from ``acquistion.latch_clock_offsets``,
+        for ``record_device_timestamp``.
+    :type clock_offsets: list or None
+    """
+
+    def __init__(self, trigger_handles, labels=None, clock_offsets=None):
+        self.trigger_handles = list(trigger_handles)
+        self.labels = list(labels) if labels is not None else list(range(len(self.trigger_handles)))
+        n_cameras = len(self.trigger_handles)
+        self.clock_offsets = list(clock_offsets) if clock_offsets is not None else [None] * n_cameras
+        self._release = threading.Barrier(n_cameras + 1)
+        self._finished = threading.Barrier(n_cameras + 1)
+        self._call_times = np.zeros(n_cameras, dtype=np.int64)
+        self._errors = [None] * n_cameras
+        self._stopping = False
+        self.host_skews = []
+        self.device_skews = []
+        self._device_timestamps = {}
+        self._lock = threading.Lock()
+        self._threads = [threading.Thread(target=self._run, args=(i,), name=f'trigger-{i}', daemon=True)
+                         for i in range(n_cameras)]
+        for thread in self._threads:
+            thread.start()
+
+    @classmethod
+    def from_nodes(cls, nodes_list, labels=None, clock_offsets=None):
+        """
+        Arms a dispatcher with the software trigger handle of each camera.
+
+        :param nodes_list: Node cache of each camera.
+        :type nodes_list: list of acquistion.CameraNodes
+        """
+        handles = [nodes.command('TriggerSoftware') for nodes in nodes_list]
+        if any(handle is None for handle in handles):
+            raise ValueError('Software trigger is not available on every camera')
+        return cls(handles, labels, clock_offsets)
+
+    def _run(self, i):
+        handle = self.trigger_handles[i]
+        label = self.labels[i]
+        while True:
+            self._release.wait()
+            if self._stopping:
+                return
+            self._call_times[i] = time.perf_counter_ns()
+            started = instrumentation.start()
+            try:
+                handle.Execute()
+                self._errors[i] = None
+            except Exception as ex:
+                self._errors[i] = ex
+            instrumentation.stop('trigger', label, started)
+            self._finished.wait()
+
+    def fire(self):
+        """
+        Triggers every camera at once and waits for all ``Execute`` calls to return.
+
+        :return: True if every camera was triggered, False otherwise.
+        :rtype: bool
+        """
+        self._release.wait()
+        self._finished.wait()
+        self.host_skews.append(int(self._call_times.max() - self._call_times.min()))
+        for i, error in enumerate(self._errors):
+            if error is not None:
+                logger.error('Camera %d trigger error: %s' % (i, error))
+        return all(error is None for error in self._errors)
+
+    def record_device_timestamp(self, trigger_number, camera_index, timestamp):
+        """
+        Records the device timestamp of the frame a trigger produced on one camera.
+
+        Camera clocks are not synchronized, so each timestamp is mapped onto the host clock with the camera's clock
+        offset; the skew of a trigger is the spread of those host times across cameras. Nothing is recorded unless
+        every camera has an offset: referencing a camera to its own first frame instead would hide a constant skew.
+        """
+        if None in self.clock_offsets:
+            return
+        with self._lock:
+            stamps = self._device_timestamps.setdefault(trigger_number, {})
+            stamps[camera_index] = timestamp - self.clock_offsets[camera_index]
+            if len(stamps) == len(self.trigger_handles):
+                del self._device_timestamps[trigger_number]
+                self.device_skews.append(int(max(stamps.values()) - min(stamps.values())))
+
+    def report(self):
+        """
+        Logs and returns the skew distributions.
+
+        :return: ``{'host': summary, 'device': summary}`` as produced by ``skew_summary``.
+        :rtype: dict
+        """
+        report = {'host': skew_summary(self.host_skews), 'device': skew_summary(self.device_skews)}
+        logger.info(f'Trigger skew: {report}')
+        return report
+
+    def close(self):
+        self._stopping = True
+        self._release.wait()
+        for thread in self._threads:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def benchmark(num_cameras=2, num_triggers=200, execute_time=0.0005):
+    """
+    Compares the skew of triggering simulated cameras in a loop with the dispatcher. The skew of a trigger is the
+    spread of its frames' device timestamps, mapped onto the host clock with latched clock offsets.
+
+    :param execute_time: Simulated round trip of one ``Execute`` call, in seconds.
+    :return: ``(sequential summary, dispatcher summary)``
+    """
+    import simulated_pyspin
+    cams = simulated_pyspin.open_cameras(num_cameras, command_time=execute_time)
+    import acquistion as cam_aq  # after the simulation is installed, so that it imports the simulated PySpin
+    for cam in cams:
+        cam_aq.configure_trigger(cam, cam_aq.triggers.software)
+    offsets = cam_aq.latch_clock_offsets(cams)
+
+    def measure(fire):
+        for cam in cams:
+            cam.BeginAcquisition()
+        for _ in range(num_triggers):
+            fire()
+        timestamps = []
+        for cam, offset in zip(cams, offsets):
+            stamps = []
+            for _ in range(num_triggers):
+                image_result = cam.GetNextImage(1000)
+                stamps.append(image_result.GetTimeStamp() - offset)
+                image_result.Release()
+            timestamps.append(stamps)
+            cam.EndAcquisition()
+        return skew_summary([max(stamps) - min(stamps) for stamps in zip(*timestamps)])
+
+    handles = [cam.TriggerSoftware for cam in cams]
+    sequential = measure(lambda: [handle.Execute() for handle in handles])
+    with TriggerDispatcher(handles) as dispatcher:
+        dispatched = measure(dispatcher.fire)
+    for cam in cams:
+        cam_aq.reset_trigger(cam_aq.camera_nodes(cam))
+        cam.DeInit()
+    logger.info(f'Sequential trigger skew: {sequential}')
+    logger.info(f'Dispatched trigger skew: {dispatched}')
+    return sequential, dispatched
+
+
+if __name__ == '__main__':
+    benchmark()